@@ -0,0 +1,162 @@
+# Audio delivery - 本地音频文件的HTTP分发
+# 支持 Range 分段请求（206，移动端Safari拖动进度和断点续播需要）、ETag/Last-Modified 条件请求（304），
+# 所有文件都允许缓存但每次用ETag重新验证；ASGI服务器支持 zerocopysend 扩展时用 sendfile 零拷贝发送
+
+import os
+import re
+import stat
+from email.utils import formatdate, parsedate_to_datetime
+from pathlib import Path
+from typing import Optional, Tuple
+
+import anyio
+from starlette.datastructures import Headers
+from starlette.responses import Response
+from starlette.types import Receive, Scope, Send
+
+AUDIO_MEDIA_TYPES = {
+    ".mp3": "audio/mpeg",
+    ".opus": "audio/ogg",  # Ogg封装的Opus
+    ".m4a": "audio/mp4"    # AAC
+}
+
+# 音频文件名都不是由音频内容推导的（rec_ 是随机分享ID，tts_ 不含实际使用的TTS服务和声音，
+# discovery_ 由书名/作者/等级生成而内容来自LLM，画廊音频按固定文件名重新生成），同一个URL的内容可能变化，
+# 所以不使用 immutable 长期缓存：允许缓存，但每次用ETag重新验证（未变化时只返回304）
+REVALIDATE_CACHE_CONTROL = "public, no-cache"
+
+_RANGE_RE = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+
+def file_etag(stat_result: os.stat_result) -> str:
+    return f'"{stat_result.st_mtime_ns:x}-{stat_result.st_size:x}"'
+
+
+def parse_range(range_header: str, file_size: int) -> Optional[Tuple[int, int]]:
+    """解析单段 Range 头，返回 (起始, 结束) 闭区间；格式不支持时返回None（按完整文件响应）
+
+    范围无法满足时抛出 ValueError。
+    """
+    match = _RANGE_RE.match(range_header.strip())
+    if not match:
+        return None  # 多段范围等不支持的格式
+
+    start, end = match.groups()
+    if not start and not end:
+        return None
+    if not start:
+        # bytes=-500 表示最后500字节
+        length = int(end)
+        if length == 0:
+            raise ValueError("empty suffix range")
+        return max(0, file_size - length), file_size - 1
+
+    start = int(start)
+    end = min(int(end), file_size - 1) if end else file_size - 1
+    if start >= file_size or start > end:
+        raise ValueError("range not satisfiable")
+    return start, end
+
+
+class AudioFileResponse(Response):
+    """发送文件的一段（或完整文件）"""
+
+    chunk_size = 64 * 1024
+
+    def __init__(self, path: Path, start: int, end: int, status_code: int, headers: dict,
+                 media_type: str, send_body: bool = True):
+        super().__init__(status_code=status_code, headers=headers, media_type=media_type)
+        self.path = path
+        self.start = start
+        self.count = end - start + 1
+        self.send_body = send_body
+        self.headers["content-length"] = str(self.count)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+        if not self.send_body or self.count <= 0:
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+            return
+
+        if "http.response.zerocopysend" in scope.get("extensions", {}):
+            # 服务器支持时交给内核 sendfile，不经过用户态缓冲
+            with open(self.path, "rb") as f:
+                await send({
+                    "type": "http.response.zerocopysend",
+                    "file": f,
+                    "offset": self.start,
+                    "count": self.count,
+                    "more_body": False
+                })
+            return
+
+        async with await anyio.open_file(self.path, mode="rb") as f:
+            await f.seek(self.start)
+            remaining = self.count
+            while remaining > 0:
+                chunk = await f.read(min(self.chunk_size, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                await send({"type": "http.response.body", "body": chunk, "more_body": remaining > 0})
+        if remaining > 0:
+            # 文件在发送过程中被截断
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+
+
+def _not_modified(request_headers: Headers, etag: str, stat_result: os.stat_result) -> bool:
+    if_none_match = request_headers.get("if-none-match")
+    if if_none_match is not None:
+        tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+        return "*" in tags or etag in tags
+
+    if_modified_since = request_headers.get("if-modified-since")
+    if if_modified_since:
+        try:
+            return int(stat_result.st_mtime) <= parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
+def _range_allowed(request_headers: Headers, etag: str, last_modified: str) -> bool:
+    """If-Range 与当前文件不一致时忽略 Range，返回完整文件"""
+    if_range = request_headers.get("if-range")
+    return if_range is None or if_range.strip() in (etag, last_modified)
+
+
+def audio_file_response(path: Path, request_headers: Headers, method: str = "GET",
+                        cache_control: Optional[str] = None) -> Response:
+    """按请求头返回 200 / 206 / 304 / 416 响应；cache_control 可覆盖默认的重新验证缓存策略"""
+    stat_result = path.stat()
+    if not stat.S_ISREG(stat_result.st_mode):
+        raise FileNotFoundError(path)
+
+    file_size = stat_result.st_size
+    etag = file_etag(stat_result)
+    last_modified = formatdate(stat_result.st_mtime, usegmt=True)
+    headers = {
+        "accept-ranges": "bytes",
+        "etag": etag,
+        "last-modified": last_modified,
+        "cache-control": cache_control or REVALIDATE_CACHE_CONTROL,
+        "access-control-expose-headers": "Accept-Ranges, Content-Length, Content-Range, ETag"
+    }
+    media_type = AUDIO_MEDIA_TYPES.get(path.suffix, "application/octet-stream")
+
+    if _not_modified(request_headers, etag, stat_result):
+        return Response(status_code=304, headers=headers)
+
+    range_header = request_headers.get("range")
+    if range_header and file_size and _range_allowed(request_headers, etag, last_modified):
+        try:
+            byte_range = parse_range(range_header, file_size)
+        except ValueError:
+            headers["content-range"] = f"bytes */{file_size}"
+            return Response(status_code=416, headers=headers)
+        if byte_range:
+            start, end = byte_range
+            headers["content-range"] = f"bytes {start}-{end}/{file_size}"
+            return AudioFileResponse(path, start, end, 206, headers, media_type, method != "HEAD")
+
+    return AudioFileResponse(path, 0, file_size - 1, 200, headers, media_type, method != "HEAD")
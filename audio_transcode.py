@@ -0,0 +1,142 @@
+# Audio transcoding - TTS合成后生成体积更小的 Opus/AAC 单声道版本
+# Azure输出固定为160kbps MP3，对短语音片段和国内移动网络来说偏大；
+# 变体文件与原始MP3放在同一目录（rec_xxx.mp3 -> rec_xxx.opus / rec_xxx.m4a），各自有独立的URL，每个片段只转码一次
+# 需要系统安装 ffmpeg（带 libopus），不可用时只提供MP3
+
+import os
+import shutil
+import subprocess
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Optional
+
+FFMPEG_PATH = os.getenv("FFMPEG_PATH") or shutil.which("ffmpeg")
+FFMPEG_AVAILABLE = bool(FFMPEG_PATH)
+
+# 合成后是否自动生成变体
+AUDIO_TRANSCODE_ENABLED = os.getenv("AUDIO_TRANSCODE_ENABLED", "true").lower() == "true"
+AUDIO_TRANSCODE_WORKERS = int(os.getenv("AUDIO_TRANSCODE_WORKERS", "2"))
+AUDIO_TRANSCODE_TIMEOUT = 120
+
+# 码率档位：语音内容单声道32-48kbps即可
+TRANSCODE_PROFILES = {
+    "opus": {
+        "suffix": ".opus",
+        "media_type": "audio/ogg",
+        "args": ["-c:a", "libopus", "-b:a", os.getenv("AUDIO_OPUS_BITRATE", "32k"), "-application", "voip", "-f", "ogg"]
+    },
+    "aac": {
+        "suffix": ".m4a",
+        "media_type": "audio/mp4",
+        "args": ["-c:a", "aac", "-b:a", os.getenv("AUDIO_AAC_BITRATE", "48k"), "-movflags", "+faststart", "-f", "mp4"]
+    }
+}
+
+# Accept 头中的媒体类型 -> 格式；同等权重时优先体积更小的格式
+ACCEPT_FORMATS = {
+    "audio/ogg": "opus",
+    "audio/opus": "opus",
+    "audio/webm": "opus",
+    "audio/mp4": "aac",
+    "audio/aac": "aac",
+    "audio/x-m4a": "aac",
+    "audio/mpeg": "mp3"
+}
+FORMAT_PREFERENCE = ["opus", "aac", "mp3"]
+
+_executor = ThreadPoolExecutor(max_workers=AUDIO_TRANSCODE_WORKERS, thread_name_prefix="audio-transcode")
+_locks = {}
+_locks_guard = threading.Lock()
+_pending = set()  # 已提交、尚未完成的 (目标文件, 格式)，避免重复请求反复排队
+
+
+def variant_path(source: Path, fmt: str) -> Path:
+    return source.with_suffix(TRANSCODE_PROFILES[fmt]["suffix"])
+
+
+def negotiate_format(accept: Optional[str], requested: Optional[str] = None) -> str:
+    """选择音频格式：查询参数优先，其次按 Accept 头的q值；通配符（audio/*、*/*）不触发转码，返回mp3"""
+    if requested:
+        requested = requested.lower()
+        return requested if requested in TRANSCODE_PROFILES else "mp3"
+
+    best_format, best_q = "mp3", 0.0
+    for item in (accept or "").split(","):
+        parts = [part.strip() for part in item.split(";")]
+        fmt = ACCEPT_FORMATS.get(parts[0].lower())
+        if not fmt:
+            continue
+        q = 1.0
+        for param in parts[1:]:
+            if param.startswith("q="):
+                try:
+                    q = float(param[2:])
+                except ValueError:
+                    q = 0.0
+        if q > best_q or (q == best_q and FORMAT_PREFERENCE.index(fmt) < FORMAT_PREFERENCE.index(best_format)):
+            best_format, best_q = fmt, q
+    return best_format if best_q > 0 else "mp3"
+
+
+def _lock_for(path: Path) -> threading.Lock:
+    with _locks_guard:
+        return _locks.setdefault(str(path), threading.Lock())
+
+
+def transcode(source: Path, fmt: str) -> Optional[Path]:
+    """生成（或复用已有的）变体文件；ffmpeg不可用或转码失败时返回None"""
+    if not FFMPEG_AVAILABLE or fmt not in TRANSCODE_PROFILES or not source.exists():
+        return None
+
+    target = variant_path(source, fmt)
+    with _lock_for(target):
+        # 变体比原始文件新才复用（原始音频重新合成后需要重新转码）
+        if target.exists() and target.stat().st_mtime >= source.stat().st_mtime:
+            return target
+
+        part_path = target.with_name(f"{target.name}.{uuid.uuid4().hex[:8]}.part")
+        command = [FFMPEG_PATH, "-hide_banner", "-loglevel", "error", "-y", "-i", str(source),
+                   "-vn", "-ac", "1", *TRANSCODE_PROFILES[fmt]["args"], str(part_path)]
+        try:
+            subprocess.run(command, check=True, capture_output=True, timeout=AUDIO_TRANSCODE_TIMEOUT)
+            os.replace(part_path, target)
+        except (subprocess.SubprocessError, OSError) as e:
+            stderr = getattr(e, "stderr", b"") or b""
+            print(f"音频转码失败 {source.name} -> {fmt}: {str(e)} {stderr.decode(errors='ignore').strip()}")
+            if part_path.exists():
+                part_path.unlink()
+            return None
+
+    print(f"🎚️  已生成 {fmt} 版本: {target.name} ({target.stat().st_size // 1024}KB, 原始 {source.stat().st_size // 1024}KB)")
+    return target
+
+
+def ready_variant(source: Path, fmt: str) -> Optional[Path]:
+    """已经转码好的变体（不触发转码）"""
+    if fmt not in TRANSCODE_PROFILES:
+        return None
+    target = variant_path(source, fmt)
+    if target.exists() and source.exists() and target.stat().st_mtime >= source.stat().st_mtime:
+        return target
+    return None
+
+
+def schedule_variants(source: Path, formats=None):
+    """合成完成后在后台生成各格式变体"""
+    if not (FFMPEG_AVAILABLE and AUDIO_TRANSCODE_ENABLED):
+        return
+    for fmt in formats or TRANSCODE_PROFILES:
+        key = (str(variant_path(source, fmt)), fmt)
+        with _locks_guard:
+            if key in _pending:
+                continue
+            _pending.add(key)
+        future = _executor.submit(transcode, source, fmt)
+        future.add_done_callback(lambda _, key=key: _discard_pending(key))
+
+
+def _discard_pending(key):
+    with _locks_guard:
+        _pending.discard(key)
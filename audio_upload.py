@@ -0,0 +1,360 @@
+# Audio upload pipeline - 音频先写本地并立即返回，后台上传到Cloudinary
+# 上传失败按指数退避重试，成功后通过回调把已存储的本地URL切换为CDN URL
+# TTS响应可以边下载边上传（ChunkPipe），不需要在内存中保存完整音频，也不需要从磁盘再读一遍
+
+import os
+import queue
+import random
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Iterable, Optional, Tuple
+
+import cloudinary
+import cloudinary.uploader
+import cloudinary.utils
+import requests
+
+CLOUDINARY_FOLDER = "shh-elf-audio"
+AUDIO_UPLOAD_WORKERS = int(os.getenv("AUDIO_UPLOAD_WORKERS", "2"))
+AUDIO_UPLOAD_MAX_RETRIES = int(os.getenv("AUDIO_UPLOAD_MAX_RETRIES", "4"))
+AUDIO_UPLOAD_BACKOFF_SECONDS = float(os.getenv("AUDIO_UPLOAD_BACKOFF_SECONDS", "1.0"))
+
+# 同时进行的流式上传数（与TTS请求同步进行，不与重试任务共用线程）
+AUDIO_STREAM_UPLOAD_WORKERS = int(os.getenv("AUDIO_STREAM_UPLOAD_WORKERS", "8"))
+
+# 没有本地缓存时写入端为流式上传累计等待的上限（秒），超过后放弃流式上传，改为从缓冲的完整音频上传
+AUDIO_STREAM_PUT_TIMEOUT = float(os.getenv("AUDIO_STREAM_PUT_TIMEOUT", "20"))
+# 上述缓冲在内存中保存的上限，超过后写入临时文件
+AUDIO_STREAM_SPOOL_MEMORY = 1024 * 1024
+
+# 流式上传的连接/读取超时（秒）
+STREAM_UPLOAD_TIMEOUT = (10, 120)
+
+# 检查CDN上音频是否存在的HEAD请求超时（秒）
+HEAD_CHECK_TIMEOUT = (3, 5)
+
+
+def cloudinary_configured() -> bool:
+    config = cloudinary.config()
+    return bool(config.cloud_name and config.api_key and config.api_secret)
+
+
+def cloudinary_audio_url(public_id: str) -> Optional[str]:
+    """按上传时使用的 public_id 推算CDN地址（不含版本号），用于检查音频是否已经上传过"""
+    if not cloudinary_configured():
+        return None
+    url, _ = cloudinary.utils.cloudinary_url(
+        f"{CLOUDINARY_FOLDER}/{public_id}", resource_type="video", format="mp3", secure=True
+    )
+    return url
+
+
+def audio_url_available(url: str) -> bool:
+    """HEAD请求确认CDN上的音频仍然存在"""
+    try:
+        response = requests.head(url, timeout=HEAD_CHECK_TIMEOUT, allow_redirects=True)
+        return response.status_code == 200
+    except requests.RequestException as e:
+        print(f"音频地址检查失败 {url}: {str(e)}")
+        return False
+
+
+def upload_to_cloudinary(local_path: str, public_id: str) -> str:
+    """上传音频文件到Cloudinary并返回URL（失败时抛出异常，由上传队列负责重试）"""
+    print(f"上传文件到Cloudinary: {local_path} -> {public_id}")
+
+    response = cloudinary.uploader.upload(
+        local_path,
+        public_id=public_id,
+        resource_type="video",  # 用于音频文件
+        folder=CLOUDINARY_FOLDER,  # 组织文件的文件夹
+        overwrite=True
+    )
+
+    cloudinary_url = response['secure_url']
+    print(f"Cloudinary URL: {cloudinary_url}")
+    return cloudinary_url
+
+
+def stream_upload_to_cloudinary(chunks: Iterable[bytes], public_id: str) -> str:
+    """以分块传输的multipart请求把音频流直接上传到Cloudinary，边读边发，不缓存完整文件"""
+    options = {
+        "public_id": public_id,
+        "resource_type": "video",
+        "folder": CLOUDINARY_FOLDER,
+        "overwrite": True
+    }
+    params = cloudinary.utils.sign_request(cloudinary.utils.build_upload_params(**options), options)
+    upload_url = cloudinary.utils.cloudinary_api_url("upload", **options)
+    boundary = uuid.uuid4().hex
+
+    def body():
+        for name, value in params.items():
+            if value is None or value == "":
+                continue
+            yield (f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n'
+                   f'{value}\r\n').encode("utf-8")
+        yield (f'--{boundary}\r\nContent-Disposition: form-data; name="file"; filename="{public_id}.mp3"\r\n'
+               f'Content-Type: audio/mpeg\r\n\r\n').encode("utf-8")
+        yield from chunks
+        yield f"\r\n--{boundary}--\r\n".encode("utf-8")
+
+    print(f"流式上传到Cloudinary: {public_id}")
+    response = requests.post(
+        upload_url,
+        data=body(),
+        headers={"Content-Type": f"multipart/form-data; boundary={boundary}"},
+        timeout=STREAM_UPLOAD_TIMEOUT
+    )
+    response.raise_for_status()
+
+    cloudinary_url = response.json()["secure_url"]
+    print(f"Cloudinary URL: {cloudinary_url}")
+    return cloudinary_url
+
+
+class ChunkPipe:
+    """有界的块管道：TTS响应线程写入，上传线程按块读取；上传端已结束（成功或失败）时写入端直接丢弃数据
+
+    block=True 时队列满了写入端会等待（背压），用于没有本地文件、流式上传是唯一副本的情况；
+    此时数据同时写入缓冲（SpooledTemporaryFile），写入端累计等待超过 put_timeout 后标记溢出、不再等待，
+    上传端放弃流式上传，等写入完成后从缓冲上传；
+    block=False 时写入端从不等待，上传跟不上（Cloudinary慢或上传线程都在忙）时标记溢出，
+    上传端放弃这次流式上传，改为从本地文件上传，上传速度不会拖慢TTS响应和浏览器端的流式播放。
+    """
+
+    _END = object()
+
+    def __init__(self, max_chunks: int = 32, block: bool = True, put_timeout: float = AUDIO_STREAM_PUT_TIMEOUT):
+        self._queue = queue.Queue(maxsize=max_chunks)
+        self._block = block
+        self._put_timeout = put_timeout
+        self._blocked_seconds = 0.0
+        self._spool = tempfile.SpooledTemporaryFile(max_size=AUDIO_STREAM_SPOOL_MEMORY) if block else None
+        self._closed = threading.Event()
+        self.consumer_done = threading.Event()
+        self.overflowed = False
+        self.error = None
+
+    def _put(self, item) -> bool:
+        if self.overflowed or self.consumer_done.is_set():
+            return False
+        if not self._block:
+            try:
+                self._queue.put_nowait(item)
+                return True
+            except queue.Full:
+                self.overflowed = True
+                return False
+        started = time.monotonic()
+        try:
+            while not self.consumer_done.is_set():
+                remaining = self._put_timeout - self._blocked_seconds - (time.monotonic() - started)
+                if remaining <= 0:
+                    # 上传长时间跟不上：不再等待，剩余数据只写入缓冲
+                    self.overflowed = True
+                    return False
+                try:
+                    self._queue.put(item, timeout=min(0.5, remaining))
+                    return True
+                except queue.Full:
+                    continue
+            return False
+        finally:
+            self._blocked_seconds += time.monotonic() - started
+
+    def write(self, chunk: bytes):
+        if self._spool:
+            self._spool.write(chunk)
+        self._put(chunk)
+
+    def close(self):
+        """写入完成"""
+        self._closed.set()
+        self._put(self._END)
+
+    def abort(self, error: Exception):
+        """写入端出错（例如TTS流中断），让上传端放弃这次上传"""
+        self.error = error
+        self.close()
+
+    def wait_closed(self, timeout: Optional[float] = None) -> bool:
+        return self._closed.wait(timeout)
+
+    def save_spool(self) -> Optional[str]:
+        """写入完成后把缓冲的完整音频保存为临时文件，返回路径（非阻塞模式没有缓冲，返回None）"""
+        if not self._spool:
+            return None
+        fd, path = tempfile.mkstemp(suffix=".mp3")
+        with os.fdopen(fd, "wb") as f:
+            self._spool.seek(0)
+            while True:
+                data = self._spool.read(64 * 1024)
+                if not data:
+                    break
+                f.write(data)
+        return path
+
+    def release_spool(self):
+        if self._spool:
+            self._spool.close()
+            self._spool = None
+
+    def __iter__(self):
+        while True:
+            if self.overflowed:
+                raise IOError("流式上传跟不上音频数据，改为写入完成后从文件上传")
+            try:
+                chunk = self._queue.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            if chunk is self._END:
+                if self.error is not None:
+                    raise IOError(f"音频流中断: {self.error}")
+                return
+            yield chunk
+
+
+class AudioUploadQueue:
+    """后台上传队列：线程池执行上传，失败按指数退避重试，完成后通知回调"""
+
+    def __init__(self, max_workers: int = AUDIO_UPLOAD_WORKERS):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="audio-upload")
+        self._stream_executor = ThreadPoolExecutor(
+            max_workers=AUDIO_STREAM_UPLOAD_WORKERS, thread_name_prefix="audio-stream-upload"
+        )
+        self._lock = threading.Lock()
+        self._callbacks = []
+        self.pending = {}   # 本地路径 -> public_id
+        self.uploaded = {}  # 本地路径 -> CDN URL
+        self.failed = {}    # 本地路径 -> 最后一次错误
+
+    def on_uploaded(self, callback: Callable[[str, str], None]) -> Callable[[str, str], None]:
+        """注册上传完成回调 callback(local_path, cdn_url)，可作装饰器使用"""
+        self._callbacks.append(callback)
+        return callback
+
+    def submit(self, local_path: str, public_id: str) -> bool:
+        """提交后台上传；Cloudinary未配置或同一文件已在队列中时跳过"""
+        if not cloudinary_configured():
+            return False
+
+        with self._lock:
+            if local_path in self.pending:
+                return False
+            self.pending[local_path] = public_id
+            self.uploaded.pop(local_path, None)
+            self.failed.pop(local_path, None)
+
+        self._executor.submit(self._run, local_path, public_id)
+        return True
+
+    def submit_stream(self, local_path: Optional[str], public_id: str) -> Tuple[Optional[ChunkPipe], Optional[Future]]:
+        """开始一次流式上传，返回 (写入管道, 结果Future)；Cloudinary未配置时返回 (None, None)
+
+        local_path 为本地缓存文件路径（可为None）。流式上传失败或跟不上时，如果本地缓存存在，
+        会等写入完成后改为从本地文件按退避策略上传；有本地缓存时写入端不会因上传而等待。
+        没有本地缓存时写入端最多累计等待 AUDIO_STREAM_PUT_TIMEOUT 秒，之后改为从管道缓冲的完整音频上传。
+        """
+        if not cloudinary_configured():
+            return None, None
+
+        key = local_path or public_id
+        with self._lock:
+            self.pending[key] = public_id
+            self.uploaded.pop(key, None)
+            self.failed.pop(key, None)
+
+        pipe = ChunkPipe(block=local_path is None)
+        future = self._stream_executor.submit(self._run_stream, pipe, local_path, public_id)
+        return pipe, future
+
+    def resolve(self, local_path: str) -> str:
+        """已上传则返回CDN URL，否则返回原本地路径"""
+        return self.uploaded.get(local_path, local_path)
+
+    def cdn_url(self, local_path: str) -> Optional[str]:
+        return self.uploaded.get(local_path)
+
+    def status(self) -> dict:
+        with self._lock:
+            return {
+                "pending": len(self.pending),
+                "uploaded": len(self.uploaded),
+                "failed": len(self.failed)
+            }
+
+    def _run_stream(self, pipe: ChunkPipe, local_path: Optional[str], public_id: str) -> Optional[str]:
+        key = local_path or public_id
+        try:
+            cloudinary_url = stream_upload_to_cloudinary(pipe, public_id)
+        except Exception as e:
+            print(f"Cloudinary流式上传错误: {str(e)}")
+            pipe.consumer_done.set()
+            pipe.wait_closed()
+            with self._lock:
+                self.pending.pop(key, None)
+            if pipe.error is None and local_path and os.path.exists(local_path):
+                # 本地缓存已完整写入，交给重试队列从文件上传
+                print(f"改为从本地缓存重试上传: {local_path}")
+                self.submit(local_path, public_id)
+                return None
+            spool_path = pipe.save_spool() if pipe.error is None else None
+            if spool_path:
+                # 没有本地缓存：从缓冲的完整音频上传（调用方在等待结果，直接在本线程按退避策略重试）
+                print(f"改为从缓冲的完整音频上传: {public_id}")
+                with self._lock:
+                    self.pending[key] = public_id
+                try:
+                    cloudinary_url = self._run(spool_path, public_id, key)
+                finally:
+                    os.remove(spool_path)
+                if cloudinary_url is None:
+                    raise
+                return cloudinary_url
+            with self._lock:
+                self.failed[key] = str(e)
+            raise
+        finally:
+            pipe.consumer_done.set()
+            pipe.release_spool()
+
+        self._finish(key, cloudinary_url)
+        return cloudinary_url
+
+    def _run(self, local_path: str, public_id: str, key: Optional[str] = None) -> Optional[str]:
+        """按退避策略从文件上传；key 为记录状态用的键（默认是文件路径）"""
+        key = key or local_path
+        cloudinary_url = None
+        for attempt in range(AUDIO_UPLOAD_MAX_RETRIES + 1):
+            try:
+                cloudinary_url = upload_to_cloudinary(local_path, public_id)
+                break
+            except Exception as e:
+                if attempt == AUDIO_UPLOAD_MAX_RETRIES:
+                    print(f"Cloudinary上传最终失败: {local_path}: {str(e)}")
+                    with self._lock:
+                        self.pending.pop(key, None)
+                        self.failed[key] = str(e)
+                    return None
+                # 指数退避 + 随机抖动，避免多个任务同时重试
+                delay = AUDIO_UPLOAD_BACKOFF_SECONDS * (2 ** attempt) * random.uniform(0.5, 1.0)
+                print(f"Cloudinary上传错误（第{attempt + 1}次）: {str(e)}，{delay:.1f}秒后重试")
+                time.sleep(delay)
+
+        self._finish(key, cloudinary_url)
+        return cloudinary_url
+
+    def _finish(self, local_path: str, cloudinary_url: str):
+        with self._lock:
+            self.pending.pop(local_path, None)
+            self.uploaded[local_path] = cloudinary_url
+
+        for callback in self._callbacks:
+            try:
+                callback(local_path, cloudinary_url)
+            except Exception as e:
+                print(f"上传回调失败: {str(e)}")
@@ -0,0 +1,193 @@
+# Local book catalog - fuzzy matching of OCR fragments to canonical titles
+# 中英文书名的 n-gram 倒排索引 + 编辑距离打分，命中的书名无需再交给 LLM 识别
+
+import csv
+import json
+import os
+import re
+import unicodedata
+from collections import defaultdict
+from typing import List, Optional, Tuple
+
+from sqlalchemy.orm import Session
+
+# OCR片段与书名相似度达到该值才视为命中
+CATALOG_MATCH_THRESHOLD = float(os.getenv("CATALOG_MATCH_THRESHOLD", "0.82"))
+
+# 可选的批量书目文件（CSV 或 JSONL，包含 title/author 字段）
+BOOK_CATALOG_PATH = os.getenv("BOOK_CATALOG_PATH")
+
+_PUNCTUATION_RE = re.compile(r"[^\w\s]|_")
+_CJK = "\u3400-\u9fff\uf900-\ufaff"
+_SCRIPT_RUN_RE = re.compile(f"[{_CJK}]+|[^\\s{_CJK}]+")
+
+
+def normalize_title(text: str) -> str:
+    """统一全半角、大小写并去掉标点（书名号等），用于索引和比较"""
+    text = unicodedata.normalize("NFKC", text or "").casefold()
+    text = _PUNCTUATION_RE.sub(" ", text)
+    return " ".join(text.split())
+
+
+def _is_cjk(run: str) -> bool:
+    return "\u3400" <= run[0] <= "\u9fff" or "\uf900" <= run[0] <= "\ufaff"
+
+
+def make_ngrams(normalized: str) -> set:
+    """中文按字二元组切分，英文按词内三元组切分（带边界填充）"""
+    grams = set()
+    for run in _SCRIPT_RUN_RE.findall(normalized):
+        if _is_cjk(run):
+            if len(run) == 1:
+                grams.add(run)
+            grams.update(run[i:i + 2] for i in range(len(run) - 1))
+        else:
+            padded = f" {run} "
+            grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return grams
+
+
+def edit_distance(a: str, b: str) -> int:
+    """Levenshtein编辑距离（两行滚动数组）"""
+    if len(a) < len(b):
+        a, b = b, a
+    previous = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        current = [i]
+        for j, cb in enumerate(b, 1):
+            current.append(min(
+                previous[j] + 1,
+                current[j - 1] + 1,
+                previous[j - 1] + (ca != cb)
+            ))
+        previous = current
+    return previous[-1]
+
+
+def similarity(a: str, b: str) -> float:
+    """基于编辑距离的相似度（0-1）"""
+    if not a or not b:
+        return 0.0
+    return 1 - edit_distance(a, b) / max(len(a), len(b))
+
+
+class BookCatalog:
+    """书名/作者的内存倒排索引"""
+
+    def __init__(self):
+        self.entries = []
+        self._keys = {}
+        self._index = defaultdict(list)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def add(self, title: str, author: str = "", source: str = "") -> bool:
+        """加入一本书，按规范化书名去重；已存在时补全缺失的作者"""
+        key = normalize_title(title)
+        if not key:
+            return False
+
+        if key in self._keys:
+            entry = self.entries[self._keys[key]]
+            if author and not entry["author"]:
+                entry["author"] = author
+            return False
+
+        entry_id = len(self.entries)
+        self.entries.append({"title": title.strip(), "author": (author or "").strip(), "source": source, "key": key})
+        self._keys[key] = entry_id
+        for gram in make_ngrams(key):
+            self._index[gram].append(entry_id)
+        return True
+
+    def search(self, fragment: str, limit: int = 3) -> List[Tuple[dict, float]]:
+        """模糊查找与OCR片段最接近的书籍，返回 (书目条目, 相似度) 列表"""
+        query = normalize_title(fragment)
+        grams = make_ngrams(query)
+        if not grams:
+            return []
+
+        # 倒排索引统计共享n-gram数，只对重叠度足够的候选计算编辑距离
+        overlap = defaultdict(int)
+        for gram in grams:
+            for entry_id in self._index.get(gram, ()):
+                overlap[entry_id] += 1
+
+        candidates = sorted(overlap.items(), key=lambda item: item[1], reverse=True)[:20]
+        scored = []
+        for entry_id, shared in candidates:
+            entry = self.entries[entry_id]
+            if 2 * shared / (len(grams) + len(make_ngrams(entry["key"]))) < 0.3:
+                continue
+            score = similarity(query, entry["key"])
+            if entry["author"]:
+                # 书脊上常常是"书名 作者"连在一起
+                score = max(score, similarity(query, normalize_title(f"{entry['title']} {entry['author']}")))
+            scored.append((entry, round(score, 3)))
+
+        scored.sort(key=lambda item: item[1], reverse=True)
+        return scored[:limit]
+
+    def resolve(self, ocr_text: str, threshold: float = CATALOG_MATCH_THRESHOLD) -> Tuple[List[dict], List[str]]:
+        """逐行匹配OCR文字：返回 (已确认书籍, 未能解析的行)"""
+        resolved = []
+        unresolved = []
+        seen = set()
+
+        for line in (ocr_text or "").splitlines():
+            line = line.strip()
+            if len(normalize_title(line)) < 2:
+                continue
+
+            matches = self.search(line, limit=1)
+            if matches and matches[0][1] >= threshold:
+                entry, score = matches[0]
+                if entry["key"] not in seen:
+                    seen.add(entry["key"])
+                    resolved.append({
+                        "title": entry["title"],
+                        "author": entry["author"] or "未知",
+                        "confidence": score,
+                        "source": "catalog"
+                    })
+            else:
+                unresolved.append(line)
+
+        return resolved, unresolved
+
+    def load_file(self, path: str) -> int:
+        """从CSV或JSONL书目文件批量导入，逐行读取"""
+        added = 0
+        with open(path, encoding="utf-8") as f:
+            if path.endswith(".csv"):
+                rows = csv.DictReader(f)
+            else:
+                rows = (json.loads(line) for line in f if line.strip())
+            for row in rows:
+                if self.add(row.get("title", ""), row.get("author", ""), source="file"):
+                    added += 1
+        return added
+
+    def load_from_db(self, db: Session) -> int:
+        """从画廊书籍和用户推荐历史中导入书名"""
+        from book_gallery import BookTalkGallery
+        from database import UserRecommendation
+
+        added = 0
+        for title, author in db.query(BookTalkGallery.title, BookTalkGallery.author):
+            if self.add(title, author, source="gallery"):
+                added += 1
+        for (title,) in db.query(UserRecommendation.book_title).distinct():
+            if self.add(title, source="recommendation"):
+                added += 1
+        return added
+
+
+def build_book_catalog(db: Session, catalog_path: Optional[str] = BOOK_CATALOG_PATH) -> BookCatalog:
+    """构建完整书目：数据库 + 可选的书目文件"""
+    catalog = BookCatalog()
+    catalog.load_from_db(db)
+    if catalog_path and os.path.exists(catalog_path):
+        catalog.load_file(catalog_path)
+    return catalog
@@ -18,7 +18,7 @@ class BookTalkGallery(Base):
     description = Column(Text)
 
     # For English learners
-    cefr_level = Column(String(10))  # A2, B1, B2, C1, C2
+    cefr_level = Column(String(10), index=True)  # A2, B1, B2, C1, C2
     estimated_vocabulary = Column(Integer)  # 3000, 5000, 8000, etc.
 
     # Joshua Landy's Formal Models
@@ -35,12 +35,28 @@ class BookTalkGallery(Base):
     book_talk_duration_seconds = Column(Integer)  # ~2-3 minutes
 
     # Metadata
-    genre = Column(String(100))
+    genre = Column(String(100), index=True)
     publication_year = Column(Integer)
     page_count = Column(Integer)
     goodreads_rating = Column(Float)
-    featured = Column(String(10), default='false')
+    featured = Column(String(10), default='false', index=True)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
+    # 任何修改都会更新；与行数一起作为画廊版本，用于判断缓存是否过期（包括其他进程的修改）
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+class GalleryAudioAsset(Base):
+    """画廊音频索引 - 持久记录已生成的音频地址，重启或换机器后无需重新合成"""
+    __tablename__ = "gallery_audio_assets"
+
+    id = Column(Integer, primary_key=True, index=True)
+    cache_key = Column(String(50), unique=True, index=True, nullable=False)  # sample_{isbn} / talk_{isbn}
+    isbn = Column(String(20), index=True, nullable=False)
+    audio_type = Column(String(10), nullable=False)  # sample / talk
+    audio_url = Column(String(500), nullable=False)  # Cloudinary URL，上传完成前为本地路径
+    duration_seconds = Column(Integer)  # 由MP3帧头计算
+    bitrate_kbps = Column(Integer)
+    sample_rate = Column(Integer)
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
 
 # Sample data structure for MVP
 SAMPLE_BOOKS = [
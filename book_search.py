@@ -0,0 +1,252 @@
+# Book search - 画廊和Discovery内容的全文检索
+# SQLite 使用 FTS5 虚拟表（bm25排序，带前缀索引），Postgres 使用 tsvector + GIN 索引（ts_rank排序）；
+# 两种数据库都不支持中文分词，这里预先切分：中文按单字+二元组、英文按词（normalize_title统一大小写和全半角），
+# 用空格连接后交给数据库按空白切分，查询时用同样的方式切分，最后一个词按前缀匹配（输入联想）
+
+import json
+import zlib
+from typing import List, Optional
+
+from sqlalchemy import select, text
+from sqlalchemy.engine import Engine
+
+from book_catalog import _SCRIPT_RUN_RE, _is_cjk, normalize_title
+
+SEARCH_TABLE = "book_search"
+SEARCH_MAX_LIMIT = 50
+SEARCH_RANK_MAX_CANDIDATES = 2000
+
+# 各字段权重：书名 > 作者 > 类型/formal models > 推荐文本
+SEARCH_WEIGHTS = {"title": 10.0, "author": 5.0, "genre": 2.0, "formal_models": 2.0, "body": 1.0}
+SEARCH_COLUMNS = list(SEARCH_WEIGHTS)
+
+# Discovery 文档的 doc_id 放在画廊书籍id之后的区间
+DISCOVERY_ID_OFFSET = 1 << 40
+
+
+def segment(value: str) -> str:
+    """把文本切分为空格分隔的词：中文连续字符输出单字和相邻二元组，其他文字按词输出"""
+    tokens = []
+    for run in _SCRIPT_RUN_RE.findall(normalize_title(value)):
+        if _is_cjk(run):
+            tokens.extend(run)
+            tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+        else:
+            tokens.append(run)
+    return " ".join(tokens)
+
+
+def query_terms(query: str) -> List[str]:
+    """查询切分：中文两个字以上用二元组（所有二元组都要命中），单字直接匹配"""
+    terms = []
+    for run in _SCRIPT_RUN_RE.findall(normalize_title(query)):
+        if _is_cjk(run) and len(run) > 1:
+            terms.extend(run[i:i + 2] for i in range(len(run) - 1))
+        else:
+            terms.append(run)
+    return list(dict.fromkeys(terms))
+
+
+def discovery_doc_id(analysis_id: str) -> int:
+    return DISCOVERY_ID_OFFSET + zlib.crc32(analysis_id.encode())
+
+
+class BookSearchIndex:
+    """全文索引：每个文档 = (doc_id, 来源, 引用, 展示字段JSON, 各检索字段)"""
+
+    def __init__(self, engine: Engine):
+        self.engine = engine
+        self.backend = None  # fts5 / tsvector；不支持时为None，搜索退回 LIKE 查询画廊表
+
+    def create(self):
+        """创建索引表（已存在时跳过）"""
+        dialect = self.engine.dialect.name
+        try:
+            with self.engine.begin() as conn:
+                if dialect == "sqlite":
+                    # prefix='2 3' 为2、3字符前缀建索引，输入联想的短前缀查询不需要扫描整个词表
+                    conn.execute(text(
+                        f"CREATE VIRTUAL TABLE IF NOT EXISTS {SEARCH_TABLE} USING fts5("
+                        "source UNINDEXED, ref UNINDEXED, payload UNINDEXED, "
+                        f"{', '.join(SEARCH_COLUMNS)}, "
+                        "tokenize='unicode61 remove_diacritics 2', prefix='2 3')"
+                    ))
+                    self.backend = "fts5"
+                elif dialect == "postgresql":
+                    conn.execute(text(
+                        f"CREATE TABLE IF NOT EXISTS {SEARCH_TABLE} ("
+                        "doc_id BIGINT PRIMARY KEY, source VARCHAR(20) NOT NULL, ref VARCHAR(50) NOT NULL, "
+                        "payload TEXT NOT NULL, document TSVECTOR NOT NULL)"
+                    ))
+                    conn.execute(text(
+                        f"CREATE INDEX IF NOT EXISTS ix_{SEARCH_TABLE}_document ON {SEARCH_TABLE} USING GIN (document)"
+                    ))
+                    self.backend = "tsvector"
+        except Exception as e:
+            print(f"⚠️  全文索引不可用，搜索退回LIKE查询: {str(e)}")
+            self.backend = None
+
+    def _rows(self, documents: List[dict]) -> List[dict]:
+        return [
+            {
+                "doc_id": document["doc_id"],
+                "source": document["source"],
+                "ref": str(document["ref"]),
+                "payload": json.dumps(document["payload"], ensure_ascii=False),
+                **{column: segment(document.get(column) or "") for column in SEARCH_COLUMNS}
+            }
+            for document in documents
+        ]
+
+    def upsert(self, conn, documents: List[dict]):
+        """写入或替换文档（调用方负责事务）"""
+        if not self.backend or not documents:
+            return
+        rows = self._rows(documents)
+        if self.backend == "fts5":
+            conn.execute(text(f"DELETE FROM {SEARCH_TABLE} WHERE rowid = :doc_id"), rows)
+            conn.execute(text(
+                f"INSERT INTO {SEARCH_TABLE} (rowid, source, ref, payload, {', '.join(SEARCH_COLUMNS)}) "
+                f"VALUES (:doc_id, :source, :ref, :payload, {', '.join(':' + column for column in SEARCH_COLUMNS)})"
+            ), rows)
+        else:
+            conn.execute(text(
+                f"INSERT INTO {SEARCH_TABLE} (doc_id, source, ref, payload, document) VALUES ("
+                ":doc_id, :source, :ref, :payload, "
+                "setweight(to_tsvector('simple', :title), 'A') || "
+                "setweight(to_tsvector('simple', :author), 'B') || "
+                "setweight(to_tsvector('simple', :genre || ' ' || :formal_models), 'C') || "
+                "setweight(to_tsvector('simple', :body), 'D')) "
+                "ON CONFLICT (doc_id) DO UPDATE SET source = EXCLUDED.source, ref = EXCLUDED.ref, "
+                "payload = EXCLUDED.payload, document = EXCLUDED.document"
+            ), rows)
+
+    def rebuild_gallery(self, batch_size: int = 1000) -> int:
+        """用画廊表重建画廊部分的索引（Discovery文档保留），返回文档数"""
+        if not self.backend:
+            return 0
+        count = 0
+        # 读取和写入在同一个连接和事务中（SQLite上两个连接会互相锁住）
+        with self.engine.begin() as conn:
+            books = conn.execute(select(*gallery_columns())).fetchall()
+            conn.execute(text(f"DELETE FROM {SEARCH_TABLE} WHERE source = 'gallery'"))
+            batch = []
+            for book in books:
+                batch.append(gallery_document(book))
+                if len(batch) >= batch_size:
+                    self.upsert(conn, batch)
+                    count += len(batch)
+                    batch = []
+            self.upsert(conn, batch)
+            count += len(batch)
+        return count
+
+    def index_discovery(self, analysis_id: str, title: str, author: str, cefr_level: str,
+                        formal_models: List[str], book_talk: str):
+        """把一次Discovery分析结果写入索引"""
+        with self.engine.begin() as conn:
+            self.upsert(conn, [{
+                "doc_id": discovery_doc_id(analysis_id),
+                "source": "discovery",
+                "ref": analysis_id,
+                "payload": {"analysis_id": analysis_id, "title": title, "author": author, "cefr_level": cefr_level},
+                "title": title,
+                "author": author,
+                "formal_models": " ".join(formal_models or []),
+                "body": book_talk
+            }])
+
+    def search(self, query: str, limit: int = 10, prefix: bool = True, source: Optional[str] = None) -> List[dict]:
+        """按相关度返回结果；prefix=True 时每个词都按前缀匹配（输入联想）
+
+        很短的前缀（如 "th"）可能命中大半个书目，对所有命中文档计算相关度要几十毫秒；
+        命中数超过 SEARCH_RANK_MAX_CANDIDATES 时不排序，直接返回前几条，用户多输入几个字母后再按相关度排序。
+        """
+        terms = query_terms(query)
+        if not terms:
+            return []
+        limit = max(1, min(limit, SEARCH_MAX_LIMIT))
+        params = {"limit": limit, "source": source, "candidates": SEARCH_RANK_MAX_CANDIDATES}
+        source_filter = "AND source = :source" if source else ""
+
+        if self.backend == "fts5":
+            exact = " AND ".join(f'"{term}"' for term in terms)
+            params["match"] = exact
+            if prefix:
+                # 同时保留完整词查询，完整命中的文档相关度更高（"Book 1" 排在 "Book 12" 前面）
+                prefixed = " AND ".join(f'"{term}"*' for term in terms)
+                params["match"] = f"({exact}) OR ({prefixed})"
+            weights = ", ".join(["0", "0", "0"] + [str(weight) for weight in SEARCH_WEIGHTS.values()])
+            matches = f"FROM {SEARCH_TABLE} WHERE {SEARCH_TABLE} MATCH :match {source_filter}"
+            rank = f"bm25({SEARCH_TABLE}, {weights})"
+            order = "rank"
+        elif self.backend == "tsvector":
+            params["match"] = " & ".join(f"'{term}':*" if prefix else f"'{term}'" for term in terms)
+            matches = f"FROM {SEARCH_TABLE}, to_tsquery('simple', :match) query WHERE document @@ query {source_filter}"
+            rank = "ts_rank(document, query)"
+            order = "rank DESC"
+        else:
+            return self._like_search(query, limit)
+
+        with self.engine.connect() as conn:
+            candidates = conn.execute(
+                text(f"SELECT count(*) FROM (SELECT 1 {matches} LIMIT :candidates) candidates"), params
+            ).scalar()
+            if candidates >= SEARCH_RANK_MAX_CANDIDATES:
+                sql = f"SELECT source, ref, payload, 0 AS rank {matches} LIMIT :limit"
+            else:
+                sql = f"SELECT source, ref, payload, {rank} AS rank {matches} ORDER BY {order} LIMIT :limit"
+            rows = conn.execute(text(sql), params).fetchall()
+        return [
+            {"source": row.source, **json.loads(row.payload), "score": round(abs(row.rank), 4)}
+            for row in rows
+        ]
+
+    def _like_search(self, query: str, limit: int) -> List[dict]:
+        from book_gallery import BookTalkGallery
+
+        pattern = f"%{query.strip()}%"
+        with self.engine.connect() as conn:
+            books = conn.execute(
+                select(*gallery_columns())
+                .where(BookTalkGallery.title.ilike(pattern) | BookTalkGallery.author.ilike(pattern))
+                .limit(limit)
+            ).fetchall()
+        return [{"source": "gallery", **gallery_document(book)["payload"], "score": 0} for book in books]
+
+
+def gallery_columns() -> list:
+    """建索引需要的画廊表列"""
+    from book_gallery import BookTalkGallery
+    return [
+        BookTalkGallery.id, BookTalkGallery.isbn, BookTalkGallery.title, BookTalkGallery.author,
+        BookTalkGallery.genre, BookTalkGallery.cefr_level, BookTalkGallery.cover_url,
+        BookTalkGallery.formal_models, BookTalkGallery.book_talk_text
+    ]
+
+
+def gallery_document(book) -> dict:
+    """画廊书籍行 -> 索引文档"""
+    try:
+        formal_models = " ".join(json.loads(book.formal_models)) if book.formal_models else ""
+    except (TypeError, ValueError):
+        formal_models = book.formal_models or ""
+    return {
+        "doc_id": book.id,
+        "source": "gallery",
+        "ref": book.id,
+        "payload": {
+            "id": book.id,
+            "isbn": book.isbn,
+            "title": book.title,
+            "author": book.author,
+            "genre": book.genre,
+            "cefr_level": book.cefr_level,
+            "cover_url": book.cover_url or f"https://covers.openlibrary.org/b/isbn/{book.isbn}-L.jpg"
+        },
+        "title": book.title,
+        "author": book.author,
+        "genre": book.genre,
+        "formal_models": formal_models,
+        "body": book.book_talk_text
+    }
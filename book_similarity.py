@@ -0,0 +1,217 @@
+# Book similarity - 本地"相似书籍"推荐，不需要调用GPT
+# 每本书的书名、作者、类型、formal models、推荐文本切分为词和n-gram（中文按字二元组），
+# 按TF-IDF加权后用特征哈希（带符号）投影到固定维度，L2归一化后存成一个 float32 的 NumPy 矩阵；
+# 相似度 = 矩阵乘向量（余弦），两万本书的查询在毫秒级完成
+# 用户推荐历史中的书也加入索引：推荐文本补充内容特征，推荐过同一本书的用户作为协同特征（"推荐过X的人也推荐了Y"）
+
+import json
+import math
+import zlib
+from collections import Counter, defaultdict
+from typing import List, Optional
+
+import numpy as np
+from sqlalchemy.orm import Session
+
+from book_catalog import normalize_title
+from book_search import segment
+
+# 每本书 512 x 4 字节 = 2KB，两万本书约40MB
+SIMILARITY_DIMENSIONS = 512
+
+# 各字段的词权重
+FIELD_WEIGHTS = {"title": 3.0, "author": 1.5, "genre": 2.0, "formal_models": 2.0, "text": 1.0, "users": 1.0}
+
+# 推荐结果的最低相似度
+SIMILARITY_MIN_SCORE = 0.08
+
+# 每本书最多使用的历史推荐文本条数（避免热门书的文本淹没其他特征）
+HISTORY_TEXTS_PER_BOOK = 5
+
+
+def _features(document: dict) -> Counter:
+    """文档 -> {特征: 权重}；英文相邻词组成二元组，中文由 segment 切为单字和二元组"""
+    features = Counter()
+    for field, weight in FIELD_WEIGHTS.items():
+        value = document.get(field)
+        if not value:
+            continue
+        if field == "users":
+            for user_id in value:
+                features[f"user:{user_id}"] += weight
+            continue
+        # 单个英文字母（don't -> don t）没有区分度
+        tokens = [token for token in segment(value).split() if len(token) > 1 or not token.isascii()]
+        for token in tokens:
+            features[f"{field}:{token}" if field in ("author", "genre") else token] += weight
+        for first, second in zip(tokens, tokens[1:]):
+            if first.isascii() and second.isascii():
+                features[f"{first} {second}"] += weight
+    return features
+
+
+def _bucket(feature: str):
+    """特征 -> (维度下标, 符号)；用crc32保证不同进程之间结果一致"""
+    digest = zlib.crc32(feature.encode("utf-8"))
+    return digest % SIMILARITY_DIMENSIONS, 1.0 if digest & 0x80000000 else -1.0
+
+
+class SimilarityIndex:
+    """书籍向量矩阵 + 元数据，按规范化书名查找"""
+
+    def __init__(self):
+        self.items = []                 # 书籍元数据：title, author, genre, cefr_level, source, id, isbn
+        self.keys = {}                  # 规范化书名 -> 行号
+        self.idf = {}
+        self.gallery_mask = np.zeros(0, dtype=bool)
+        self.user_rows = {}             # 用户id -> 该用户推荐历史中（画廊之外）的书的行号
+        self.matrix = np.zeros((0, SIMILARITY_DIMENSIONS), dtype=np.float32)
+
+    def __len__(self):
+        return len(self.items)
+
+    def build(self, documents: List[dict]):
+        """documents: [{"item": 元数据, 以及 FIELD_WEIGHTS 中的字段}]"""
+        feature_sets = [_features(document) for document in documents]
+        document_frequency = Counter()
+        for features in feature_sets:
+            document_frequency.update(features.keys())
+        total = len(documents)
+        self.idf = {feature: math.log((1 + total) / (1 + count)) + 1.0 for feature, count in document_frequency.items()}
+
+        self.items = [document["item"] for document in documents]
+        self.keys = {normalize_title(item["title"]): row for row, item in enumerate(self.items)}
+        self.gallery_mask = np.array([item["source"] == "gallery" for item in self.items], dtype=bool)
+        self.user_rows = {}
+        for row, document in enumerate(documents):
+            if document["item"]["source"] == "gallery":
+                continue
+            for user_id in document.get("users", ()):
+                if user_id is not None:
+                    self.user_rows.setdefault(user_id, []).append(row)
+        self.matrix = np.zeros((total, SIMILARITY_DIMENSIONS), dtype=np.float32)
+        for row, features in enumerate(feature_sets):
+            self.matrix[row] = self._vector(features)
+
+    def _vector(self, features: Counter) -> np.ndarray:
+        vector = np.zeros(SIMILARITY_DIMENSIONS, dtype=np.float32)
+        for feature, weight in features.items():
+            idf = self.idf.get(feature)
+            if idf is None:
+                continue  # 索引中没有出现过的特征对相似度没有贡献
+            index, sign = _bucket(feature)
+            vector[index] += sign * (1.0 + math.log(weight)) * idf
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def row_for(self, title: str) -> Optional[int]:
+        return self.keys.get(normalize_title(title))
+
+    def _visible_mask(self, user_id: Optional[int] = None) -> np.ndarray:
+        """可以返回给请求者的行：画廊书籍，以及 user_id 自己推荐历史中的书（其他用户的历史不外露）"""
+        mask = self.gallery_mask.copy()
+        if user_id is not None:
+            mask[self.user_rows.get(user_id, [])] = True
+        return mask
+
+    def contains(self, title: str, user_id: Optional[int] = None) -> bool:
+        row = self.row_for(title)
+        return row is not None and bool(self._visible_mask(user_id)[row])
+
+    def query_vector(self, title: str, author: str = "", genre: str = "") -> np.ndarray:
+        """索引中的书直接取向量，不在索引中的书用书名/作者/类型现算"""
+        row = self.row_for(title)
+        if row is not None:
+            return self.matrix[row]
+        return self._vector(_features({"title": title, "author": author, "genre": genre}))
+
+    def _top(self, scores: np.ndarray, limit: int, exclude: List[str], user_id: Optional[int]) -> List[int]:
+        """相似度最高的行（排除已读的书；只返回画廊中的书和 user_id 自己推荐历史中的书）"""
+        excluded_rows = [row for row in (self.row_for(title) for title in exclude) if row is not None]
+        scores[excluded_rows] = -1.0
+        scores[~self._visible_mask(user_id)] = -1.0
+        limit = min(limit, len(scores))
+        if not limit:
+            return []
+        candidates = np.argpartition(-scores, limit - 1)[:limit]
+        return [int(row) for row in candidates[np.argsort(-scores[candidates])] if scores[row] >= SIMILARITY_MIN_SCORE]
+
+    def similar_to(self, title: str, limit: int = 5, user_id: Optional[int] = None) -> List[dict]:
+        """与某本书最相似的书（画廊书籍；传入 user_id 时也包括该用户自己推荐过的书）"""
+        if not self.items:
+            return []
+        scores = self.matrix @ self.query_vector(title)
+        rows = self._top(scores, limit, [title], user_id)
+        return [{**self.items[row], "score": round(float(scores[row]), 3)} for row in rows]
+
+    def recommend_for(self, books: List[dict], limit: int = 5, user_id: Optional[int] = None) -> List[dict]:
+        """给喜欢这些书的读者推荐：对每本候选书取与各本已读书相似度的平均，并记下最相近的一本作为理由"""
+        books = [book for book in books if book.get("title")]
+        if not self.items or not books:
+            return []
+        liked = np.stack([
+            self.query_vector(book["title"], book.get("author", ""), book.get("genre", "")) for book in books
+        ])
+        similarities = self.matrix @ liked.T  # (书目数, 已读书数)
+        scores = similarities.mean(axis=1)
+        closest = similarities.argmax(axis=1)
+        rows = self._top(scores, limit, [book["title"] for book in books], user_id)
+        return [
+            {**self.items[row], "score": round(float(scores[row]), 3), "because_of": books[closest[row]]["title"]}
+            for row in rows
+        ]
+
+
+def build_similarity_index(db: Session) -> SimilarityIndex:
+    """从画廊书籍和用户推荐历史构建索引（同一本书按规范化书名合并）"""
+    from book_gallery import BookTalkGallery
+    from database import UserRecommendation
+
+    documents = {}
+    for book in db.query(
+        BookTalkGallery.id, BookTalkGallery.isbn, BookTalkGallery.title, BookTalkGallery.author,
+        BookTalkGallery.genre, BookTalkGallery.cefr_level, BookTalkGallery.formal_models, BookTalkGallery.book_talk_text
+    ):
+        try:
+            formal_models = " ".join(json.loads(book.formal_models)) if book.formal_models else ""
+        except (TypeError, ValueError):
+            formal_models = book.formal_models or ""
+        documents[normalize_title(book.title)] = {
+            "item": {
+                "title": book.title, "author": book.author, "genre": book.genre, "cefr_level": book.cefr_level,
+                "source": "gallery", "id": book.id, "isbn": book.isbn
+            },
+            "title": book.title,
+            "author": book.author,
+            "genre": book.genre,
+            "formal_models": formal_models,
+            "text": book.book_talk_text or "",
+            "users": set()
+        }
+
+    history_texts = defaultdict(list)
+    for title, user_id, text in db.query(
+        UserRecommendation.book_title, UserRecommendation.user_id, UserRecommendation.recommendation_text
+    ):
+        key = normalize_title(title)
+        if not key:
+            continue
+        document = documents.setdefault(key, {
+            "item": {
+                "title": title.strip(), "author": "", "genre": None, "cefr_level": None,
+                "source": "history", "id": None, "isbn": None
+            },
+            "title": title,
+            "text": "",
+            "users": set()
+        })
+        document["users"].add(user_id)
+        if len(history_texts[key]) < HISTORY_TEXTS_PER_BOOK:
+            history_texts[key].append(text or "")
+
+    for key, texts in history_texts.items():
+        documents[key]["text"] = " ".join([documents[key]["text"], *texts])
+
+    index = SimilarityIndex()
+    index.build(list(documents.values()))
+    return index
@@ -10,6 +10,12 @@ apt-get update
 # Install Tesseract OCR with language packs
 apt-get install -y tesseract-ocr tesseract-ocr-chi-sim tesseract-ocr-eng
 
+# Tesseract C-API headers for the in-process tesserocr backend (optional)
+apt-get install -y libtesseract-dev libleptonica-dev pkg-config
+
+# ffmpeg for Opus/AAC audio variants (optional, MP3 only without it)
+apt-get install -y ffmpeg || echo "⚠️  ffmpeg unavailable, serving MP3 only"
+
 # Verify installation
 echo "📋 Tesseract version:"
 tesseract --version
@@ -21,4 +27,10 @@ tesseract --list-langs
 echo "🐍 Installing Python dependencies..."
 pip install -r requirements.txt
 
+# Optional: in-process OCR backend, falls back to pytesseract if the build fails
+pip install tesserocr || echo "⚠️  tesserocr unavailable, using pytesseract"
+
+# Optional: word frequency list for the local CEFR estimator, falls back to the LLM estimate
+pip install wordfreq || echo "⚠️  wordfreq unavailable, CEFR level estimated by the LLM"
+
 echo "✅ Build completed successfully!"
\ No newline at end of file
@@ -0,0 +1,399 @@
+# Catalog import - 从CSV/JSONL书目文件批量导入画廊书籍
+# 逐行读取和校验（不把整个文件读入内存），按ISBN去重后分批写入：每批一次查询、一次批量插入/更新、一次提交，
+# 单个事务很短，导入期间SQLite不会长时间锁库；可选把新书交给限速的后台流水线做AI分析和TTS合成
+#
+# 用法:
+#   python catalog_import.py books.csv
+#   python catalog_import.py books.jsonl --batch-size 1000 --analyze --tts --rate 20
+#
+# 字段: title, author, isbn 必填；cefr_level, estimated_vocabulary, formal_models（JSON数组或以;分隔）,
+# sample_paragraph, book_talk_text, cover_url, description, genre, publication_year, page_count, goodreads_rating
+# 缺少 cefr_level / estimated_vocabulary 时由本地估算器根据 sample_paragraph 补全；
+# 新书必须有 sample_paragraph / book_talk_text 和等级字段才会写入画廊，缺少时需要 --analyze：
+# 这些书暂不写入，由AI补全成功后才插入，分析失败的书不会以空文本出现在画廊中，否则视为无效行
+# 写入会改变画廊表的版本（MAX(updated_at) + 行数），运行中的服务据此刷新缓存和索引，不需要重启
+
+import argparse
+import csv
+import json
+import queue
+import re
+import threading
+import time
+from collections import Counter
+from typing import Iterator, List, Optional, Tuple
+
+from sqlalchemy import insert, update
+
+from database import SessionLocal, create_tables, engine
+from book_gallery import BookTalkGallery
+from book_search import BookSearchIndex
+from cefr_estimator import estimate_levels, level_vocabulary, local_estimate_enabled
+
+IMPORT_BATCH_SIZE = 500
+
+CEFR_LEVELS = {"A1", "A2", "B1", "B2", "C1", "C2"}
+
+TEXT_FIELDS = ["title", "author", "cover_url", "description", "genre", "sample_paragraph", "book_talk_text"]
+INT_FIELDS = ["estimated_vocabulary", "publication_year", "page_count"]
+FLOAT_FIELDS = ["goodreads_rating"]
+
+# 字段长度上限（与表结构一致）
+MAX_LENGTHS = {"title": 255, "author": 255, "cover_url": 500, "genre": 100}
+
+_ISBN_SEPARATORS_RE = re.compile(r"[\s-]")
+
+
+def normalize_isbn(value) -> Optional[str]:
+    """去掉空格和连字符，校验ISBN-10/13校验位；无效时返回None"""
+    isbn = _ISBN_SEPARATORS_RE.sub("", str(value or "")).upper()
+    if len(isbn) == 13 and isbn.isdigit():
+        total = sum(int(digit) * (1 if i % 2 == 0 else 3) for i, digit in enumerate(isbn[:12]))
+        return isbn if (10 - total % 10) % 10 == int(isbn[12]) else None
+    if len(isbn) == 10 and isbn[:9].isdigit() and (isbn[9].isdigit() or isbn[9] == "X"):
+        total = sum((10 - i) * (10 if char == "X" else int(char)) for i, char in enumerate(isbn))
+        return isbn if total % 11 == 0 else None
+    return None
+
+
+def iter_catalog_rows(path: str) -> Iterator[Tuple[int, dict]]:
+    """逐行读取CSV或JSONL书目，返回 (行号, 原始字典)；JSONL中无法解析的行返回 (行号, None)"""
+    with open(path, encoding="utf-8-sig", newline="") as f:
+        if path.endswith(".csv"):
+            for line_number, row in enumerate(csv.DictReader(f), 2):
+                yield line_number, row
+        else:
+            for line_number, line in enumerate(f, 1):
+                if not line.strip():
+                    continue
+                try:
+                    row = json.loads(line)
+                except json.JSONDecodeError:
+                    row = None
+                yield line_number, row if isinstance(row, dict) else None
+
+
+def validate_row(row: Optional[dict]) -> Tuple[Optional[dict], Optional[str]]:
+    """校验并转换一行书目，返回 (书籍数据, 错误)；只包含文件中出现的字段，更新时不会覆盖其他字段"""
+    if row is None:
+        return None, "invalid JSON"
+
+    book = {}
+    for field in TEXT_FIELDS:
+        value = row.get(field)
+        if value is not None and str(value).strip():
+            value = str(value).strip()
+            if field in MAX_LENGTHS and len(value) > MAX_LENGTHS[field]:
+                return None, f"{field} too long"
+            book[field] = value
+
+    if "title" not in book or "author" not in book:
+        return None, "missing title or author"
+
+    isbn = normalize_isbn(row.get("isbn"))
+    if not isbn:
+        return None, f"invalid isbn: {row.get('isbn')!r}"
+    book["isbn"] = isbn
+
+    cefr_level = str(row.get("cefr_level") or "").strip().upper()
+    if cefr_level:
+        if cefr_level not in CEFR_LEVELS:
+            return None, f"invalid cefr_level: {cefr_level}"
+        book["cefr_level"] = cefr_level
+
+    for field, cast in [(field, int) for field in INT_FIELDS] + [(field, float) for field in FLOAT_FIELDS]:
+        value = row.get(field)
+        if value is None or str(value).strip() == "":
+            continue
+        try:
+            book[field] = cast(float(value)) if cast is int else cast(value)
+        except (TypeError, ValueError):
+            return None, f"invalid {field}: {value!r}"
+
+    formal_models = row.get("formal_models")
+    if isinstance(formal_models, str) and formal_models.strip():
+        formal_models = formal_models.strip()
+        if formal_models.startswith("["):
+            try:
+                formal_models = json.loads(formal_models)
+            except json.JSONDecodeError:
+                return None, "invalid formal_models"
+        else:
+            formal_models = [model.strip() for model in formal_models.split(";") if model.strip()]
+    if isinstance(formal_models, list) and formal_models:
+        book["formal_models"] = json.dumps([str(model) for model in formal_models], ensure_ascii=False)
+
+    return book, None
+
+
+def has_texts(book: dict) -> bool:
+    return bool(book.get("sample_paragraph") and book.get("book_talk_text"))
+
+
+def missing_fields(book: dict) -> List[str]:
+    """新书写入画廊前必须具备、但当前缺少的字段"""
+    return [field for field in ("sample_paragraph", "book_talk_text", "cefr_level", "estimated_vocabulary")
+            if not book.get(field)]
+
+
+def needs_analysis(book: dict) -> bool:
+    return bool(missing_fields(book))
+
+
+def new_book_values(book: dict) -> dict:
+    """新书插入时补齐音频地址（与 create_book_if_not_exists 一致）"""
+    isbn = book["isbn"]
+    return {
+        "sample_audio_path": f"audio/gallery_sample_{isbn}.mp3",
+        "book_talk_audio_path": f"audio/gallery_talk_{isbn}.mp3",
+        **book
+    }
+
+
+def prefill_levels(books: List[dict]):
+    """新书缺少CEFR等级或词汇量时，用本地估算器根据示例段落批量补全（不需要AI分析）"""
+    pending = [book for book in books
+               if book.get("sample_paragraph") and not (book.get("cefr_level") and book.get("estimated_vocabulary"))]
+    for book, estimate in zip(pending, estimate_levels([book["sample_paragraph"] for book in pending])):
+        if estimate:
+            book.setdefault("cefr_level", estimate["cefr_level"])
+            book.setdefault("estimated_vocabulary", estimate["estimated_vocabulary"])
+    # 给出了等级但没有词汇量（且文本太短无法估算）时，用等级的典型词汇量
+    for book in books:
+        if book.get("cefr_level") and not book.get("estimated_vocabulary"):
+            book["estimated_vocabulary"] = level_vocabulary(book["cefr_level"])
+
+
+def upsert_batch(db, books: List[dict], allow_missing_text: bool = False) -> Tuple[List[dict], int, List[dict], List[dict]]:
+    """按ISBN批量插入或更新，一次提交；返回 (新插入的书, 更新数量, 待AI补全的新书, 缺少字段而拒绝的新书)
+
+    已有的书只更新文件中给出的字段；新书必须有示例段落、推荐文本和等级字段才插入，
+    缺少时 allow_missing_text 为真则暂不插入（待AI补全后由流水线插入），否则拒绝。
+    """
+    existing = dict(
+        db.query(BookTalkGallery.isbn, BookTalkGallery.id)
+        .filter(BookTalkGallery.isbn.in_([book["isbn"] for book in books]))
+    )
+
+    new_books = [book for book in books if book["isbn"] not in existing]
+    # 之后由AI分析的新书，等级交给模型判断（除非开启了 CEFR_LOCAL_ESTIMATE），本地估算只用于没有AI的导入
+    if not allow_missing_text or local_estimate_enabled():
+        prefill_levels(new_books)
+    inserted = [book for book in new_books if not missing_fields(book)]
+    incomplete = [book for book in new_books if missing_fields(book)]
+    staged, rejected = (incomplete, []) if allow_missing_text else ([], incomplete)
+    updates = [{"id": existing[book["isbn"]], **book} for book in books if book["isbn"] in existing]
+
+    if inserted:
+        db.execute(insert(BookTalkGallery), [new_book_values(book) for book in inserted])
+    if updates:
+        db.execute(update(BookTalkGallery), updates)
+    db.commit()
+    return inserted, len(updates), staged, rejected
+
+
+class RateLimiter:
+    """全局限速：两次调用之间至少间隔 60/每分钟次数 秒（多个线程共享）"""
+
+    def __init__(self, per_minute: float):
+        self.interval = 60.0 / per_minute if per_minute > 0 else 0.0
+        self._lock = threading.Lock()
+        self._next_at = 0.0
+
+    def wait(self):
+        with self._lock:
+            now = time.monotonic()
+            scheduled = max(now, self._next_at)
+            self._next_at = scheduled + self.interval
+        if scheduled > now:
+            time.sleep(scheduled - now)
+
+
+class EnrichmentPipeline:
+    """新书的后台处理流水线：AI补全文本（限速），完成后收集需要合成音频的书
+
+    导入过程中边导入边分析；尚未写入画廊的新书（staged）在分析成功后才插入，分析失败时不写入。
+    TTS在导入结束后通过画廊音频任务统一生成（同样限速）。
+    """
+
+    def __init__(self, analyze: bool, tts: bool, per_minute: float, workers: int = 2):
+        self.analyze = analyze
+        self.tts = tts
+        self.limiter = RateLimiter(per_minute)
+        self.stats = Counter()
+        self.tts_books = []
+        self._queue = queue.Queue(maxsize=workers * 50)
+        self._lock = threading.Lock()
+        self._threads = [
+            threading.Thread(target=self._worker, name=f"catalog-enrich-{i}", daemon=True)
+            for i in range(workers)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def submit(self, book: dict, staged: bool = False):
+        self._queue.put((book, staged))
+
+    def _worker(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            book, staged = item
+            try:
+                self._process(book, staged)
+            except Exception as e:
+                print(f"书籍后台处理失败 {book['title']}: {str(e)}")
+                with self._lock:
+                    self.stats["failed"] += 1
+
+    def _process(self, book: dict, staged: bool = False):
+        import main
+
+        if self.analyze and needs_analysis(book):
+            self.limiter.wait()
+            analysis = main.analyze_book_with_ai(book["title"], book["author"], book.get("cefr_level", "B2"))
+            fields = {
+                "sample_paragraph": book.get("sample_paragraph") or analysis.get("first_paragraph"),
+                "book_talk_text": book.get("book_talk_text") or analysis.get("book_talk"),
+                "cefr_level": book.get("cefr_level") or analysis.get("cefr_level"),
+                "estimated_vocabulary": book.get("estimated_vocabulary") or analysis.get("estimated_vocabulary"),
+                "formal_models": book.get("formal_models") or json.dumps(analysis.get("formal_models") or [])
+            }
+            book.update(fields)
+            if missing_fields(book):
+                raise ValueError(f"analysis incomplete: missing {', '.join(missing_fields(book))}")
+            db = SessionLocal()
+            try:
+                # 暂存的新书此时才写入画廊；同一ISBN可能已由其他批次写入，此时改为更新
+                exists = db.query(BookTalkGallery.id).filter(BookTalkGallery.isbn == book["isbn"]).first()
+                if staged and not exists:
+                    db.execute(insert(BookTalkGallery), [new_book_values(book)])
+                else:
+                    db.query(BookTalkGallery).filter(BookTalkGallery.isbn == book["isbn"]).update(fields)
+                db.commit()
+            finally:
+                db.close()
+            with self._lock:
+                self.stats["analyzed"] += 1
+                if staged and not exists:
+                    self.stats["inserted"] += 1
+
+        if self.tts and has_texts(book):
+            with self._lock:
+                self.tts_books.append(book)
+
+    def close(self):
+        """等待分析完成，然后生成音频并等待音频任务结束"""
+        for _ in self._threads:
+            self._queue.put(None)
+        for thread in self._threads:
+            thread.join()
+
+        if not self.tts_books:
+            return
+
+        import main
+        from gallery_audio_job import GalleryAudioJob
+
+        def synthesize(text: str, filename: str) -> str:
+            self.limiter.wait()
+            return main.text_to_speech(text, filename, "English")
+
+        main.load_gallery_audio_index()
+        job = GalleryAudioJob(synthesize, cached=main.gallery_audio_cached, checkpoint=main.checkpoint_gallery_audio)
+        job.start([
+            {**book, "formal_models": json.loads(book.get("formal_models") or "[]")}
+            for book in self.tts_books
+        ])
+        job.wait()
+        progress = job.progress()
+        self.stats["audio_generated"] += progress["generated_files"]
+        self.stats["audio_failed"] += progress["failed_books"]
+
+
+def import_catalog(path: str, batch_size: int = IMPORT_BATCH_SIZE,
+                   pipeline: Optional[EnrichmentPipeline] = None) -> Counter:
+    """流式导入书目文件，返回统计（inserted / updated / staged / invalid / duplicates）"""
+    stats = Counter()
+    allow_missing_text = bool(pipeline and pipeline.analyze)
+    batch = {}
+    batch_lines = {}  # ISBN -> 行号，用于报告错误
+
+    def flush():
+        db = SessionLocal()
+        try:
+            inserted, updated, staged, rejected = upsert_batch(db, list(batch.values()), allow_missing_text)
+        finally:
+            db.close()
+        stats["inserted"] += len(inserted)
+        stats["updated"] += updated
+        stats["staged"] += len(staged)
+        for book in rejected:
+            report_invalid(batch_lines[book["isbn"]], f"new book missing {', '.join(missing_fields(book))} (use --analyze)")
+        if pipeline:
+            for book in inserted:
+                pipeline.submit(dict(book))
+            for book in staged:
+                pipeline.submit(dict(book), staged=True)
+        batch.clear()
+        batch_lines.clear()
+
+    def report_invalid(line_number: int, error: str):
+        stats["invalid"] += 1
+        if stats["invalid"] <= 20:
+            print(f"⚠️  第{line_number}行无效: {error}")
+
+    for line_number, row in iter_catalog_rows(path):
+        book, error = validate_row(row)
+        if error:
+            report_invalid(line_number, error)
+            continue
+
+        isbn = book["isbn"]
+        if isbn in batch:
+            stats["duplicates"] += 1
+            book = {**batch[isbn], **book}  # 同一批中重复的ISBN合并，后出现的字段为准
+        batch[isbn] = book
+        batch_lines[isbn] = line_number
+        if len(batch) >= batch_size:
+            flush()
+
+    if batch:
+        flush()
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="批量导入画廊书目（CSV/JSONL）")
+    parser.add_argument("path", help="书目文件（.csv 或 .jsonl）")
+    parser.add_argument("--batch-size", type=int, default=IMPORT_BATCH_SIZE, help="每个事务写入的书籍数")
+    parser.add_argument("--analyze", action="store_true", help="新书缺少文本时用AI补全")
+    parser.add_argument("--tts", action="store_true", help="为新书生成画廊音频")
+    parser.add_argument("--rate", type=float, default=20, help="AI分析和TTS每分钟最多请求数")
+    parser.add_argument("--workers", type=int, default=2, help="后台分析线程数")
+    args = parser.parse_args()
+
+    create_tables()
+    pipeline = EnrichmentPipeline(args.analyze, args.tts, args.rate, args.workers) if args.analyze or args.tts else None
+
+    started = time.perf_counter()
+    stats = import_catalog(args.path, args.batch_size, pipeline)
+    print(f"📚 导入完成: 新增 {stats['inserted']}, 更新 {stats['updated']}, 待AI补全 {stats['staged']}, "
+          f"无效 {stats['invalid']}, 重复 {stats['duplicates']} ({time.perf_counter() - started:.1f}s)")
+
+    if pipeline:
+        print("⏳ 等待后台分析和音频生成...")
+        pipeline.close()
+        print(f"🎵 后台处理完成: 分析 {pipeline.stats['analyzed']}（新增 {pipeline.stats['inserted']}）, "
+              f"生成音频 {pipeline.stats['audio_generated']}, "
+              f"失败 {pipeline.stats['failed'] + pipeline.stats['audio_failed']}")
+
+    search_index = BookSearchIndex(engine)
+    search_index.create()
+    print(f"🔎 全文索引已更新: {search_index.rebuild_gallery()} 本画廊书籍")
+    print("ℹ️  运行中的服务会在下次请求时发现画廊版本变化，自动刷新画廊列表缓存和书目/相似书籍索引")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,199 @@
+# CEFR estimator - 根据书籍文本（第一段、画廊示例段落）本地估算CEFR难度和所需词汇量
+# 词频排名 + 简单词形还原：按90%词汇覆盖率所需的词频排名估算词汇量（短样本中最生僻的5-10%多是专有名词、
+# 方言和拟声词，取95%会被它们左右），再结合句长和音节数（Flesch-Kincaid年级）得到CEFR等级；
+# 全部用NumPy向量化，一批文本一次计算，结果可重复
+# 词频表优先使用 WORD_FREQUENCY_PATH 文件（每行一个词，按频率降序），其次使用 wordfreq 包；都没有时不可用
+#
+# 准确度：只有3本带人工标注的画廊示例书，不足以校准，刻度只是粗调。用wordfreq词表对示例段落（约200词）的结果：
+#   Animal Farm                      B1/4000（标注 B1/4000）
+#   The Great Gatsby                 B2/5000（标注 B2/6000）
+#   My Year of Rest and Relaxation   B1/3500（标注 B2/6500）
+# 即等级3本中1本低一级，词汇量平均偏差约1300词（最大3000）；单段文本的词汇覆盖率噪声较大，
+# 因此默认只在没有AI的场景（书目导入补全）使用；CEFR_LOCAL_ESTIMATE=true 时才在AI分析中代替模型的判断
+
+import os
+import re
+from functools import lru_cache
+from typing import List, Optional
+
+import numpy as np
+
+try:
+    from wordfreq import top_n_list
+    WORDFREQ_AVAILABLE = True
+except ImportError:
+    WORDFREQ_AVAILABLE = False
+
+WORD_FREQUENCY_PATH = os.getenv("WORD_FREQUENCY_PATH")
+CEFR_LOCAL_ESTIMATE = os.getenv("CEFR_LOCAL_ESTIMATE", "false").lower() == "true"
+FREQUENCY_LIST_SIZE = 80000
+
+# 少于这么多词的文本估算不可靠
+CEFR_MIN_WORDS = 40
+
+# 读者需要认识的词比例
+COVERAGE = 0.9
+
+CEFR_LEVELS = ["A1", "A2", "B1", "B2", "C1", "C2"]
+
+# 词汇量、Flesch-Kincaid年级 -> 等级刻度（1=A1 ... 6=C2），两者按权重合并
+# 刻度用画廊示例书籍的人工标注校准
+VOCABULARY_SCALE = ([1000, 2000, 3500, 5000, 7000, 10000], [1, 2, 3, 4, 5, 6])
+GRADE_SCALE = ([1, 4, 7, 10, 13, 16], [1, 2, 3, 4, 5, 6])
+VOCABULARY_WEIGHT = 0.7
+
+_WORD_RE = re.compile(r"[A-Za-z]+(?:['’][A-Za-z]+)?")
+_SENTENCE_END_RE = re.compile(r"[.!?]+[\"'”’)]*(?:\s|$)")
+_VOWEL_GROUP_RE = re.compile(r"[aeiouy]+")
+
+# 常见不规则变化
+IRREGULAR_LEMMAS = {
+    "was": "be", "were": "be", "is": "be", "are": "be", "am": "be", "been": "be",
+    "had": "have", "has": "have", "did": "do", "does": "do", "done": "do",
+    "went": "go", "gone": "go", "said": "say", "made": "make", "got": "get",
+    "saw": "see", "seen": "see", "knew": "know", "known": "know", "took": "take", "taken": "take",
+    "came": "come", "thought": "think", "told": "tell", "found": "find", "gave": "give", "given": "give",
+    "felt": "feel", "left": "leave", "kept": "keep", "began": "begin", "begun": "begin",
+    "brought": "bring", "stood": "stand", "heard": "hear", "ran": "run", "wrote": "write",
+    "written": "write", "sat": "sit", "held": "hold", "spoke": "speak", "spoken": "speak",
+    "meant": "mean", "drew": "draw", "drawn": "draw", "drank": "drink", "drunk": "drink",
+    "men": "man", "women": "woman", "children": "child", "feet": "foot", "teeth": "tooth",
+    "better": "good", "best": "good", "worse": "bad", "worst": "bad"
+}
+
+# 后缀还原规则：(后缀, 替换)，按顺序尝试，取词频排名最靠前的候选
+SUFFIX_RULES = [
+    ("ies", "y"), ("ied", "y"), ("iest", "y"), ("ier", "y"), ("ily", "y"),
+    ("es", ""), ("s", ""), ("ed", ""), ("ed", "e"), ("ing", ""), ("ing", "e"),
+    ("est", ""), ("est", "e"), ("er", ""), ("er", "e"), ("ly", ""), ("'s", ""), ("’s", "")
+]
+
+
+@lru_cache(maxsize=1)
+def frequency_ranks() -> dict:
+    """词 -> 词频排名（从1开始）；没有词频表时返回空字典"""
+    words = []
+    if WORD_FREQUENCY_PATH and os.path.exists(WORD_FREQUENCY_PATH):
+        with open(WORD_FREQUENCY_PATH, encoding="utf-8") as f:
+            words = [line.split(",")[0].split("\t")[0].strip().lower() for line in f if line.strip()]
+    elif WORDFREQ_AVAILABLE:
+        words = top_n_list("en", FREQUENCY_LIST_SIZE)
+
+    ranks = {}
+    for rank, word in enumerate(words, 1):
+        ranks.setdefault(word, rank)
+    return ranks
+
+
+def estimator_available() -> bool:
+    return bool(frequency_ranks())
+
+
+def local_estimate_enabled() -> bool:
+    """AI分析是否用本地估算代替模型给出的等级和词汇量"""
+    return CEFR_LOCAL_ESTIMATE and estimator_available()
+
+
+@lru_cache(maxsize=50000)
+def lemma_rank(word: str) -> int:
+    """词形还原后的词频排名：在原词、不规则变化和后缀还原候选中取最靠前的排名；未收录的词视为最生僻"""
+    ranks = frequency_ranks()
+    unknown = len(ranks) + 1
+    candidates = [word]
+    if word in IRREGULAR_LEMMAS:
+        candidates.append(IRREGULAR_LEMMAS[word])
+    for suffix, replacement in SUFFIX_RULES:
+        if word.endswith(suffix) and len(word) - len(suffix) >= 2:
+            stem = word[:-len(suffix)]
+            candidates.append(stem + replacement)
+            if len(stem) >= 3 and stem[-1] == stem[-2] and stem[-1] not in "aeiouls":
+                candidates.append(stem[:-1])  # running -> run, stopped -> stop
+    return min(ranks.get(candidate, unknown) for candidate in candidates)
+
+
+def _syllables(word: str) -> int:
+    count = len(_VOWEL_GROUP_RE.findall(word))
+    if word.endswith("e") and not word.endswith(("le", "ee")) and count > 1:
+        count -= 1  # 词尾不发音的e
+    return max(count, 1)
+
+
+def _tokenize(text: str):
+    """返回 (计入词汇统计的小写词, 词数, 句数, 音节数)；句中大写开头的词视为专有名词，不计入词汇"""
+    words = []
+    total_words = 0
+    syllables = 0
+    sentences = max(len(_SENTENCE_END_RE.findall(text)), 1)
+    sentence_start = True
+    for match in _WORD_RE.finditer(text):
+        token = match.group()
+        lower = token.lower().replace("’", "'")
+        total_words += 1
+        syllables += _syllables(lower)
+        if sentence_start or not token[0].isupper() or lower == "i" or lower.startswith("i'"):
+            words.append(lower)
+        # 下一个词是否在句首：当前词后到下一个词之间出现句末标点
+        end = match.end()
+        sentence_start = bool(_SENTENCE_END_RE.match(text, end)) if end < len(text) else False
+    return words, total_words, sentences, syllables
+
+
+def estimate_levels(texts: List[str]) -> List[Optional[dict]]:
+    """批量估算，每段文本返回 {cefr_level, estimated_vocabulary, coverage_rank, mean_sentence_length, fk_grade, words}
+
+    文本太短或没有词频表时对应位置返回None。
+    """
+    if not estimator_available():
+        return [None] * len(texts)
+
+    group_ids, ranks, stats, valid = [], [], [], []
+    for index, text in enumerate(texts):
+        words, total_words, sentences, syllables = _tokenize(text or "")
+        if total_words < CEFR_MIN_WORDS or not words:
+            continue
+        valid.append(index)
+        group_ids.extend([len(valid) - 1] * len(words))
+        ranks.extend(lemma_rank(word) for word in words)
+        stats.append((total_words, sentences, syllables))
+
+    results = [None] * len(texts)
+    if not valid:
+        return results
+
+    group_ids = np.asarray(group_ids)
+    ranks = np.asarray(ranks, dtype=np.float64)
+    total_words, sentences, syllables = np.asarray(stats, dtype=np.float64).T
+
+    # 每段文本内按排名排序，取覆盖90%的词所需的排名（最近秩法）
+    order = np.lexsort((ranks, group_ids))
+    counts = np.bincount(group_ids)
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+    coverage_rank = ranks[order][starts + np.ceil(COVERAGE * counts).astype(int) - 1]
+
+    vocabulary = np.clip(np.round(coverage_rank / 500) * 500, 500, 20000)
+    mean_sentence_length = total_words / sentences
+    fk_grade = 0.39 * mean_sentence_length + 11.8 * (syllables / total_words) - 15.59
+    scale = (VOCABULARY_WEIGHT * np.interp(vocabulary, *VOCABULARY_SCALE)
+             + (1 - VOCABULARY_WEIGHT) * np.interp(fk_grade, *GRADE_SCALE))
+    level_index = np.clip(np.floor(scale + 0.5).astype(int), 1, 6) - 1
+
+    for position, index in enumerate(valid):
+        results[index] = {
+            "cefr_level": CEFR_LEVELS[level_index[position]],
+            "estimated_vocabulary": int(vocabulary[position]),
+            "coverage_rank": int(coverage_rank[position]),
+            "mean_sentence_length": round(float(mean_sentence_length[position]), 1),
+            "fk_grade": round(float(fk_grade[position]), 1),
+            "words": int(total_words[position])
+        }
+    return results
+
+
+def estimate_level(text: str) -> Optional[dict]:
+    return estimate_levels([text])[0]
+
+
+def level_vocabulary(cefr_level: str) -> int:
+    """CEFR等级对应的典型词汇量（文本太短无法估算时使用）"""
+    index = CEFR_LEVELS.index(cefr_level) if cefr_level in CEFR_LEVELS else CEFR_LEVELS.index("B2")
+    return VOCABULARY_SCALE[0][index]
@@ -1,4 +1,4 @@
-from sqlalchemy import create_engine, Column, Integer, String, DateTime, Text, ForeignKey, Float
+from sqlalchemy import create_engine, Column, Integer, String, DateTime, Text, ForeignKey, Float, inspect, text
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, Session, relationship
 from sqlalchemy.sql import func
@@ -54,6 +54,7 @@ class UserRecommendation(Base):
     dialect = Column(String(50), default="zh-CN-XiaoxiaoNeural")
     recommendation_text = Column(Text, nullable=False)
     audio_path = Column(String(255), nullable=False)
+    audio_duration_seconds = Column(Integer, nullable=True)
     share_id = Column(String(32), unique=True, index=True, nullable=False)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
 
@@ -63,6 +64,36 @@ UserRecommendation.user = relationship("User", back_populates="recommendations")
 
 def create_tables():
     Base.metadata.create_all(bind=engine)
+    add_missing_columns()
+    add_missing_indexes()
+
+def add_missing_columns():
+    """create_all不会修改已有的表：为模型中新增的可空列执行 ALTER TABLE ADD COLUMN"""
+    inspector = inspect(engine)
+    with engine.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+            existing = {column["name"] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing or not column.nullable:
+                    continue
+                column_type = column.type.compile(dialect=engine.dialect)
+                conn.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}"))
+                print(f"数据库表 {table.name} 新增列: {column.name}")
+
+def add_missing_indexes():
+    """为已有的表补建模型中新增的索引"""
+    inspector = inspect(engine)
+    with engine.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+            existing = {index["name"] for index in inspector.get_indexes(table.name)}
+            for index in table.indexes:
+                if index.name not in existing:
+                    index.create(bind=conn)
+                    print(f"数据库表 {table.name} 新增索引: {index.name}")
 
 def get_db():
     db = SessionLocal()
@@ -101,7 +132,8 @@ def create_user_recommendation(
     dialect: str,
     recommendation_text: str,
     audio_path: str,
-    share_id: str
+    share_id: str,
+    audio_duration_seconds: int = None
 ):
     db_recommendation = UserRecommendation(
         user_id=user_id,
@@ -114,6 +146,7 @@ def create_user_recommendation(
         dialect=dialect,
         recommendation_text=recommendation_text,
         audio_path=audio_path,
+        audio_duration_seconds=audio_duration_seconds,
         share_id=share_id
     )
     db.add(db_recommendation)
@@ -121,6 +154,38 @@ def create_user_recommendation(
     db.refresh(db_recommendation)
     return db_recommendation
 
+def create_user_recommendations(db: Session, user_id: int, recommendations: list) -> int:
+    """批量写入推荐记录（一次INSERT、一次提交），返回写入条数
+
+    share_id 重复的记录只保留第一条；批量写入与已有记录冲突时退回逐条写入，跳过冲突的记录。
+    """
+    from sqlalchemy import insert
+    from sqlalchemy.exc import IntegrityError
+
+    rows = []
+    seen = set()
+    for recommendation in recommendations:
+        if recommendation["share_id"] not in seen:
+            seen.add(recommendation["share_id"])
+            rows.append({"user_id": user_id, **recommendation})
+    try:
+        db.execute(insert(UserRecommendation), rows)
+        db.commit()
+        return len(rows)
+    except IntegrityError:
+        db.rollback()
+
+    saved = 0
+    for row in rows:
+        try:
+            db.execute(insert(UserRecommendation), [row])
+            db.commit()
+            saved += 1
+        except IntegrityError:
+            db.rollback()
+            print(f"推荐记录已存在，跳过: {row['share_id']}")
+    return saved
+
 def get_user_recommendations(db: Session, user_id: int, skip: int = 0, limit: int = 100):
     return db.query(UserRecommendation).filter(
         UserRecommendation.user_id == user_id
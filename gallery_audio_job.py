@@ -0,0 +1,133 @@
+# Gallery audio job - 后台批量生成画廊音频
+# 多本书并行合成（并发数有上限），已有音频的条目直接跳过；
+# 每完成一本书就写一次检查点，进程中断后重新启动任务会从未完成的书继续
+
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Callable, List, Optional
+
+# 同时合成的书籍数
+GALLERY_AUDIO_WORKERS = int(os.getenv("GALLERY_AUDIO_WORKERS", "3"))
+
+# 每本书需要的音频：(音频类型, 书籍数据中的文本字段)
+GALLERY_AUDIO_TYPES = [("sample", "sample_paragraph"), ("talk", "book_talk_text")]
+
+
+def gallery_audio_key(audio_type: str, isbn: str) -> str:
+    """画廊音频在缓存和检查点中的键，例如 sample_9780451526342"""
+    return f"{audio_type}_{isbn}"
+
+
+class GalleryAudioJob:
+    """画廊音频后台任务
+
+    synthesize(text, filename) 生成音频并返回地址；
+    cached(key) 返回已有音频地址（没有则返回None）；
+    checkpoint(book, {key: 地址}) 在每本书处理结束后持久化新生成的音频。
+    """
+
+    def __init__(self, synthesize: Callable[[str, str], str], cached: Callable[[str], Optional[str]],
+                 checkpoint: Callable[[dict, dict], None], max_workers: int = GALLERY_AUDIO_WORKERS):
+        self._synthesize = synthesize
+        self._cached = cached
+        self._checkpoint = checkpoint
+        self._max_workers = max_workers
+        self._lock = threading.Lock()
+        self._thread = None
+        self._reset(0)
+        self.status = "idle"
+
+    def _reset(self, total: int):
+        self.status = "running"
+        self.total_books = total
+        self.completed_books = 0
+        self.generated_files = 0
+        self.skipped_files = 0
+        self.in_progress = set()
+        self.failed = {}  # isbn -> 错误
+        self.started_at = time.time()
+        self.finished_at = None
+
+    def is_running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, books: List[dict]) -> bool:
+        """在后台线程启动任务；已在运行时返回False"""
+        with self._lock:
+            if self.is_running():
+                return False
+            self._reset(len(books))
+            self._thread = threading.Thread(target=self._run, args=(list(books),), name="gallery-audio-job", daemon=True)
+            self._thread.start()
+            return True
+
+    def wait(self, timeout: Optional[float] = None):
+        """等待当前任务结束（命令行批量导入时使用）"""
+        thread = self._thread
+        if thread is not None:
+            thread.join(timeout)
+
+    def progress(self) -> dict:
+        with self._lock:
+            finished = self.completed_books + len(self.failed)
+            return {
+                "status": self.status,
+                "total_books": self.total_books,
+                "completed_books": self.completed_books,
+                "failed_books": len(self.failed),
+                "generated_files": self.generated_files,
+                "skipped_files": self.skipped_files,
+                "in_progress": sorted(self.in_progress),
+                "errors": dict(self.failed),
+                "percent": round(finished / self.total_books * 100, 1) if self.total_books else 100.0,
+                "elapsed_seconds": round((self.finished_at or time.time()) - self.started_at, 1)
+            }
+
+    def _run(self, books: List[dict]):
+        print(f"🎵 画廊音频任务开始: {len(books)} 本书, 并发 {self._max_workers}")
+        with ThreadPoolExecutor(max_workers=self._max_workers, thread_name_prefix="gallery-audio") as executor:
+            futures = {executor.submit(self._process_book, book): book for book in books}
+            for future in as_completed(futures):
+                book = futures[future]
+                try:
+                    future.result()
+                    with self._lock:
+                        self.completed_books += 1
+                except Exception as e:
+                    print(f"画廊音频生成失败 {book['title']}: {str(e)}")
+                    with self._lock:
+                        self.failed[book["isbn"]] = str(e)
+
+        with self._lock:
+            self.status = "completed" if not self.failed else "completed_with_errors"
+            self.finished_at = time.time()
+        print(f"🎵 画廊音频任务结束: {self.completed_books}/{self.total_books} 本完成, "
+              f"生成 {self.generated_files} 个, 跳过 {self.skipped_files} 个")
+
+    def _process_book(self, book: dict):
+        isbn = book["isbn"]
+        with self._lock:
+            self.in_progress.add(isbn)
+        try:
+            urls = {}
+            try:
+                for audio_type, text_field in GALLERY_AUDIO_TYPES:
+                    key = gallery_audio_key(audio_type, isbn)
+                    cached_url = self._cached(key)
+                    if cached_url:
+                        with self._lock:
+                            self.skipped_files += 1
+                        continue
+
+                    urls[key] = self._synthesize(book[text_field], f"gallery_{audio_type}_{isbn}")
+                    with self._lock:
+                        self.generated_files += 1
+            finally:
+                # 即使这本书中途失败，也保存已生成的部分，下次只补缺失的音频
+                if urls:
+                    self._checkpoint(book, urls)
+        finally:
+            with self._lock:
+                self.in_progress.discard(isbn)
@@ -1,33 +1,54 @@
-from fastapi import FastAPI, HTTPException, Depends, status, File, UploadFile
-from fastapi.staticfiles import StaticFiles
+from fastapi import FastAPI, HTTPException, Depends, status, File, UploadFile, Request
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import HTMLResponse, FileResponse
+from fastapi.responses import HTMLResponse, FileResponse, StreamingResponse, RedirectResponse, JSONResponse
 from fastapi.security import HTTPBearer
 from pydantic import BaseModel, EmailStr
-from sqlalchemy.orm import Session
+from sqlalchemy import func
+from sqlalchemy.orm import Session, load_only
 from typing import Optional, List
 import requests
 import os
 from dotenv import load_dotenv
 import hashlib
+import uuid
 from pathlib import Path
 from datetime import timedelta
 import urllib.parse
 import json
 import cloudinary
-import cloudinary.uploader
 import base64
 import io
+import time
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from collections import deque
 from PIL import Image
 
 from database import (
-    create_tables, get_db, get_user_by_email, get_user_by_username,
-    create_user, create_user_recommendation, get_user_recommendations,
+    create_tables, get_db, SessionLocal, get_user_by_email, get_user_by_username,
+    create_user, create_user_recommendation, create_user_recommendations, get_user_recommendations,
     get_recommendation_by_share_id, User, UserRecommendation,
     get_user_by_verification_token, verify_user_email, update_verification_token,
-    get_book_by_isbn, update_book_audio_urls, create_book_if_not_exists
+    get_book_by_isbn, update_book_audio_urls, create_book_if_not_exists, engine
 )
-from book_gallery import BookTalkGallery, SAMPLE_BOOKS
+from book_gallery import BookTalkGallery, GalleryAudioAsset, SAMPLE_BOOKS
+from book_catalog import BookCatalog, build_book_catalog, normalize_title
+from book_search import BookSearchIndex
+from cefr_estimator import estimate_level, estimator_available, level_vocabulary, local_estimate_enabled
+from book_similarity import SimilarityIndex, build_similarity_index
+from structured_output import StructuredOutputError, chat_json, strict_object
+from prompt_cache import PromptCache, fill_template, make_template, prompt_fingerprint
+import ocr_engine
+from audio_upload import AudioUploadQueue, audio_url_available, cloudinary_audio_url
+from audio_delivery import AUDIO_MEDIA_TYPES, audio_file_response
+from audio_transcode import FFMPEG_AVAILABLE, negotiate_format, ready_variant, schedule_variants
+from mp3_info import Mp3Scanner
+from precomputed_response import PrecomputedJSON
+from stream_drain import StreamDrain
+from tts_router import TTSRouter
+from gallery_audio_job import GalleryAudioJob, gallery_audio_key
 from auth import (
     create_access_token, get_current_user, get_current_user_optional,
     ACCESS_TOKEN_EXPIRE_MINUTES
@@ -68,105 +89,557 @@ Path("audio").mkdir(exist_ok=True)
 # 创建数据库表
 create_tables()
 
+# 画廊和Discovery内容的全文索引
+book_search_index = BookSearchIndex(engine)
+book_search_index.create()
+
 # 简单的内存存储来记录每个分享的语言信息
 share_language_store = {}
 
 # 存储Cloudinary音频URL的缓存
 cloudinary_audio_cache = {}
 
+# 后台Cloudinary上传队列 - TTS音频先写本地立即返回，上传完成后切换为CDN URL
+audio_upload_queue = AudioUploadQueue()
+
+@audio_upload_queue.on_uploaded
+def switch_audio_to_cdn_url(local_path: str, cdn_url: str):
+    """上传完成后，把内存缓存和数据库中记录的本地音频地址替换为CDN URL"""
+    for cache_key, url in list(cloudinary_audio_cache.items()):
+        if url == local_path:
+            cloudinary_audio_cache[cache_key] = cdn_url
+
+    for response in discovery_cache.values():
+        if response.sample_audio_url == local_path:
+            response.sample_audio_url = cdn_url
+        if response.book_talk_audio_url == local_path:
+            response.book_talk_audio_url = cdn_url
+
+    db = SessionLocal()
+    try:
+        updated = db.query(UserRecommendation).filter(
+            UserRecommendation.audio_path == local_path
+        ).update({UserRecommendation.audio_path: cdn_url}, synchronize_session=False)
+        db.query(GalleryAudioAsset).filter(
+            GalleryAudioAsset.audio_url == local_path
+        ).update({GalleryAudioAsset.audio_url: cdn_url}, synchronize_session=False)
+        gallery_updated = 0
+        for column in GALLERY_AUDIO_COLUMNS.values():
+            gallery_updated += db.query(BookTalkGallery).filter(
+                column == local_path
+            ).update({column: cdn_url}, synchronize_session=False)
+        db.commit()
+        if gallery_updated:
+            invalidate_gallery_cache()
+        if updated:
+            print(f"已更新 {updated} 条推荐记录的音频地址: {cdn_url}")
+    finally:
+        db.close()
+
+# 本地书目索引 - 用于把OCR片段直接匹配为书名
+book_catalog = BookCatalog()
+
+# 本地相似书籍索引 - 画廊书籍和用户推荐历史的向量矩阵
+book_similarity_index = SimilarityIndex()
+similarity_index_built_at = 0.0
+similarity_rebuild_lock = threading.Lock()
+SIMILARITY_REBUILD_INTERVAL = int(os.getenv("SIMILARITY_REBUILD_INTERVAL", "3600"))
+
+# 本地相似推荐达到这么多本时，书架分析不再让模型推荐书籍
+SHELF_LOCAL_RECOMMENDATIONS_MIN = 3
+SHELF_LOCAL_RECOMMENDATIONS_LIMIT = 5
+# 多取一些候选：模型识别出书架上的其他书后，要从推荐中去掉这些书
+SHELF_LOCAL_RECOMMENDATIONS_CANDIDATES = 15
+
 # Flag to track if gallery audio is being generated
 gallery_audio_generating = False
 
 # Startup event to populate audio cache
 @app.on_event("startup")
 async def startup_event():
+    seed_gallery_books()
+    rebuild_book_catalog()
+    rebuild_search_index()
+    rebuild_similarity_index()
     await warmup_gallery_audio()
 
-def populate_audio_cache_from_files():
-    """Pre-populate cache with existing valid audio files"""
+@app.on_event("shutdown")
+async def shutdown_event():
+    ocr_engine.shutdown()
+
+def seed_gallery_books():
+    """把示例书籍写入画廊表（已存在的跳过）"""
+    db = SessionLocal()
+    try:
+        for book_data in SAMPLE_BOOKS:
+            create_book_if_not_exists(db, book_data)
+    except Exception as e:
+        print(f"Gallery seed failed: {e}")
+    finally:
+        db.close()
+    invalidate_gallery_cache()
+
+def rebuild_book_catalog():
+    """从数据库、示例书籍和可选书目文件重建本地书目索引"""
+    global book_catalog
     try:
-        print("🎵 Checking for existing gallery audio files...")
-        populated_count = 0
+        db = SessionLocal()
+        try:
+            catalog = build_book_catalog(db)
+        finally:
+            db.close()
 
         for book_data in SAMPLE_BOOKS:
-            isbn = book_data['isbn']
-
-            # Check sample audio
-            sample_path = f"audio/gallery_sample_{isbn}.mp3"
-            if Path(sample_path).exists() and Path(sample_path).stat().st_size > 100:
-                cloudinary_audio_cache[f"sample_{isbn}"] = sample_path
-                populated_count += 1
-                print(f"✓ Found valid sample audio for {book_data['title']}")
-
-            # Check talk audio
-            talk_path = f"audio/gallery_talk_{isbn}.mp3"
-            if Path(talk_path).exists() and Path(talk_path).stat().st_size > 100:
-                cloudinary_audio_cache[f"talk_{isbn}"] = talk_path
-                populated_count += 1
-                print(f"✓ Found valid talk audio for {book_data['title']}")
-
-        if populated_count > 0:
-            print(f"🎵 Pre-populated audio cache with {populated_count} files")
-        else:
-            print("⚠️  No valid audio files found - gallery will trigger regeneration")
+            catalog.add(book_data["title"], book_data["author"], source="gallery")
 
+        book_catalog = catalog
+        print(f"📚 本地书目索引已构建，共 {len(book_catalog)} 本书")
     except Exception as e:
-        print(f"Cache population failed: {e}")
+        print(f"Book catalog build failed: {e}")
 
-async def warmup_gallery_audio():
-    """Pre-populate cache and optionally generate missing audio"""
-    global gallery_audio_generating
-    if gallery_audio_generating:
-        return
+def rebuild_search_index():
+    """用画廊表重建全文索引"""
+    try:
+        count = book_search_index.rebuild_gallery()
+        print(f"🔎 全文索引已重建（{book_search_index.backend or 'LIKE'}），共 {count} 本画廊书籍")
+    except Exception as e:
+        print(f"Search index build failed: {e}")
 
-    gallery_audio_generating = True
+def rebuild_similarity_index():
+    """从画廊表和推荐历史重建相似书籍索引"""
+    global book_similarity_index, similarity_index_built_at
+    if not similarity_rebuild_lock.acquire(blocking=False):
+        return  # 已有重建在进行
     try:
-        # First, try to populate from existing files
-        populate_audio_cache_from_files()
+        start_time = time.perf_counter()
+        db = SessionLocal()
+        try:
+            index = build_similarity_index(db)
+        finally:
+            db.close()
+        book_similarity_index = index
+        similarity_index_built_at = time.time()
+        print(f"🧭 相似书籍索引已构建，共 {len(index)} 本书 ({(time.perf_counter() - start_time) * 1000:.0f}ms)")
+    except Exception as e:
+        print(f"Similarity index build failed: {e}")
+    finally:
+        similarity_rebuild_lock.release()
 
-        # If cache is still empty, we'll let the frontend trigger regeneration
-        if not cloudinary_audio_cache:
-            print("🎵 Audio cache empty - frontend will trigger background generation")
-        else:
-            print(f"🎵 Gallery audio cache ready with {len(cloudinary_audio_cache)} files")
+def schedule_similarity_rebuild():
+    """有新的推荐记录时，距上次构建超过间隔则在后台重建（推荐历史变化不需要立即生效）"""
+    if time.time() - similarity_index_built_at >= SIMILARITY_REBUILD_INTERVAL:
+        threading.Thread(target=rebuild_similarity_index, name="similarity-rebuild", daemon=True).start()
+
+def local_shelf_recommendations(books: List[dict], limit: int = SHELF_LOCAL_RECOMMENDATIONS_LIMIT) -> List[dict]:
+    """根据书架上已确认的书，从本地索引推荐画廊中的书籍（与AI返回的recommended_books格式一致）
+
+    只推荐画廊书籍：推荐历史中的书名是用户自由输入的，可能有错别字，也没有作者信息。
+    """
+    return [
+        {
+            "title": book["title"],
+            "author": book["author"] or "未知",
+            "reason": f"与《{book['because_of']}》的主题和风格相近",
+            "match_score": book["score"],
+            "source": "local"
+        }
+        for book in book_similarity_index.recommend_for(books, limit=limit)
+    ]
+
+def exclude_shelf_books(recommendations: List[dict], shelf_books: List[dict],
+                        limit: int = SHELF_LOCAL_RECOMMENDATIONS_LIMIT) -> List[dict]:
+    """去掉书架上已有的书（包括模型识别出的书），保留前 limit 本"""
+    shelf_keys = {normalize_title(book.get("title", "")) for book in shelf_books}
+    return [book for book in recommendations if normalize_title(book["title"]) not in shelf_keys][:limit]
+
+def gallery_audio_books() -> List[dict]:
+    """画廊表中需要音频的书籍（示例书籍和导入的书籍），只取生成音频需要的字段"""
+    db = SessionLocal()
+    try:
+        books = db.query(
+            BookTalkGallery.isbn, BookTalkGallery.title, BookTalkGallery.author,
+            BookTalkGallery.sample_paragraph, BookTalkGallery.book_talk_text
+        ).filter(BookTalkGallery.isbn.isnot(None))
+        return [
+            {
+                "isbn": book.isbn,
+                "title": book.title,
+                "author": book.author,
+                "sample_paragraph": book.sample_paragraph,
+                "book_talk_text": book.book_talk_text
+            }
+            for book in books
+            if book.sample_paragraph and book.book_talk_text
+        ]
+    finally:
+        db.close()
+
+def verify_gallery_audio() -> List[dict]:
+    """校验画廊音频：本地文件、数据库音频索引和Cloudinary（并行HEAD请求），返回仍缺音频的书籍
+
+    临时主机（如Render）重启后本地文件会丢失，但Cloudinary上的音频仍在；
+    索引中的地址失效时依次尝试按public_id推算的CDN地址和本地文件，都不可用才算缺失。
+    能确认存在的地址写入内存缓存，与索引不同时更新索引；改用本地文件时重新提交上传。
+    """
+    print("🎵 Checking for existing gallery audio...")
+    db = SessionLocal()
+    try:
+        index = {asset.cache_key: asset.audio_url for asset in db.query(GalleryAudioAsset)}
+    finally:
+        db.close()
+
+    # 每个音频的候选地址，按优先级排列：索引中的CDN地址、按public_id推算的CDN地址、本地文件
+    books = gallery_audio_books()
+    candidates = {}
+    local_files = {}
+    for book_data in books:
+        for audio_type in ("sample", "talk"):
+            cache_key = gallery_audio_key(audio_type, book_data["isbn"])
+            filename = f"gallery_{audio_type}_{book_data['isbn']}"
+            urls = []
+            if index.get(cache_key, "").startswith("http"):
+                urls.append(index[cache_key])
+            derived_url = cloudinary_audio_url(filename)
+            if derived_url and derived_url not in urls:
+                urls.append(derived_url)
+            local_path = f"audio/{filename}.mp3"
+            if Path(local_path).exists() and Path(local_path).stat().st_size > 100:
+                urls.append(local_path)
+                local_files[local_path] = filename
+            candidates[cache_key] = urls
+
+    # 先只检查每个音频的第一个CDN地址；失效的再检查推算的地址，避免对所有音频都发两次HEAD请求
+    remote_urls = set()
+    available = {}
+    for round_index in range(2):
+        urls_to_check = set()
+        for urls in candidates.values():
+            remote = [url for url in urls if url.startswith("http")]
+            if round_index < len(remote) and not any(available.get(url) for url in remote[:round_index]):
+                urls_to_check.add(remote[round_index])
+        urls_to_check -= remote_urls
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            available.update(zip(urls_to_check, executor.map(audio_url_available, urls_to_check)))
+        remote_urls |= urls_to_check
+
+    found = {}
+    for cache_key, urls in candidates.items():
+        for url in urls:
+            if not url.startswith("http") or available.get(url):
+                found[cache_key] = url
+                break
+
+    for cache_key, url in found.items():
+        cloudinary_audio_cache[cache_key] = url
+
+    # 把新发现的CDN地址写回索引，下次启动直接命中；画廊表中的音频地址同步更新
+    db = SessionLocal()
+    try:
+        for cache_key, url in found.items():
+            audio_type, isbn = cache_key.split("_", 1)
+            db.query(BookTalkGallery).filter(BookTalkGallery.isbn == isbn).update(
+                {GALLERY_AUDIO_COLUMNS[audio_type]: url}, synchronize_session=False
+            )
+            if index.get(cache_key) == url or not (url.startswith("http") or cache_key in index):
+                continue
+            if not url.startswith("http"):
+                # 索引中的CDN地址已失效，改为本地文件并重新上传，上传完成后回调会把地址换回CDN
+                audio_upload_queue.submit(url, local_files[url])
+            asset = db.query(GalleryAudioAsset).filter(GalleryAudioAsset.cache_key == cache_key).first()
+            if asset:
+                asset.audio_url = url
+            else:
+                db.add(GalleryAudioAsset(cache_key=cache_key, isbn=isbn, audio_type=audio_type, audio_url=url))
+        db.commit()
+    finally:
+        db.close()
+    invalidate_gallery_cache()
 
+    missing_books = [
+        book_data for book_data in books
+        if any(gallery_audio_key(audio_type, book_data["isbn"]) not in found for audio_type in ("sample", "talk"))
+    ]
+    print(f"🎵 Gallery audio verified: {len(found)}/{len(candidates)} files available, "
+          f"{len(remote_urls)} CDN checks, {len(missing_books)} books missing audio")
+    return missing_books
+
+def warmup_gallery_audio_in_background():
+    """后台校验画廊音频，只为真正缺失的书籍启动合成任务"""
+    global gallery_audio_generating
+    try:
+        missing_books = verify_gallery_audio()
+        if not missing_books:
+            print(f"🎵 Gallery audio cache ready with {len(cloudinary_audio_cache)} files")
+        elif OPENAI_API_KEY or ELEVENLABS_API_KEY:
+            gallery_audio_job.start(missing_books)
+        else:
+            print("⚠️  No TTS service configured - missing gallery audio will not be generated")
     except Exception as e:
         print(f"Gallery audio warmup failed: {e}")
     finally:
         gallery_audio_generating = False
 
-def get_book_audio_url(db: Session, isbn: str, audio_type: str) -> str:
-    """Get audio URL from memory cache, check local files, or use fallback"""
-    cache_key = f"{audio_type}_{isbn}"
+async def warmup_gallery_audio():
+    """启动时校验和补全画廊音频，在后台线程中进行，不推迟服务就绪"""
+    global gallery_audio_generating
+    if gallery_audio_generating:
+        return
 
-    # Return cached URL if available
-    if cache_key in cloudinary_audio_cache:
-        return cloudinary_audio_cache[cache_key]
+    gallery_audio_generating = True
+    threading.Thread(target=warmup_gallery_audio_in_background, name="gallery-audio-warmup", daemon=True).start()
+
+def gallery_audio_cached(cache_key: str) -> Optional[str]:
+    """已有的画廊音频地址：CDN URL，或仍然存在的本地文件"""
+    url = cloudinary_audio_cache.get(cache_key)
+    if not url:
+        return None
+    if url.startswith("http"):
+        return url
+    if Path(url).exists() and Path(url).stat().st_size > 100:
+        return url
+    return None
+
+def load_gallery_audio_index():
+    """从数据库中的画廊音频索引补全内存缓存（跳过已不存在的本地文件）"""
+    db = SessionLocal()
+    try:
+        for asset in db.query(GalleryAudioAsset):
+            if asset.cache_key in cloudinary_audio_cache:
+                continue
+            if asset.audio_url.startswith("http") or Path(asset.audio_url).exists():
+                cloudinary_audio_cache[asset.cache_key] = asset.audio_url
+    finally:
+        db.close()
 
-    # Check if local file exists and is valid (> 100 bytes)
-    local_path = f"audio/gallery_{audio_type}_{isbn}.mp3"
-    local_file_path = Path(local_path)
+def checkpoint_gallery_audio(book_data: dict, urls: dict):
+    """一本书的音频生成后立即写入数据库索引和内存缓存"""
+    db = SessionLocal()
+    try:
+        book = create_book_if_not_exists(db, book_data)
+        for cache_key, audio_url in urls.items():
+            audio_type = cache_key.split("_", 1)[0]
+            # 上传可能在合成返回后已经完成
+            audio_url = audio_upload_queue.resolve(audio_url)
+            asset = db.query(GalleryAudioAsset).filter(GalleryAudioAsset.cache_key == cache_key).first()
+            if not asset:
+                asset = GalleryAudioAsset(cache_key=cache_key, isbn=book_data["isbn"], audio_type=audio_type)
+                db.add(asset)
+            asset.audio_url = audio_url
+
+            setattr(book, GALLERY_AUDIO_COLUMNS[audio_type].key, audio_url)
+
+            audio_info = audio_info_cache.pop(f"gallery_{audio_type}_{book_data['isbn']}", None)
+            if audio_info:
+                asset.duration_seconds = audio_duration(audio_info)
+                asset.bitrate_kbps = audio_info["bitrate_kbps"]
+                asset.sample_rate = audio_info["sample_rate"]
+                if audio_type == "sample":
+                    book.sample_duration_seconds = asset.duration_seconds
+                else:
+                    book.book_talk_duration_seconds = asset.duration_seconds
+            cloudinary_audio_cache[cache_key] = audio_url
+        db.commit()
+        print(f"✓ 画廊音频检查点: {book_data['title']} ({len(urls)} 个文件)")
+    finally:
+        db.close()
+    invalidate_gallery_cache()
+
+# 画廊表中存放各类音频地址的列
+GALLERY_AUDIO_COLUMNS = {
+    "sample": BookTalkGallery.sample_audio_path,
+    "talk": BookTalkGallery.book_talk_audio_path
+}
+
+# 画廊音频后台任务 - 多本书并行合成，每本书完成后写检查点
+gallery_audio_job = GalleryAudioJob(
+    synthesize=lambda text, filename: text_to_speech(text, filename, "English"),
+    cached=gallery_audio_cached,
+    checkpoint=checkpoint_gallery_audio
+)
 
-    if local_file_path.exists() and local_file_path.stat().st_size > 100:
-        # File exists and is reasonably sized, return local path
-        return local_path
+# 画廊分页响应缓存 - (画廊版本, 筛选条件, 游标, 数量, 音频状态) -> 预先序列化并压缩的响应
+# 画廊版本（MAX(updated_at) + 行数）每次请求都查询，其他进程（例如 catalog_import）修改画廊表后旧条目不再命中；
+# 时间戳可能只精确到秒，同一秒内的多次修改靠较短的TTL兜底。本进程修改书籍或音频地址时直接清空
+GALLERY_PAGE_CACHE_SIZE = 256
+GALLERY_PAGE_CACHE_TTL = int(os.getenv("GALLERY_PAGE_CACHE_TTL", "60"))
+gallery_page_cache = PromptCache(max_entries=GALLERY_PAGE_CACHE_SIZE, ttl_seconds=GALLERY_PAGE_CACHE_TTL)
+GALLERY_PAGE_SIZE = 50
+GALLERY_MAX_PAGE_SIZE = 200
+
+def invalidate_gallery_cache():
+    """本进程修改了画廊表：清空缓存，下次检查画廊版本时只记录新版本，不当作外部导入"""
+    global known_gallery_version
+    gallery_page_cache.clear()
+    known_gallery_version = None
+
+def gallery_version(db: Session) -> tuple:
+    """画廊表的版本戳：最近修改时间和行数（插入、修改、删除都会改变）"""
+    updated_at, count = db.query(func.max(BookTalkGallery.updated_at), func.count(BookTalkGallery.id)).one()
+    return str(updated_at), count
+
+# 最近一次看到的画廊版本；版本变化而本进程没有修改过画廊表，说明其他进程（例如 catalog_import）导入了书籍
+known_gallery_version = None
+gallery_version_checked_at = 0.0
+gallery_indexes_rebuilding = False
+gallery_version_lock = threading.Lock()
+GALLERY_VERSION_CHECK_INTERVAL = 5
+
+def check_gallery_version(db: Optional[Session] = None) -> Optional[tuple]:
+    """检查画廊版本，发现其他进程的修改时清空画廊缓存，并在后台重建书目、全文和相似书籍索引
+
+    画廊列表每次请求都传入db检查；搜索和相似书籍接口不传db，最多每 GALLERY_VERSION_CHECK_INTERVAL 秒查询一次。
+    """
+    global known_gallery_version, gallery_version_checked_at, gallery_indexes_rebuilding
+    if db is None:
+        if time.time() - gallery_version_checked_at < GALLERY_VERSION_CHECK_INTERVAL:
+            return None
+        db = SessionLocal()
+        try:
+            return check_gallery_version(db)
+        finally:
+            db.close()
+
+    version = gallery_version(db)
+    with gallery_version_lock:
+        gallery_version_checked_at = time.time()
+        # 重建进行中时不记录新版本，重建结束后的下一次检查会再发现变化
+        if version == known_gallery_version or gallery_indexes_rebuilding:
+            return version
+        external = known_gallery_version is not None
+        known_gallery_version = version
+        gallery_indexes_rebuilding = external
+
+    if external:
+        print("🔄 画廊表已被其他进程修改，刷新画廊缓存并重建索引")
+        gallery_page_cache.clear()
+        threading.Thread(target=rebuild_gallery_indexes, daemon=True).start()
+    return version
+
+def rebuild_gallery_indexes():
+    global gallery_indexes_rebuilding
+    try:
+        rebuild_book_catalog()
+        rebuild_search_index()
+        rebuild_similarity_index()
+    finally:
+        gallery_indexes_rebuilding = False
+
+# 画廊书籍可返回的字段 -> (需要加载的列, 取值函数)
+GALLERY_FIELDS = {
+    "id": ([BookTalkGallery.id], lambda book: book.id),
+    "title": ([BookTalkGallery.title], lambda book: book.title),
+    "author": ([BookTalkGallery.author], lambda book: book.author),
+    "isbn": ([BookTalkGallery.isbn], lambda book: book.isbn),
+    "cover_url": (
+        [BookTalkGallery.cover_url, BookTalkGallery.isbn],
+        lambda book: book.cover_url or f"https://covers.openlibrary.org/b/isbn/{book.isbn}-L.jpg"
+    ),
+    "cefr_level": ([BookTalkGallery.cefr_level], lambda book: book.cefr_level),
+    "estimated_vocabulary": ([BookTalkGallery.estimated_vocabulary], lambda book: book.estimated_vocabulary),
+    "formal_models": (
+        [BookTalkGallery.formal_models],
+        lambda book: json.loads(book.formal_models) if book.formal_models else []
+    ),
+    "sample_paragraph": ([BookTalkGallery.sample_paragraph], lambda book: book.sample_paragraph),
+    "sample_audio_path": ([BookTalkGallery.sample_audio_path], lambda book: book.sample_audio_path),
+    "sample_duration_seconds": ([BookTalkGallery.sample_duration_seconds], lambda book: book.sample_duration_seconds),
+    "book_talk_text": ([BookTalkGallery.book_talk_text], lambda book: book.book_talk_text),
+    "book_talk_audio_path": ([BookTalkGallery.book_talk_audio_path], lambda book: book.book_talk_audio_path),
+    "book_talk_duration_seconds": (
+        [BookTalkGallery.book_talk_duration_seconds], lambda book: book.book_talk_duration_seconds
+    ),
+    "genre": ([BookTalkGallery.genre], lambda book: book.genre),
+    "publication_year": ([BookTalkGallery.publication_year], lambda book: book.publication_year),
+    "page_count": ([BookTalkGallery.page_count], lambda book: book.page_count),
+    "goodreads_rating": ([BookTalkGallery.goodreads_rating], lambda book: book.goodreads_rating)
+}
+
+# 列表默认只返回卡片需要的字段，长文本通过详情接口加载
+GALLERY_LIST_FIELDS = [
+    "id", "title", "author", "cefr_level", "genre", "cover_url",
+    "sample_audio_path", "book_talk_audio_path"
+]
+
+def parse_gallery_fields(fields: Optional[str]) -> List[str]:
+    """解析 fields= 参数（逗号分隔），id 始终返回"""
+    if not fields:
+        return GALLERY_LIST_FIELDS
+    requested = [field.strip() for field in fields.split(",") if field.strip()]
+    unknown = [field for field in requested if field not in GALLERY_FIELDS]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(unknown)}")
+    return ["id"] + [field for field in dict.fromkeys(requested) if field != "id"]
+
+def gallery_load_columns(fields: List[str]) -> list:
+    """字段对应需要从数据库加载的列"""
+    columns = {}
+    for field in fields:
+        for column in GALLERY_FIELDS[field][0]:
+            columns[column.key] = column
+    return list(columns.values())
+
+def serialize_gallery_book(book: BookTalkGallery, fields: List[str] = None) -> dict:
+    """画廊书籍行 -> API返回的字典（默认全部字段）"""
+    return {field: GALLERY_FIELDS[field][1](book) for field in (fields or GALLERY_FIELDS)}
+
+# 流式TTS任务 - job_id -> 文本、语言、方言和音频文件名
+# 创建任务不需要登录，按数量和时间淘汰（LRU + TTL），避免内存无限增长；过期后需要重新创建任务
+TTS_STREAM_JOB_LIMIT = int(os.getenv("TTS_STREAM_JOB_LIMIT", "500"))
+TTS_STREAM_JOB_TTL = int(os.getenv("TTS_STREAM_JOB_TTL", str(3600)))
+tts_stream_jobs = PromptCache(max_entries=TTS_STREAM_JOB_LIMIT, ttl_seconds=TTS_STREAM_JOB_TTL)
+# 正在合成的流式TTS任务 - job_id -> StreamDrain；同一任务同时只向TTS服务请求一次，保存完成后移除
+tts_stream_drains = {}
+tts_stream_drains_lock = threading.Lock()
+
+# 合成音频的时长/码率信息 - 文件名 -> MP3帧头扫描结果，写入数据库后移除
+audio_info_cache = {}
+AUDIO_INFO_CACHE_SIZE = 1000
+
+def remember_audio_info(filename: str, audio_info: Optional[dict]):
+    if not audio_info:
+        return
+    audio_info_cache.pop(filename, None)
+    audio_info_cache[filename] = audio_info
+    while len(audio_info_cache) > AUDIO_INFO_CACHE_SIZE:
+        audio_info_cache.pop(next(iter(audio_info_cache)))
 
-    # File doesn't exist or is too small - return placeholder that will trigger regeneration
-    print(f"Audio file {local_path} missing or invalid (size: {local_file_path.stat().st_size if local_file_path.exists() else 0} bytes)")
-    return f"audio/gallery_{audio_type}_{isbn}.mp3"
+def audio_duration(audio_info: Optional[dict]) -> Optional[int]:
+    return round(audio_info["duration_seconds"]) if audio_info else None
 
 # Discovery缓存 - 存储用户发现的书籍分析
 discovery_cache = {}
 
-# 挂载音频文件服务
-app.mount("/audio", StaticFiles(directory="audio"), name="audio")
-
 # API密钥
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 ELEVENLABS_API_KEY = os.getenv("ELEVENLABS_API_KEY")
 AZURE_SPEECH_KEY = os.getenv("AZURE_SPEECH_KEY")
 AZURE_SPEECH_REGION = os.getenv("AZURE_SPEECH_REGION")
 
+# TTS音频本地缓存（关闭后音频只流式上传到Cloudinary，不落盘）
+AUDIO_LOCAL_CACHE = os.getenv("AUDIO_LOCAL_CACHE", "true").lower() == "true"
+TTS_STREAM_CHUNK_SIZE = 16 * 1024
+
+# 外部API超时（秒）：(连接超时, 读取超时)；流式响应的读取超时作用于每次读取之间的间隔
+TTS_REQUEST_TIMEOUT = (float(os.getenv("TTS_CONNECT_TIMEOUT", "3")), float(os.getenv("TTS_READ_TIMEOUT", "15")))
+OPENAI_CHAT_TIMEOUT = (float(os.getenv("OPENAI_CONNECT_TIMEOUT", "5")), float(os.getenv("OPENAI_READ_TIMEOUT", "60")))
+
+# 书架分析视觉档位阈值（OCR质量分0-1）：高于TEXT_ONLY只发文字，高于LOW_DETAIL发低清图片，否则发高清图片
+OCR_TEXT_ONLY_THRESHOLD = float(os.getenv("OCR_TEXT_ONLY_THRESHOLD", "0.85"))
+OCR_LOW_DETAIL_THRESHOLD = float(os.getenv("OCR_LOW_DETAIL_THRESHOLD", "0.6"))
+
+# 批量书架分析单次最多接受的图片数
+MAX_BATCH_SHELF_IMAGES = int(os.getenv("MAX_BATCH_SHELF_IMAGES", "6"))
+
+# 批量推荐：每次最多收件人数、同时进行的GPT/TTS调用数
+MAX_BATCH_RECIPIENTS = int(os.getenv("MAX_BATCH_RECIPIENTS", "30"))
+RECOMMENDATION_BATCH_CONCURRENCY = int(os.getenv("RECOMMENDATION_BATCH_CONCURRENCY", "4"))
+
+# 进行中的批量推荐任务
+batch_recommendation_tasks = set()
+
+# 最近的书架分析记录（token用量与延迟），用于调优上述阈值
+shelf_analysis_metrics = deque(maxlen=500)
+
 # 数据模型
 class BookRecommendation(BaseModel):
     book_title: str
@@ -177,11 +650,24 @@ class BookRecommendation(BaseModel):
     language: str = "中文"
     dialect: str = "zh-CN-XiaoxiaoNeural"
 
+class BatchRecipient(BaseModel):
+    recipient_name: str
+    relationship: str = "朋友"
+    recipient_interests: str = ""
+
+class BatchRecommendationRequest(BaseModel):
+    book_title: str
+    recipients: List[BatchRecipient]
+    tone: str = "友好热情"
+    language: str = "中文"
+    dialect: str = "zh-CN-XiaoxiaoNeural"
+
 class RecommendationResponse(BaseModel):
     success: bool
     recommendation_text: str
     audio_path: str
     share_id: str
+    audio_duration_seconds: Optional[int] = None
 
 class UserCreate(BaseModel):
     username: str
@@ -238,6 +724,11 @@ class BookDiscoveryResponse(BaseModel):
     formal_models: List[str]
     analysis_id: str
 
+class TTSStreamRequest(BaseModel):
+    text: str
+    language: str = "English"
+    dialect: str = "zh-CN-XiaoxiaoNeural"
+
 class ShelfAnalysisResponse(BaseModel):
     success: bool
     detected_books: List[dict]
@@ -247,9 +738,49 @@ class ShelfAnalysisResponse(BaseModel):
     confidence_score: float
     analysis_id: str
 
+class BatchShelfAnalysisResponse(ShelfAnalysisResponse):
+    image_timings: List[dict]
+    total_ms: float
+
+# 推荐文本缓存 - 按规范化的请求参数缓存GPT结果（LRU + TTL）
+recommendation_cache = PromptCache(
+    max_entries=int(os.getenv("RECOMMENDATION_CACHE_SIZE", "2000")),
+    ttl_seconds=float(os.getenv("RECOMMENDATION_CACHE_TTL", str(7 * 24 * 3600)))
+)
+# 可选：只有收件人名字不同时复用已生成的文本（替换名字），每个模板最多复用几次
+RECOMMENDATION_TEMPLATE_REUSE = os.getenv("RECOMMENDATION_TEMPLATE_REUSE", "false").lower() == "true"
+RECOMMENDATION_TEMPLATE_MAX_REUSE = int(os.getenv("RECOMMENDATION_TEMPLATE_MAX_REUSE", "3"))
+recommendation_template_cache = PromptCache(
+    max_entries=int(os.getenv("RECOMMENDATION_CACHE_SIZE", "2000")),
+    ttl_seconds=float(os.getenv("RECOMMENDATION_CACHE_TTL", str(7 * 24 * 3600)))
+)
+
 # GPT生成推荐文本
 def generate_recommendation_text(book_title: str, recipient_name: str, relationship: str, interests: str, tone: str, language: str) -> str:
-    """使用GPT生成个性化书籍推荐文本"""
+    """使用GPT生成个性化书籍推荐文本（先查缓存）"""
+    cache_key = prompt_fingerprint(book_title, recipient_name, relationship, interests, tone, language)
+    cached_text = recommendation_cache.get(cache_key)
+    if cached_text:
+        return cached_text
+
+    template_key = prompt_fingerprint(book_title, relationship, interests, tone, language)
+    if RECOMMENDATION_TEMPLATE_REUSE:
+        template = recommendation_template_cache.get(template_key, max_uses=RECOMMENDATION_TEMPLATE_MAX_REUSE)
+        if template:
+            recommendation_text = fill_template(template, recipient_name)
+            recommendation_cache.put(cache_key, recommendation_text)
+            return recommendation_text
+
+    recommendation_text = request_recommendation_text(book_title, recipient_name, relationship, interests, tone, language)
+    recommendation_cache.put(cache_key, recommendation_text)
+    if RECOMMENDATION_TEMPLATE_REUSE:
+        template = make_template(recommendation_text, recipient_name)
+        if template:
+            recommendation_template_cache.put(template_key, template)
+    return recommendation_text
+
+def request_recommendation_text(book_title: str, recipient_name: str, relationship: str, interests: str, tone: str, language: str) -> str:
+    """调用GPT生成推荐文本"""
     
     if language == "English":
         prompt = f"""
@@ -307,7 +838,7 @@ Generate the recommendation:
     
     try:
         response = requests.post("https://api.openai.com/v1/chat/completions", 
-                               headers=headers, json=data)
+                               headers=headers, json=data, timeout=OPENAI_CHAT_TIMEOUT)
         response.raise_for_status()
         result = response.json()
         return result["choices"][0]["message"]["content"].strip()
@@ -316,38 +847,72 @@ Generate the recommendation:
         raise HTTPException(status_code=500, detail=f"GPT API错误: {str(e)}")
 
 # 智能文本转语音 - 根据语言选择最佳API
-def upload_to_cloudinary(local_path: str, public_id: str) -> str:
-    """上传音频文件到Cloudinary并返回URL"""
-    try:
-        print(f"上传文件到Cloudinary: {local_path} -> {public_id}")
-
-        response = cloudinary.uploader.upload(
-            local_path,
-            public_id=public_id,
-            resource_type="video",  # 用于音频文件
-            folder="shh-elf-audio",  # 组织文件的文件夹
-            overwrite=True
-        )
-
-        cloudinary_url = response['secure_url']
-        print(f"Cloudinary URL: {cloudinary_url}")
+def iter_tts_stream(response: requests.Response, filename: str, result: Optional[dict] = None):
+    """逐块产出TTS音频，同时写入本地缓存文件和Cloudinary流式上传，不在内存中保存完整音频
 
-        # 删除本地文件以节省空间
-        try:
-            os.remove(local_path)
-            print(f"已删除本地文件: {local_path}")
-        except:
-            pass
-
-        return cloudinary_url
+    同时扫描MP3帧头，结束后把时长、码率等信息记入 audio_info_cache。
 
-    except Exception as e:
-        print(f"Cloudinary上传错误: {str(e)}")
-        # 如果上传失败，返回本地路径作为后备
-        return local_path
+    只有完整读完响应后才会落盘并完成上传；中途中断（例如TTS连接断开）时丢弃不完整的音频。
+    result 非空时，结束后写入 result["audio_path"]（本地路径或CDN URL）。
+    """
+    audio_path = f"audio/{filename}.mp3"
+    local_path = audio_path if AUDIO_LOCAL_CACHE else None
+    pipe, upload_future = audio_upload_queue.submit_stream(local_path, filename)
+    if pipe is None and local_path is None:
+        response.close()
+        raise Exception("本地音频缓存已关闭且Cloudinary未配置，无法保存音频")
+
+    # 先写临时文件，写完再原子替换，避免其他请求读到不完整的音频
+    part_path = f"{audio_path}.{uuid.uuid4().hex[:8]}.part"
+    local_file = open(part_path, "wb") if local_path else None
+    # 边接收边解析MP3帧头，得到时长和码率
+    scanner = Mp3Scanner()
+    try:
+        for chunk in response.iter_content(chunk_size=TTS_STREAM_CHUNK_SIZE):
+            if not chunk:
+                continue
+            scanner.feed(chunk)
+            if local_file:
+                local_file.write(chunk)
+            if pipe:
+                pipe.write(chunk)
+            yield chunk
+    except BaseException as e:
+        if pipe:
+            pipe.abort(e)
+        if local_file:
+            local_file.close()
+            os.remove(part_path)
+        raise
+    finally:
+        response.close()
+
+    if local_file:
+        local_file.close()
+        os.replace(part_path, audio_path)
+        # 后台生成体积更小的Opus/AAC版本
+        schedule_variants(Path(audio_path))
+    if pipe:
+        pipe.close()
+
+    audio_info = scanner.result()
+    remember_audio_info(filename, audio_info)
+    if audio_info:
+        print(f"音频时长: {audio_info['duration_seconds']}秒, {audio_info['bitrate_kbps']}kbps, {audio_info['sample_rate']}Hz")
+
+    if result is not None:
+        # 开启本地缓存时直接返回本地音频地址，上传在后台完成
+        result["audio_path"] = audio_path if local_path else upload_future.result()
+
+def save_tts_stream(response: requests.Response, filename: str) -> str:
+    """完整读取TTS响应并保存，返回音频地址"""
+    result = {}
+    for _ in iter_tts_stream(response, filename, result):
+        pass
+    return result["audio_path"]
 
 def text_to_speech(text: str, filename: str, language: str, dialect: str = "zh-CN-XiaoxiaoNeural") -> str:
-    """根据语言选择最佳TTS服务：中文使用Azure方言语音，英文使用ElevenLabs"""
+    """根据语言选择TTS服务：中文使用Azure方言语音，英文使用ElevenLabs，由tts_router按实时延迟和错误率调整"""
 
     print(f"=== 语音生成调试信息 ===")
     print(f"文本: {text}")
@@ -355,11 +920,18 @@ def text_to_speech(text: str, filename: str, language: str, dialect: str = "zh-C
     print(f"语言: {language}")
     print(f"方言: {dialect}")
 
-    if language == "中文":
-        # 使用Azure Speech Services和用户选择的方言
-        return azure_text_to_speech(text, filename, dialect)
-    else:
-        return elevenlabs_text_to_speech(text, filename)
+    try:
+        response = open_tts_stream(text, language, dialect)
+        audio_path = save_tts_stream(response, filename)
+        print(f"音频文件已保存: {audio_path}")
+        return audio_path
+    except Exception as e:
+        print(f"TTS错误: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"语音生成错误: {str(e)}")
+
+def open_tts_stream(text: str, language: str, dialect: str = "zh-CN-XiaoxiaoNeural") -> requests.Response:
+    """打开一个流式TTS响应：路由到最快的健康服务，主服务过慢时对冲请求后备服务"""
+    return tts_router.open(text, "中文" if language == "中文" else "English", dialect)
 
 def enhance_text_with_ssml(text: str) -> str:
     """智能增强中文文本的SSML标记，改善断句和语调"""
@@ -391,12 +963,8 @@ def enhance_text_with_ssml(text: str) -> str:
 
     return enhanced
 
-def azure_text_to_speech(text: str, filename: str, voice_name: str = "zh-CN-XiaoxiaoNeural") -> str:
-    """使用Azure Speech Services生成中文语音 - 专业中文声优"""
-
-    if not AZURE_SPEECH_KEY or not AZURE_SPEECH_REGION:
-        print("Azure Speech Services未配置，回退到OpenAI TTS")
-        return openai_text_to_speech(text, filename)
+def azure_tts_request(text: str, voice_name: str = "zh-CN-XiaoxiaoNeural") -> requests.Response:
+    """向Azure Speech Services发起流式TTS请求，返回尚未读取正文的响应"""
 
     # Azure Speech Services endpoint
     url = f"https://{AZURE_SPEECH_REGION}.tts.speech.microsoft.com/cognitiveservices/v1"
@@ -416,30 +984,15 @@ def azure_text_to_speech(text: str, filename: str, voice_name: str = "zh-CN-Xiao
     </voice>
 </speak>"""
 
-    try:
-        print(f"使用Azure Speech Services生成中文语音...")
-        print(f"声音: {voice_name}")
-        print(f"SSML内容: {ssml}")
-        response = requests.post(url, headers=headers, data=ssml.encode('utf-8'))
-        print(f"Azure Speech响应状态: {response.status_code}")
-        response.raise_for_status()
-
-        audio_path = f"audio/{filename}.mp3"
-        with open(audio_path, "wb") as f:
-            f.write(response.content)
-
-        print(f"Azure中文音频文件已保存: {audio_path}")
-
-        # 上传到Cloudinary
-        cloudinary_url = upload_to_cloudinary(audio_path, filename)
-        return cloudinary_url
-    except Exception as e:
-        print(f"Azure Speech错误: {str(e)}")
-        print("回退到OpenAI TTS")
-        return openai_text_to_speech(text, filename)
+    print(f"声音: {voice_name}")
+    print(f"SSML内容: {ssml}")
+    response = requests.post(url, headers=headers, data=ssml.encode('utf-8'), stream=True, timeout=TTS_REQUEST_TIMEOUT)
+    print(f"Azure Speech响应状态: {response.status_code}")
+    response.raise_for_status()
+    return response
 
-def openai_text_to_speech(text: str, filename: str) -> str:
-    """使用OpenAI TTS生成中文语音 - 更自然的中文发音"""
+def openai_tts_request(text: str) -> requests.Response:
+    """向OpenAI TTS发起流式请求（中英文通用），返回尚未读取正文的响应"""
 
     url = "https://api.openai.com/v1/audio/speech"
 
@@ -451,35 +1004,21 @@ def openai_text_to_speech(text: str, filename: str) -> str:
     data = {
         "model": "tts-1",  # 或 tts-1-hd 用于更高质量
         "input": text,
-        "voice": "alloy",  # 支持中文的声音: alloy, echo, fable, onyx, nova, shimmer
+        "voice": "alloy",  # 支持中英文的声音: alloy, echo, fable, onyx, nova, shimmer
         "response_format": "mp3",
         "speed": 1.0
     }
 
-    try:
-        print(f"使用OpenAI TTS生成中文语音...")
-        response = requests.post(url, json=data, headers=headers)
-        print(f"OpenAI TTS响应状态: {response.status_code}")
-        response.raise_for_status()
-
-        audio_path = f"audio/{filename}.mp3"
-        with open(audio_path, "wb") as f:
-            f.write(response.content)
-
-        print(f"中文音频文件已保存: {audio_path}")
-
-        # 上传到Cloudinary
-        cloudinary_url = upload_to_cloudinary(audio_path, filename)
-        return cloudinary_url
-    except Exception as e:
-        print(f"OpenAI TTS错误: {str(e)}")
-        raise HTTPException(status_code=500, detail=f"中文语音生成错误: {str(e)}")
+    response = requests.post(url, json=data, headers=headers, stream=True, timeout=TTS_REQUEST_TIMEOUT)
+    print(f"OpenAI TTS响应状态: {response.status_code}")
+    response.raise_for_status()
+    return response
 
-def elevenlabs_text_to_speech(text: str, filename: str) -> str:
-    """使用ElevenLabs生成英文语音"""
+def elevenlabs_tts_request(text: str) -> requests.Response:
+    """向ElevenLabs发起流式TTS请求，返回尚未读取正文的响应"""
 
     voice_id = "9BWtsMINqrJLrRacOk9x"  # Aria voice
-    url = f"https://api.elevenlabs.io/v1/text-to-speech/{voice_id}"
+    url = f"https://api.elevenlabs.io/v1/text-to-speech/{voice_id}/stream"
 
     headers = {
         "Accept": "audio/mpeg",
@@ -498,30 +1037,36 @@ def elevenlabs_text_to_speech(text: str, filename: str) -> str:
         }
     }
 
-    try:
-        print(f"使用ElevenLabs生成英文语音...")
-        response = requests.post(url, json=data, headers=headers)
-        print(f"ElevenLabs响应状态: {response.status_code}")
-        response.raise_for_status()
+    response = requests.post(url, json=data, headers=headers, stream=True, timeout=TTS_REQUEST_TIMEOUT)
+    print(f"ElevenLabs响应状态: {response.status_code}")
+    response.raise_for_status()
+    return response
 
-        audio_path = f"audio/{filename}.mp3"
-        with open(audio_path, "wb") as f:
-            f.write(response.content)
+def analyze_book_with_ai(book_title: str, author: str, user_level: str = "B2") -> dict:
+    """使用AI分析任意书籍，获取第一段、难度、formal models等
 
-        print(f"英文音频文件已保存: {audio_path}")
+    输出按JSON Schema校验，修复重试后仍无效时抛出 StructuredOutputError。
+    """
 
-        # 上传到Cloudinary
-        cloudinary_url = upload_to_cloudinary(audio_path, filename)
-        return cloudinary_url
-    except Exception as e:
-        print(f"ElevenLabs错误: {str(e)}")
-        print("回退到OpenAI TTS生成英文语音")
-        return openai_english_text_to_speech(text, filename)
+    # 开启 CEFR_LOCAL_ESTIMATE 且有词频表时，CEFR难度和词汇量由本地估算器根据第一段计算，不再让模型猜
+    estimate_locally = local_estimate_enabled()
+    if estimate_locally:
+        analysis_prompt = f"""
+    Analyze the book "{book_title}" by {author} for English learners at {user_level} level. Provide the following information in English:
 
-def analyze_book_with_ai(book_title: str, author: str, user_level: str = "B2") -> dict:
-    """使用AI分析任意书籍，获取第一段、难度、formal models等"""
+    1. Find or create the actual first paragraph of this book (approximately 150-200 words)
+    2. Identify 2-3 formal models (e.g., rational thinking, form-giving, illusion vs reality, social critique, etc.)
+    3. Write an engaging book talk recommendation (100-150 words, explaining why this book is worth reading)
 
-    analysis_prompt = f"""
+    Return in JSON format in English:
+    {{
+        "first_paragraph": "The actual first paragraph text...",
+        "formal_models": ["model1", "model2", "model3"],
+        "book_talk": "Book recommendation text in English..."
+    }}
+    """
+    else:
+        analysis_prompt = f"""
     Analyze the book "{book_title}" by {author} for English learners at {user_level} level. Provide the following information in English:
 
     1. Find or create the actual first paragraph of this book (approximately 150-200 words)
@@ -540,154 +1085,219 @@ def analyze_book_with_ai(book_title: str, author: str, user_level: str = "B2") -
     }}
     """
 
+    properties = {
+        "first_paragraph": {"type": "string"},
+        "formal_models": {"type": "array", "items": {"type": "string"}},
+        "book_talk": {"type": "string"}
+    }
+    if not estimate_locally:
+        properties["cefr_level"] = {"type": "string", "enum": ["A1", "A2", "B1", "B2", "C1", "C2"]}
+        properties["estimated_vocabulary"] = {"type": "integer"}
+
+    def check(analysis: dict) -> Optional[str]:
+        for field in ("first_paragraph", "book_talk"):
+            if not analysis[field].strip():
+                return f"'{field}' must not be empty"
+        if not analysis["formal_models"]:
+            return "'formal_models' must list at least one model"
+        return None
+
+    # 失败时直接抛出异常，不返回占位内容（否则占位文本会被合成语音、写入Discovery缓存和画廊）
     try:
-        response = requests.post(
-            "https://api.openai.com/v1/chat/completions",
-            headers={
-                "Authorization": f"Bearer {OPENAI_API_KEY}",
-                "Content-Type": "application/json"
-            },
-            json={
-                "model": "gpt-4o-mini",
-                "messages": [{"role": "user", "content": analysis_prompt}],
-                "temperature": 0.3
-            }
+        result = chat_json(
+            [{"role": "user", "content": analysis_prompt}], "book_analysis", strict_object(properties),
+            OPENAI_API_KEY, model="gpt-4o-mini", temperature=0.3, timeout=OPENAI_CHAT_TIMEOUT, check=check
         )
-
-        if response.status_code == 200:
-            result = response.json()
-            ai_content = result['choices'][0]['message']['content']
-
-            # 尝试解析JSON
-            import json
-            try:
-                # 提取JSON部分
-                start = ai_content.find('{')
-                end = ai_content.rfind('}') + 1
-                json_str = ai_content[start:end]
-                analysis = json.loads(json_str)
-                return analysis
-            except:
-                # 如果JSON解析失败，返回默认值
-                return {
-                    "first_paragraph": f"Sorry, could not retrieve the first paragraph of {book_title} by {author}. This is a placeholder text for analysis purposes.",
-                    "cefr_level": user_level,
-                    "estimated_vocabulary": 6000,
-                    "formal_models": ["literary analysis", "narrative structure", "character development"],
-                    "book_talk": f"{book_title} by {author} is a compelling work that offers rich opportunities for language learning and literary appreciation."
-                }
-        else:
-            raise Exception(f"OpenAI API error: {response.status_code}")
-
     except Exception as e:
         print(f"AI analysis error: {str(e)}")
-        # 返回默认分析
-        return {
-            "first_paragraph": f"Unable to analyze {book_title} by {author} at this time. Please try again later.",
-            "cefr_level": user_level,
-            "estimated_vocabulary": 6000,
-            "formal_models": ["literary analysis", "narrative structure"],
-            "book_talk": f"We're currently unable to provide a detailed analysis of {book_title}, but it remains an interesting choice for language learners."
-        }
-
-def openai_english_text_to_speech(text: str, filename: str) -> str:
-    """使用OpenAI TTS生成英文语音（ElevenLabs备用方案）"""
-
-    url = "https://api.openai.com/v1/audio/speech"
-
-    headers = {
-        "Authorization": f"Bearer {OPENAI_API_KEY}",
-        "Content-Type": "application/json"
-    }
+        raise
 
-    data = {
-        "model": "tts-1",
-        "input": text,
-        "voice": "alloy",  # 适合英文的声音
-        "response_format": "mp3",
-        "speed": 1.0
-    }
+    analysis = result["data"]
+    if estimate_locally:
+        estimate = estimate_level(analysis["first_paragraph"])
+        if estimate:
+            analysis["cefr_level"] = estimate["cefr_level"]
+            analysis["estimated_vocabulary"] = estimate["estimated_vocabulary"]
+        else:
+            # 第一段太短无法估算
+            analysis["cefr_level"] = user_level
+            analysis["estimated_vocabulary"] = level_vocabulary(user_level)
+    elif estimator_available():
+        # 记录本地估算与模型判断不一致的书，用于校准估算器
+        estimate = estimate_level(analysis["first_paragraph"])
+        if estimate and estimate["cefr_level"] != analysis["cefr_level"]:
+            print(f"📏 CEFR估算差异: {book_title} 模型 {analysis['cefr_level']}/{analysis['estimated_vocabulary']}, "
+                  f"本地 {estimate['cefr_level']}/{estimate['estimated_vocabulary']}")
+    return analysis
+
+# TTS服务路由 - 注册顺序即样本不足时的偏好：中文优先Azure方言语音，英文优先ElevenLabs，OpenAI中英文通用
+tts_router = TTSRouter()
+tts_router.register(
+    "azure", azure_tts_request, languages={"中文"},
+    configured=lambda: bool(AZURE_SPEECH_KEY and AZURE_SPEECH_REGION)
+)
+tts_router.register(
+    "elevenlabs", lambda text, voice: elevenlabs_tts_request(text), languages={"English"},
+    configured=lambda: bool(ELEVENLABS_API_KEY), fixed_voice="aria"
+)
+tts_router.register(
+    "openai", lambda text, voice: openai_tts_request(text), languages={"中文", "English"},
+    configured=lambda: bool(OPENAI_API_KEY), fixed_voice="alloy"
+)
 
+# OCR文字提取功能
+def extract_ocr_result(image_base64: str) -> dict:
+    """使用OCR从书架图片中提取文字，并根据逐词置信度计算OCR质量分（0-1）"""
     try:
-        print(f"使用OpenAI TTS生成英文语音（ElevenLabs备用）...")
-        response = requests.post(url, json=data, headers=headers)
-        print(f"OpenAI TTS响应状态: {response.status_code}")
-        response.raise_for_status()
-
-        audio_path = f"audio/{filename}.mp3"
-        with open(audio_path, "wb") as f:
-            f.write(response.content)
+        # 解码base64图片，直接以内存缓冲区交给OCR引擎
+        image_data = base64.b64decode(image_base64)
+        result = ocr_engine.recognize_image(image_data)
 
-        print(f"英文音频文件已保存: {audio_path}")
+        print(f"📖 OCR提取的文字: {result['text'][:200]}...")
+        print(f"📖 OCR质量分: {result['quality']} ({result['char_count']} 字符, {ocr_engine.active_backend()})")
+        return result
 
-        # 上传到Cloudinary
-        cloudinary_url = upload_to_cloudinary(audio_path, filename)
-        return cloudinary_url
     except Exception as e:
-        print(f"OpenAI TTS错误: {str(e)}")
-        raise HTTPException(status_code=500, detail=f"英文语音生成错误: {str(e)}")
+        print(f"OCR提取失败: {str(e)}")
+        return {"text": "", "quality": 0.0, "char_count": 0}
 
-# OCR文字提取功能
 def extract_text_from_bookshelf(image_base64: str) -> str:
     """使用OCR从书架图片中提取文字"""
-    try:
-        import pytesseract
-        import cv2
-        import numpy as np
-
-        # 解码base64图片
-        image_data = base64.b64decode(image_base64)
-        nparr = np.frombuffer(image_data, np.uint8)
-        image = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-
-        # 图像预处理，提高OCR效果
-        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-
-        # 增强对比度
-        clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8,8))
-        gray = clahe.apply(gray)
-
-        # 降噪
-        denoised = cv2.fastNlMeansDenoising(gray)
-
-        # 锐化
-        kernel = np.array([[-1,-1,-1], [-1,9,-1], [-1,-1,-1]])
-        sharpened = cv2.filter2D(denoised, -1, kernel)
-
-        # 配置OCR参数
-        custom_config = r'--oem 3 --psm 6 -c tessedit_char_whitelist=ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789一二三四五六七八九十百千万亿《》（）()[]【】：:：，、。！？.,!?-—'
-
-        # 提取文字
-        text = pytesseract.image_to_string(sharpened, lang='chi_sim+eng', config=custom_config)
+    return extract_ocr_result(image_base64)["text"]
+
+def choose_vision_detail(ocr_result: dict) -> str:
+    """根据OCR质量选择视觉分析档位：text（仅文字）、low（低清图片）、high（高清图片）"""
+    if len(ocr_result["text"]) <= 20:
+        return "high"
+    if ocr_result["quality"] >= OCR_TEXT_ONLY_THRESHOLD:
+        return "text"
+    if ocr_result["quality"] >= OCR_LOW_DETAIL_THRESHOLD:
+        return "low"
+    return "high"
+
+def record_shelf_analysis_metrics(vision_detail: str, model: str, ocr_quality: float, usage: dict, latency_ms: float):
+    """记录每次书架分析的token用量和延迟，便于调优OCR阈值"""
+    record = {
+        "timestamp": time.time(),
+        "vision_detail": vision_detail,
+        "model": model,
+        "ocr_quality": ocr_quality,
+        "prompt_tokens": usage.get("prompt_tokens", 0),
+        "completion_tokens": usage.get("completion_tokens", 0),
+        "total_tokens": usage.get("total_tokens", 0),
+        "latency_ms": round(latency_ms, 1)
+    }
+    shelf_analysis_metrics.append(record)
+    print(f"📊 书架分析: detail={vision_detail}, OCR质量={ocr_quality}, tokens={record['total_tokens']}, 延迟={record['latency_ms']}ms")
+
+def merge_detected_books(*book_lists: List[dict]) -> List[dict]:
+    """合并多组识别结果，按规范化书名去重，保留先出现（置信度更高来源）的条目"""
+    merged = []
+    seen = set()
+    for books in book_lists:
+        for book in books:
+            key = normalize_title(book.get("title", ""))
+            if not key or key in seen:
+                continue
+            seen.add(key)
+            merged.append(book)
+    return merged
 
-        print(f"📖 OCR提取的文字: {text[:200]}...")
-        return text.strip()
+# 书架智能分析功能 - OCR + AI混合方案
+def prepare_shelf_image(image_base64: str) -> dict:
+    """书架图片的本地处理阶段：OCR、本地书目匹配、选择视觉档位（不调用AI）"""
+    start_time = time.perf_counter()
+
+    # 第一步：使用OCR提取文字，并根据OCR质量决定是否需要发送图片及清晰度
+    ocr_result = extract_ocr_result(image_base64)
+    ocr_text = ocr_result["text"]
+
+    # 第二步：本地书目模糊匹配，已确认的书籍不再交给AI识别，只发送剩余的OCR文字
+    catalog_books, unresolved_lines = book_catalog.resolve(ocr_text)
+    if catalog_books:
+        print(f"📚 本地书目命中 {len(catalog_books)} 本: {[book['title'] for book in catalog_books]}")
+        ocr_text = "\n".join(unresolved_lines)
+
+    if catalog_books and len(ocr_text) <= 20:
+        vision_detail = "text"
+    else:
+        vision_detail = choose_vision_detail(ocr_result)
 
-    except Exception as e:
-        print(f"OCR提取失败: {str(e)}")
-        return ""
+    return {
+        "image_base64": image_base64,
+        "ocr_text": ocr_text,
+        "ocr_quality": ocr_result["quality"],
+        "catalog_books": catalog_books,
+        "vision_detail": vision_detail,
+        "ocr_ms": round((time.perf_counter() - start_time) * 1000, 1)
+    }
 
-# 书架智能分析功能 - OCR + AI混合方案
 def analyze_bookshelf_image(image_base64: str) -> dict:
     """使用OCR + AI混合方案分析书架图片，识别书籍并分析偏好"""
+    return analyze_shelf_images([prepare_shelf_image(image_base64)])
 
-    # 第一步：使用OCR提取文字
-    ocr_text = extract_text_from_bookshelf(image_base64)
+def analyze_shelf_images(shelves: List[dict]) -> dict:
+    """把一张或多张已完成本地处理的书架图片合并成一次AI调用"""
 
-    headers = {
-        "Authorization": f"Bearer {OPENAI_API_KEY}",
-        "Content-Type": "application/json"
-    }
+    catalog_books = merge_detected_books(*(shelf["catalog_books"] for shelf in shelves))
+    if len(shelves) == 1:
+        ocr_text = shelves[0]["ocr_text"]
+    else:
+        ocr_text = "\n\n".join(
+            f"[图片{i}]\n{shelf['ocr_text']}" for i, shelf in enumerate(shelves, 1) if shelf["ocr_text"]
+        )
+
+    # 只有OCR不够可靠的图片才需要发送给视觉模型
+    vision_shelves = [shelf for shelf in shelves if shelf["vision_detail"] != "text"]
+    detail_rank = {"text": 0, "low": 1, "high": 2}
+    vision_detail = max((shelf["vision_detail"] for shelf in shelves), key=detail_rank.get)
+    ocr_quality = round(sum(shelf["ocr_quality"] for shelf in shelves) / len(shelves), 3)
+
+    # 本地书目已确认的书足够推荐时，推荐书籍由本地相似索引给出，模型只需识别和分析偏好
+    local_recommendations = local_shelf_recommendations(
+        catalog_books, limit=SHELF_LOCAL_RECOMMENDATIONS_CANDIDATES
+    ) if catalog_books else []
+    if len(local_recommendations) < SHELF_LOCAL_RECOMMENDATIONS_MIN:
+        local_recommendations = []
+    if local_recommendations:
+        recommend_task = "3. 推荐书籍已由本地书目生成，无需返回recommended_books"
+        recommended_books_schema = ""
+    else:
+        recommend_task = "3. 推荐相关书籍（3-5本）"
+        recommended_books_schema = """
+            "recommended_books": [
+                {
+                    "title": "推荐书名",
+                    "author": "作者",
+                    "reason": "基于识别书籍的推荐理由",
+                    "match_score": 0.8
+                }
+            ],"""
 
     # 根据OCR结果调整分析策略
-    if ocr_text and len(ocr_text.strip()) > 20:
+    if (ocr_text and len(ocr_text.strip()) > 20) or catalog_books:
+        known_books_section = ""
+        if catalog_books:
+            known_titles = "\n        ".join(f"- {book['title']} / {book['author']}" for book in catalog_books)
+            known_books_section = f"""
+        以下书籍已通过本地书目确认，无需在detected_books中重复列出，但请纳入阅读偏好分析和推荐：
+        {known_titles}
+"""
+
+        if not vision_shelves:
+            source_instruction = "OCR文字质量较高，请基于上述OCR文字来分析这个书架，执行以下任务："
+        else:
+            source_instruction = "请同时结合图片和上述OCR文字来分析这个书架，执行以下任务："
+        if len(shelves) > 1:
+            source_instruction = f"这些文字和图片来自同一个书架的{len(shelves)}张照片，同一本书可能出现在多张照片中，请合并去重。" + source_instruction
+
         analysis_prompt = f"""
         我已经通过OCR技术从书架图片中提取了以下文字内容：
 
         OCR提取的文字：
         {ocr_text}
-
-        请同时结合图片和上述OCR文字来分析这个书架，执行以下任务：
+        {known_books_section}
+        {source_instruction}
 
         分析策略：
         1. 优先使用OCR提取的文字识别书名和作者
@@ -706,7 +1316,7 @@ def analyze_bookshelf_image(image_base64: str) -> dict:
            - 判断阅读水平和专业程度
            - 识别语言偏好和主题兴趣
 
-        3. 推荐相关书籍（3-5本）
+        {recommend_task}
         4. 提供详细的分析总结
 
         请以JSON格式返回结果：
@@ -719,15 +1329,7 @@ def analyze_bookshelf_image(image_base64: str) -> dict:
                 "reading_level": "基于书籍类型的阅读水平",
                 "interests": ["基于书名的兴趣领域"],
                 "author_preferences": "作者偏好分析"
-            }},
-            "recommended_books": [
-                {{
-                    "title": "推荐书名",
-                    "author": "作者",
-                    "reason": "基于识别书籍的推荐理由",
-                    "match_score": 0.8
-                }}
-            ],
+            }},{recommended_books_schema}
             "analysis_summary": "基于OCR文字和图片的综合分析...",
             "confidence_score": 0.8
         }}
@@ -745,69 +1347,92 @@ def analyze_bookshelf_image(image_base64: str) -> dict:
         请尽力从视觉特征推测书籍类型和用户偏好，以JSON格式返回分析结果。
         """
 
-    data = {
-        "model": "gpt-4o",  # 升级到完整版GPT-4o，视觉理解能力更强
-        "messages": [
-            {
-                "role": "user",
-                "content": [
-                    {
-                        "type": "text",
-                        "text": analysis_prompt
-                    },
-                    {
-                        "type": "image_url",
-                        "image_url": {
-                            "url": f"data:image/jpeg;base64,{image_base64}",
-                            "detail": "high"  # 高清晰度分析
-                        }
-                    }
-                ]
-            }
-        ],
-        "max_tokens": 2000,
-        "temperature": 0.2
+    content = [
+        {
+            "type": "text",
+            "text": analysis_prompt
+        }
+    ]
+
+    if not vision_shelves:
+        # OCR已足够清晰，仅发送文字，使用更便宜更快的模型
+        model = "gpt-4o-mini"
+    else:
+        # OCR一般时发送低清图片做校验，OCR很差时才升级到高清分析
+        model = "gpt-4o"  # 升级到完整版GPT-4o，视觉理解能力更强
+        for shelf in vision_shelves:
+            content.append({
+                "type": "image_url",
+                "image_url": {
+                    "url": f"data:image/jpeg;base64,{shelf['image_base64']}",
+                    "detail": shelf["vision_detail"]
+                }
+            })
+
+    properties = {
+        "detected_books": {"type": "array", "items": strict_object({
+            "title": {"type": "string"},
+            "author": {"type": "string"},
+            "genre": {"type": "string"},
+            "confidence": {"type": "number"}
+        })},
+        "reading_preferences": strict_object({
+            "favorite_genres": {"type": "array", "items": {"type": "string"}},
+            "reading_level": {"type": "string"},
+            "interests": {"type": "array", "items": {"type": "string"}},
+            "author_preferences": {"type": "string"}
+        })
     }
+    if not local_recommendations:
+        properties["recommended_books"] = {"type": "array", "items": strict_object({
+            "title": {"type": "string"},
+            "author": {"type": "string"},
+            "reason": {"type": "string"},
+            "match_score": {"type": "number"}
+        })}
+    properties["analysis_summary"] = {"type": "string"}
+    properties["confidence_score"] = {"type": "number"}
 
     try:
-        print("🔍 开始分析书架图片...")
-        response = requests.post("https://api.openai.com/v1/chat/completions",
-                               headers=headers, json=data)
-        response.raise_for_status()
-        result = response.json()
-
-        ai_content = result['choices'][0]['message']['content']
-        print(f"AI分析结果: {ai_content}")
-
-        # 解析JSON响应
-        try:
-            start = ai_content.find('{')
-            end = ai_content.rfind('}') + 1
-            json_str = ai_content[start:end]
-            analysis_result = json.loads(json_str)
-            return analysis_result
-        except:
-            # 如果JSON解析失败，返回默认结构，包含OCR提取的部分信息
-            ocr_info = f"\n\nOCR提取信息: {ocr_text[:100]}..." if ocr_text else ""
-            return {
-                "detected_books": [{"title": "识别困难", "author": "未知", "genre": "混合", "confidence": 0.4}],
-                "reading_preferences": {
-                    "favorite_genres": ["综合阅读"],
-                    "reading_level": "中级",
-                    "interests": ["多元化"],
-                    "author_preferences": "多样化作者"
-                },
-                "recommended_books": [
-                    {
-                        "title": "建议重新拍照",
-                        "author": "系统建议",
-                        "reason": "当前照片清晰度不足，建议在更好的光线下重新拍摄，确保书名清晰可见",
-                        "match_score": 0.3
-                    }
-                ],
-                "analysis_summary": f"分析遇到困难。OCR和图像识别效果不佳，建议：1.确保光线充足 2.书名清晰可见 3.正面拍摄避免反光{ocr_info}",
-                "confidence_score": 0.2
-            }
+        print(f"🔍 开始分析书架图片... ({len(shelves)}张, detail={vision_detail}, model={model})")
+        result = chat_json(
+            [{"role": "user", "content": content}], "shelf_analysis", strict_object(properties),
+            OPENAI_API_KEY, model=model, temperature=0.2, max_tokens=2000, timeout=OPENAI_CHAT_TIMEOUT
+        )
+        record_shelf_analysis_metrics(vision_detail, model, ocr_quality, result["usage"], result["latency_ms"])
+
+        analysis_result = result["data"]
+        print(f"AI分析结果: {json.dumps(analysis_result, ensure_ascii=False)}")
+        analysis_result["detected_books"] = merge_detected_books(catalog_books, analysis_result["detected_books"])
+        if local_recommendations:
+            analysis_result["recommended_books"] = exclude_shelf_books(
+                local_recommendations, analysis_result["detected_books"]
+            )
+        return analysis_result
+    except StructuredOutputError as e:
+        # 修复重试后仍无效：失败的请求同样计入token用量，然后返回重新拍照的建议（只含本地已确认的书籍和本地推荐，不含模型输出）
+        print(f"书架分析输出无效: {str(e)}")
+        record_shelf_analysis_metrics(vision_detail, model, ocr_quality, e.usage, e.latency_ms)
+        ocr_info = f"\n\nOCR提取信息: {ocr_text[:100]}..." if ocr_text else ""
+        return {
+            "detected_books": catalog_books or [{"title": "识别困难", "author": "未知", "genre": "混合", "confidence": 0.4}],
+            "reading_preferences": {
+                "favorite_genres": ["综合阅读"],
+                "reading_level": "中级",
+                "interests": ["多元化"],
+                "author_preferences": "多样化作者"
+            },
+            "recommended_books": local_recommendations[:SHELF_LOCAL_RECOMMENDATIONS_LIMIT] or [
+                {
+                    "title": "建议重新拍照",
+                    "author": "系统建议",
+                    "reason": "当前照片清晰度不足，建议在更好的光线下重新拍摄，确保书名清晰可见",
+                    "match_score": 0.3
+                }
+            ],
+            "analysis_summary": f"分析遇到困难。OCR和图像识别效果不佳，建议：1.确保光线充足 2.书名清晰可见 3.正面拍摄避免反光{ocr_info}",
+            "confidence_score": 0.2
+        }
     except Exception as e:
         print(f"书架分析错误: {str(e)}")
         raise HTTPException(status_code=500, detail=f"书架分析失败: {str(e)}")
@@ -1062,6 +1687,7 @@ async def get_my_recommendations(
             "language": rec.language,
             "recommendation_text": rec.recommendation_text,
             "audio_path": rec.audio_path,
+            "audio_duration_seconds": rec.audio_duration_seconds,
             "share_id": rec.share_id,
             "created_at": rec.created_at.isoformat()
         }
@@ -1367,6 +1993,49 @@ async def resend_verification(username: str, db: Session = Depends(get_db)):
             detail="发送验证邮件失败"
         )
 
+def create_recommendation(req: BookRecommendation) -> dict:
+    """生成一位收件人的推荐文本和语音，返回可直接写入推荐记录的字段"""
+    # 生成推荐文本
+    recommendation_text = generate_recommendation_text(
+        req.book_title,
+        req.recipient_name,
+        req.relationship,
+        req.recipient_interests,
+        req.tone,
+        req.language
+    )
+
+    print(f"生成的推荐文本: {recommendation_text}")
+    print(f"接收到的方言参数: {req.dialect}")
+
+    # 生成唯一的分享ID和文件名：推荐文本可能来自缓存（同样的请求得到同样的文本），
+    # 因此分享ID不能由文本推导，否则重复请求会得到重复的share_id（数据库唯一约束）
+    content_hash = uuid.uuid4().hex[:12]
+    filename = f"rec_{content_hash}"
+
+    # 生成语音文件（上传可能仍在后台进行，此时为本地地址）
+    audio_path = audio_upload_queue.resolve(
+        text_to_speech(recommendation_text, filename, req.language, req.dialect)
+    )
+    audio_duration_seconds = audio_duration(audio_info_cache.pop(filename, None))
+
+    # 存储分享的语言信息
+    share_language_store[content_hash] = req.language
+
+    return {
+        "book_title": req.book_title,
+        "recipient_name": req.recipient_name,
+        "relationship": req.relationship,
+        "recipient_interests": req.recipient_interests,
+        "tone": req.tone,
+        "language": req.language,
+        "dialect": req.dialect,
+        "recommendation_text": recommendation_text,
+        "audio_path": audio_path,
+        "share_id": content_hash,
+        "audio_duration_seconds": audio_duration_seconds
+    }
+
 @app.post("/api/generate-recommendation", response_model=RecommendationResponse)
 async def generate_recommendation(
     req: BookRecommendation,
@@ -1382,58 +2051,25 @@ async def generate_recommendation(
         print(f"兴趣: {req.recipient_interests}")
         print(f"语调: {req.tone}")
         print(f"语言: {req.language}")
-        
-        # 生成推荐文本
-        recommendation_text = generate_recommendation_text(
-            req.book_title, 
-            req.recipient_name, 
-            req.relationship,
-            req.recipient_interests,
-            req.tone,
-            req.language
-        )
-        
-        print(f"生成的推荐文本: {recommendation_text}")
-        print(f"接收到的方言参数: {req.dialect}")
-
-        # 生成唯一文件名
-        content_hash = hashlib.md5(
-            f"{req.book_title}{req.recipient_name}{recommendation_text}".encode()
-        ).hexdigest()[:8]
-        filename = f"rec_{content_hash}"
-        
-        # 生成语音文件
-        audio_path = text_to_speech(recommendation_text, filename, req.language, req.dialect)
 
-        # 存储分享的语言信息
-        share_language_store[content_hash] = req.language
+        recommendation = create_recommendation(req)
 
         # 如果用户已登录，保存到数据库
         if current_user:
-            create_user_recommendation(
-                db=db,
-                user_id=current_user.id,
-                book_title=req.book_title,
-                recipient_name=req.recipient_name,
-                relationship=req.relationship,
-                recipient_interests=req.recipient_interests,
-                tone=req.tone,
-                language=req.language,
-                dialect=req.dialect,
-                recommendation_text=recommendation_text,
-                audio_path=audio_path,
-                share_id=content_hash
-            )
+            create_user_recommendation(db=db, user_id=current_user.id, **recommendation)
+            book_catalog.add(req.book_title, source="recommendation")
+            schedule_similarity_rebuild()
 
         response = RecommendationResponse(
             success=True,
-            recommendation_text=recommendation_text,
-            audio_path=audio_path,
-            share_id=content_hash
+            recommendation_text=recommendation["recommendation_text"],
+            audio_path=recommendation["audio_path"],
+            share_id=recommendation["share_id"],
+            audio_duration_seconds=recommendation["audio_duration_seconds"]
         )
         
         print(f"=== 推荐生成成功 ===")
-        print(f"分享ID: {content_hash}")
+        print(f"分享ID: {recommendation['share_id']}")
         
         return response
         
@@ -1442,6 +2078,99 @@ async def generate_recommendation(
         print(f"错误: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/api/generate-recommendations/batch")
+async def generate_recommendations_batch(
+    req: BatchRecommendationRequest,
+    current_user: Optional[User] = Depends(get_current_user_optional)
+):
+    """一本书推荐给多位收件人（如读书会）：有限并发地生成文本和语音，每完成一位就以NDJSON逐行返回
+
+    每行为一位收件人的结果（index对应请求中的顺序），最后一行为汇总；登录用户的推荐记录在全部完成后一次批量写入。
+    生成和保存在独立的后台任务中进行，客户端中途断开时仍会完成并保存（GPT和TTS的费用已经付出）。
+    """
+    if not req.recipients:
+        raise HTTPException(status_code=400, detail="recipients is required")
+    if len(req.recipients) > MAX_BATCH_RECIPIENTS:
+        raise HTTPException(status_code=400, detail=f"一次最多 {MAX_BATCH_RECIPIENTS} 位收件人")
+
+    print(f"=== 批量推荐请求: {req.book_title}, {len(req.recipients)} 位收件人 ===")
+    user_id = current_user.id if current_user else None
+    lines = asyncio.Queue()
+
+    async def run_batch():
+        start_time = time.perf_counter()
+        semaphore = asyncio.Semaphore(RECOMMENDATION_BATCH_CONCURRENCY)
+
+        async def generate(index: int, recipient: BatchRecipient):
+            single = BookRecommendation(
+                book_title=req.book_title, tone=req.tone, language=req.language, dialect=req.dialect,
+                **recipient.dict()
+            )
+            async with semaphore:
+                try:
+                    return index, await run_in_threadpool(create_recommendation, single), None
+                except Exception as e:
+                    detail = e.detail if isinstance(e, HTTPException) else str(e)
+                    print(f"批量推荐失败 {recipient.recipient_name}: {detail}")
+                    return index, None, detail
+
+        completed = []
+        try:
+            tasks = [asyncio.create_task(generate(index, recipient)) for index, recipient in enumerate(req.recipients)]
+            for next_result in asyncio.as_completed(tasks):
+                index, recommendation, error = await next_result
+                line = {"index": index, "recipient_name": req.recipients[index].recipient_name, "success": error is None}
+                if error is None:
+                    completed.append(recommendation)
+                    line.update({key: recommendation[key] for key in (
+                        "recommendation_text", "audio_path", "share_id", "audio_duration_seconds"
+                    )})
+                else:
+                    line["error"] = error
+                lines.put_nowait(json.dumps(line, ensure_ascii=False) + "\n")
+
+            saved = 0
+            if user_id and completed:
+                try:
+                    saved = await run_in_threadpool(save_batch_recommendations, user_id, completed)
+                except Exception as e:
+                    print(f"批量推荐保存失败: {str(e)}")
+
+            lines.put_nowait(json.dumps({
+                "done": True,
+                "succeeded": len(completed),
+                "failed": len(req.recipients) - len(completed),
+                "saved": saved,
+                "total_ms": round((time.perf_counter() - start_time) * 1000, 1)
+            }, ensure_ascii=False) + "\n")
+        finally:
+            lines.put_nowait(None)
+
+    # 保留任务引用，避免响应结束（客户端断开）后任务被垃圾回收
+    task = asyncio.create_task(run_batch())
+    batch_recommendation_tasks.add(task)
+    task.add_done_callback(batch_recommendation_tasks.discard)
+
+    async def results():
+        while True:
+            line = await lines.get()
+            if line is None:
+                return
+            yield line
+
+    return StreamingResponse(results(), media_type="application/x-ndjson", headers={"Cache-Control": "no-store"})
+
+def save_batch_recommendations(user_id: int, recommendations: List[dict]) -> int:
+    """一次批量写入所有推荐记录，返回写入条数"""
+    db = SessionLocal()
+    try:
+        saved = create_user_recommendations(db, user_id, recommendations)
+    finally:
+        db.close()
+    book_catalog.add(recommendations[0]["book_title"], source="recommendation")
+    schedule_similarity_rebuild()
+    return saved
+
 @app.get("/share/{share_id}")
 async def share_recommendation_page(share_id: str):
     """分享推荐页面 - 支持多语言"""
@@ -1457,6 +2186,13 @@ async def share_recommendation_page(share_id: str):
     else:
         return english_share_page(share_id)
 
+def share_audio_url(share_id: str) -> str:
+    """分享音频地址：后台上传尚未完成时使用本地文件，否则使用Cloudinary"""
+    local_path = f"audio/rec_{share_id}.mp3"
+    if not audio_upload_queue.cdn_url(local_path) and Path(local_path).exists():
+        return f"/{local_path}"
+    return f"https://res.cloudinary.com/dpao9jg0k/video/upload/shh-elf-audio/rec_{share_id}.mp3"
+
 def chinese_share_page(share_id: str) -> HTMLResponse:
     """中文分享页面"""
     html_content = f"""<!DOCTYPE html>
@@ -1512,7 +2248,7 @@ def chinese_share_page(share_id: str) -> HTMLResponse:
                     🎧 语音推荐：
                 </div>
                 <audio controls class="audio-player">
-                    <source src="https://res.cloudinary.com/dpao9jg0k/video/upload/shh-elf-audio/rec_{share_id}.mp3" type="audio/mpeg">
+                    <source src="{share_audio_url(share_id)}" type="audio/mpeg">
                     你的浏览器不支持音频播放。
                 </audio>
             </div>
@@ -1581,7 +2317,7 @@ def english_share_page(share_id: str) -> HTMLResponse:
                     🎧 Audio Recommendation:
                 </div>
                 <audio controls class="audio-player">
-                    <source src="https://res.cloudinary.com/dpao9jg0k/video/upload/shh-elf-audio/rec_{share_id}.mp3" type="audio/mpeg">
+                    <source src="{share_audio_url(share_id)}" type="audio/mpeg">
                     Your browser does not support audio playback.
                 </audio>
             </div>
@@ -1602,8 +2338,7 @@ async def get_shared_recommendation(share_id: str):
     if share_id not in share_language_store:
         raise HTTPException(status_code=404, detail="推荐不存在")
 
-    # Audio is now on Cloudinary, construct URL
-    audio_url = f"https://res.cloudinary.com/dpao9jg0k/video/upload/shh-elf-audio/rec_{share_id}.mp3"
+    audio_url = share_audio_url(share_id)
 
     return {
         "success": True,
@@ -1613,47 +2348,72 @@ async def get_shared_recommendation(share_id: str):
     }
 
 @app.get("/api/book-gallery")
-async def get_book_gallery(db: Session = Depends(get_db)):
-    """获取书籍画廊列表"""
+async def get_book_gallery(
+    request: Request,
+    cefr_level: Optional[str] = None,
+    genre: Optional[str] = None,
+    featured: Optional[bool] = None,
+    cursor: Optional[int] = None,
+    limit: int = GALLERY_PAGE_SIZE,
+    fields: Optional[str] = None,
+    db: Session = Depends(get_db)
+):
+    """获取书籍画廊列表：支持按CEFR等级、类型、精选筛选，按id游标分页
+
+    默认只返回卡片字段（fields= 可选择其他字段），只从数据库加载这些字段对应的列。
+
+    响应在内容变化时才重新序列化和压缩（gzip/brotli），并带ETag，重新验证时返回304。
+    """
     try:
-        # For MVP, return sample data
-        books = []
-        for book_data in SAMPLE_BOOKS:
-            book = {
-                "id": len(books) + 1,
-                "title": book_data["title"],
-                "author": book_data["author"],
-                "isbn": book_data["isbn"],
-                "cover_url": f"https://covers.openlibrary.org/b/isbn/{book_data['isbn']}-L.jpg",
-                "cefr_level": book_data["cefr_level"],
-                "estimated_vocabulary": book_data["estimated_vocabulary"],
-                "formal_models": book_data["formal_models"],
-                "sample_paragraph": book_data["sample_paragraph"],
-                "sample_audio_path": get_book_audio_url(db, book_data['isbn'], 'sample'),
-                "book_talk_text": book_data["book_talk_text"],
-                "book_talk_audio_path": get_book_audio_url(db, book_data['isbn'], 'talk'),
-                "genre": book_data["genre"],
-                "publication_year": book_data["publication_year"],
-                "page_count": book_data["page_count"],
-                "goodreads_rating": book_data["goodreads_rating"]
-            }
-            books.append(book)
+        # Check if audio cache needs regeneration (启动校验或生成任务进行中时不再触发)
+        audio_cache_empty = (
+            not cloudinary_audio_cache
+            and not gallery_audio_generating
+            and not gallery_audio_job.is_running()
+        )
 
-        # Check if audio cache needs regeneration
-        audio_cache_empty = not cloudinary_audio_cache
+        limit = max(1, min(limit, GALLERY_MAX_PAGE_SIZE))
+        selected_fields = parse_gallery_fields(fields)
+        cache_key = (
+            check_gallery_version(db), cefr_level, genre, featured, cursor, limit, tuple(selected_fields), audio_cache_empty
+        )
+        page = gallery_page_cache.get(cache_key)
+
+        if page is None:
+            query = db.query(BookTalkGallery).options(load_only(*gallery_load_columns(selected_fields)))
+            if cefr_level:
+                query = query.filter(BookTalkGallery.cefr_level == cefr_level)
+            if genre:
+                query = query.filter(BookTalkGallery.genre == genre)
+            if featured is not None:
+                query = query.filter(BookTalkGallery.featured == ("true" if featured else "false"))
+            total = query.count()
+
+            if cursor:
+                query = query.filter(BookTalkGallery.id > cursor)
+            rows = query.order_by(BookTalkGallery.id).limit(limit + 1).all()
+            has_more = len(rows) > limit
+            rows = rows[:limit]
+
+            response = {
+                "success": True,
+                "books": [serialize_gallery_book(book, selected_fields) for book in rows],
+                "total": total,
+                "next_cursor": rows[-1].id if has_more else None
+            }
 
-        response = {
-            "success": True,
-            "books": books,
-            "total": len(books)
-        }
+            # Add cache status for frontend auto-detection
+            if audio_cache_empty:
+                response["audio_cache_empty"] = True
+                response["regeneration_url"] = "/api/generate-gallery-audio"
+                response["progress_url"] = "/api/generate-gallery-audio/progress"
 
-        # Add cache status for frontend auto-detection
-        if audio_cache_empty:
-            response["audio_cache_empty"] = True
-            response["regeneration_url"] = "/api/generate-gallery-audio"
+            page = PrecomputedJSON(response)
+            gallery_page_cache.put(cache_key, page)
 
-        return response
+        return page.response(request.headers)
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"Book gallery error: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -1662,32 +2422,13 @@ async def get_book_gallery(db: Session = Depends(get_db)):
 async def get_book_detail(book_id: int, db: Session = Depends(get_db)):
     """获取单本书详细信息"""
     try:
-        if book_id < 1 or book_id > len(SAMPLE_BOOKS):
+        book = db.query(BookTalkGallery).filter(BookTalkGallery.id == book_id).first()
+        if not book:
             raise HTTPException(status_code=404, detail="Book not found")
 
-        book_data = SAMPLE_BOOKS[book_id - 1]
-        book = {
-            "id": book_id,
-            "title": book_data["title"],
-            "author": book_data["author"],
-            "isbn": book_data["isbn"],
-            "cover_url": f"https://covers.openlibrary.org/b/isbn/{book_data['isbn']}-L.jpg",
-            "cefr_level": book_data["cefr_level"],
-            "estimated_vocabulary": book_data["estimated_vocabulary"],
-            "formal_models": book_data["formal_models"],
-            "sample_paragraph": book_data["sample_paragraph"],
-            "sample_audio_path": get_book_audio_url(db, book_data['isbn'], 'sample'),
-            "book_talk_text": book_data["book_talk_text"],
-            "book_talk_audio_path": get_book_audio_url(db, book_data['isbn'], 'talk'),
-            "genre": book_data["genre"],
-            "publication_year": book_data["publication_year"],
-            "page_count": book_data["page_count"],
-            "goodreads_rating": book_data["goodreads_rating"]
-        }
-
         return {
             "success": True,
-            "book": book
+            "book": serialize_gallery_book(book)
         }
     except HTTPException:
         raise
@@ -1696,65 +2437,232 @@ async def get_book_detail(book_id: int, db: Session = Depends(get_db)):
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/api/generate-gallery-audio")
-@app.get("/api/generate-gallery-audio")
-async def generate_gallery_audio(db: Session = Depends(get_db)):
-    """为书籍画廊生成示例音频（管理员功能）"""
+async def generate_gallery_audio():
+    """在后台为书籍画廊生成缺失的音频（管理员功能），立即返回任务进度"""
     try:
-        generated_files = []
-
-        for book_data in SAMPLE_BOOKS:
-            # Generate sample paragraph audio
-            sample_filename = f"gallery_sample_{book_data['isbn']}"
-            sample_audio = text_to_speech(
-                book_data["sample_paragraph"],
-                sample_filename,
-                "English"
-            )
-            generated_files.append(sample_audio)
-            # Cache URL in memory
-            cloudinary_audio_cache[f"sample_{book_data['isbn']}"] = sample_audio
-
-            # Generate book talk audio
-            talk_filename = f"gallery_talk_{book_data['isbn']}"
-            talk_audio = text_to_speech(
-                book_data["book_talk_text"],
-                talk_filename,
-                "English"
-            )
-            generated_files.append(talk_audio)
-            # Cache URL in memory
-            cloudinary_audio_cache[f"talk_{book_data['isbn']}"] = talk_audio
+        await run_in_threadpool(load_gallery_audio_index)
+        books = await run_in_threadpool(gallery_audio_books)
+        started = gallery_audio_job.start(books)
+        progress = gallery_audio_job.progress()
 
         return {
             "success": True,
-            "message": f"Generated {len(generated_files)} audio files for book gallery",
-            "files": generated_files
+            "message": "Gallery audio generation started" if started else "Gallery audio generation already running",
+            "progress_url": "/api/generate-gallery-audio/progress",
+            "job": progress
         }
     except Exception as e:
         print(f"Gallery audio generation error: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
-@app.get("/audio/{filename}")
-async def get_audio_file(filename: str):
-    """获取音频文件，带有 CORS 支持"""
-    audio_path = Path(f"audio/{filename}")
+@app.get("/api/generate-gallery-audio/progress")
+async def get_gallery_audio_progress():
+    """画廊音频任务进度"""
+    return {
+        "success": True,
+        "job": gallery_audio_job.progress()
+    }
+
+@app.api_route("/audio/{filename}", methods=["GET", "HEAD"])
+async def get_audio_file(filename: str, request: Request, format: Optional[str] = None):
+    """获取音频文件：支持Range分段播放和ETag/Last-Modified条件请求
+
+    每个URL只对应一种编码：/audio/xxx.mp3 始终是MP3，Opus/AAC变体在 /audio/xxx.opus、/audio/xxx.m4a。
+    请求MP3时可通过 ?format=opus|aac 或 Accept 头协商更小的格式，变体已生成时302跳转到变体地址；
+    变体尚未生成时先返回MP3并在后台转码。从文件中间开始的Range请求（播放器续读）总是返回MP3，
+    避免同一次播放拿到两种编码的数据。
+    """
+    audio_path = Path("audio") / filename
 
-    if not audio_path.exists() or not filename.endswith('.mp3'):
+    if Path(filename).suffix not in AUDIO_MEDIA_TYPES or not audio_path.is_file():
         raise HTTPException(status_code=404, detail="Audio file not found")
 
-    # 返回文件响应，带有 CORS 头
-    response = FileResponse(
-        path=audio_path,
+    if audio_path.suffix != ".mp3":
+        return audio_file_response(audio_path, request.headers, request.method)
+
+    audio_format = negotiate_format(request.headers.get("accept"), format)
+    if audio_format != "mp3" and is_initial_audio_request(request.headers.get("range")):
+        variant = ready_variant(audio_path, audio_format)
+        if variant:
+            return RedirectResponse(
+                f"/audio/{variant.name}",
+                status_code=302,
+                headers={"Vary": "Accept", "Cache-Control": "no-cache"}
+            )
+        # 变体转码完成前先返回MP3；缓存每次重新验证，转码完成后即可跳转到变体
+        schedule_variants(audio_path, [audio_format])
+
+    response = audio_file_response(audio_path, request.headers, request.method)
+    response.headers["vary"] = "Accept"
+    return response
+
+def is_initial_audio_request(range_header: Optional[str]) -> bool:
+    """没有Range或从第0字节开始的请求才可能换成变体；其余是同一次播放的续读"""
+    if not range_header:
+        return True
+    return range_header.strip().replace(" ", "").startswith("bytes=0-")
+
+def cached_tts_audio_url(filename: str) -> Optional[str]:
+    """已生成过的TTS音频地址：优先CDN，其次本地缓存文件"""
+    local_path = f"audio/{filename}.mp3"
+    cdn_url = audio_upload_queue.cdn_url(local_path) or audio_upload_queue.cdn_url(filename)
+    if cdn_url:
+        return cdn_url
+    if Path(local_path).exists():
+        return local_path
+    return None
+
+@app.post("/api/tts/stream")
+async def create_tts_stream_job(req: TTSStreamRequest):
+    """创建流式TTS任务，返回可直接交给<audio>播放的流地址"""
+    if not req.text.strip():
+        raise HTTPException(status_code=400, detail="文本不能为空")
+    if len(req.text) > 5000:
+        raise HTTPException(status_code=400, detail="文本过长（最多5000字）")
+
+    job_id = hashlib.md5(f"{req.language}_{req.dialect}_{req.text}".encode()).hexdigest()[:12]
+    filename = f"tts_{job_id}"
+    tts_stream_jobs.put(job_id, {
+        "text": req.text,
+        "language": req.language,
+        "dialect": req.dialect,
+        "filename": filename
+    })
+
+    return {
+        "success": True,
+        "job_id": job_id,
+        "stream_url": f"/api/tts/stream/{job_id}",
+        "audio_url": cached_tts_audio_url(filename)
+    }
+
+@app.get("/api/tts/stream/{job_id}")
+async def stream_tts_job(job_id: str, request: Request):
+    """边合成边播放：把TTS服务返回的音频块转发给浏览器
+
+    合成在后台读完并保存，客户端中途断开也不会丢掉已合成的音频；保存完成后的重复请求和Range请求直接读文件，
+    合成进行中的其他请求返回202（稍后重试），不会再次请求TTS服务。
+    """
+    job = tts_stream_jobs.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="TTS任务不存在")
+
+    filename = job["filename"]
+    with tts_stream_drains_lock:
+        generating = job_id in tts_stream_drains
+        # 在锁内检查缓存：合成刚结束时文件已保存、任务已移除，不会重复合成
+        cached_url = None if generating else cached_tts_audio_url(filename)
+        if not generating and not cached_url:
+            tts_stream_drains[job_id] = None  # 占位，打开TTS响应期间的并发请求也返回202
+
+    if generating:
+        return JSONResponse(
+            status_code=202,
+            content={"success": False, "status": "generating", "stream_url": f"/api/tts/stream/{job_id}"},
+            headers={"Retry-After": "2", "Cache-Control": "no-store"}
+        )
+
+    # 已合成过的音频直接返回缓存（支持Range）
+    if cached_url:
+        if cached_url.startswith("http"):
+            return RedirectResponse(cached_url)
+        return audio_file_response(Path(cached_url), request.headers)
+
+    def finish(error: Optional[BaseException]):
+        if error:
+            print(f"流式TTS错误: {str(error)}")
+        with tts_stream_drains_lock:
+            tts_stream_drains.pop(job_id, None)
+
+    try:
+        response = await run_in_threadpool(open_tts_stream, job["text"], job["language"], job["dialect"])
+    except Exception as e:
+        finish(e)
+        raise HTTPException(status_code=500, detail=f"语音生成错误: {str(e)}")
+
+    # result 非空时 iter_tts_stream 会等上传完成，任务移除时缓存地址一定可用
+    drain = StreamDrain(lambda: iter_tts_stream(response, filename, {}), finish)
+    with tts_stream_drains_lock:
+        tts_stream_drains[job_id] = drain
+    drain.start()
+
+    return StreamingResponse(
+        drain.listen(),
         media_type="audio/mpeg",
-        filename=filename
+        headers={"Cache-Control": "no-store"}
     )
 
-    # 添加 CORS 头
-    response.headers["Access-Control-Allow-Origin"] = "*"
-    response.headers["Access-Control-Allow-Methods"] = "GET"
-    response.headers["Access-Control-Allow-Headers"] = "*"
+class SimilarBooksRequest(BaseModel):
+    books: List[dict]  # [{"title": ..., "author": ...}]
+    limit: int = 5
+    gallery_only: bool = True
+
+def similar_books_user_id(gallery_only: bool, current_user: Optional[User]) -> Optional[int]:
+    """gallery_only=false 时也返回登录用户自己推荐过的书；其他用户的推荐历史从不返回"""
+    if gallery_only or current_user is None:
+        return None
+    return current_user.id
+
+@app.get("/api/similar-books")
+async def get_similar_books(title: str, limit: int = 5, gallery_only: bool = True,
+                            current_user: Optional[User] = Depends(get_current_user_optional)):
+    """与某本书相似的书（本地索引，不调用AI）"""
+    check_gallery_version()
+    limit = max(1, min(limit, 50))
+    user_id = similar_books_user_id(gallery_only, current_user)
+    return {
+        "success": True,
+        "title": title,
+        "in_index": book_similarity_index.contains(title, user_id),
+        "books": book_similarity_index.similar_to(title, limit=limit, user_id=user_id)
+    }
 
-    return response
+@app.post("/api/similar-books")
+async def recommend_similar_books(req: SimilarBooksRequest,
+                                  current_user: Optional[User] = Depends(get_current_user_optional)):
+    """给喜欢这些书（如书架上识别出的书）的读者推荐书籍（本地索引，不调用AI）"""
+    if not req.books:
+        raise HTTPException(status_code=400, detail="books is required")
+    check_gallery_version()
+    limit = max(1, min(req.limit, 50))
+    return {
+        "success": True,
+        "books": book_similarity_index.recommend_for(
+            req.books, limit=limit, user_id=similar_books_user_id(req.gallery_only, current_user)
+        )
+    }
+
+@app.get("/api/search")
+async def search_books(q: str, limit: int = 10, source: Optional[str] = None):
+    """全文搜索画廊和Discovery书籍：书名、作者、类型、formal models、推荐文本，按相关度排序
+
+    支持中文书名，最后一个词按前缀匹配；source 可选 gallery / discovery。
+    """
+    if source not in (None, "gallery", "discovery"):
+        raise HTTPException(status_code=400, detail="source must be gallery or discovery")
+    check_gallery_version()
+    started = time.perf_counter()
+    results = book_search_index.search(q, limit=limit, source=source)
+    return {
+        "success": True,
+        "query": q,
+        "results": results,
+        "took_ms": round((time.perf_counter() - started) * 1000, 2)
+    }
+
+@app.get("/api/search/suggest")
+async def suggest_books(q: str, limit: int = 8):
+    """输入联想：按前缀匹配返回书名和作者"""
+    check_gallery_version()
+    results = book_search_index.search(q, limit=limit)
+    return {
+        "success": True,
+        "query": q,
+        "suggestions": [
+            {key: result.get(key) for key in ("source", "id", "analysis_id", "title", "author")}
+            for result in results
+        ]
+    }
 
 @app.post("/api/discover-book")
 async def discover_book(request: BookDiscoveryRequest, current_user: User = Depends(get_current_user_optional)):
@@ -1798,10 +2706,20 @@ async def discover_book(request: BookDiscoveryRequest, current_user: User = Depe
 
         # 缓存结果
         discovery_cache[analysis_id] = response
+        try:
+            book_search_index.index_discovery(
+                analysis_id, request.book_title, request.author, analysis["cefr_level"],
+                analysis["formal_models"], analysis["book_talk"]
+            )
+        except Exception as e:
+            print(f"Discovery search indexing failed: {str(e)}")
 
         print(f"书籍分析完成: {request.book_title}")
         return response
 
+    except StructuredOutputError as e:
+        print(f"Discovery error: {str(e)}")
+        raise HTTPException(status_code=502, detail=f"Book discovery failed: {str(e)}")
     except Exception as e:
         print(f"Discovery error: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Book discovery failed: {str(e)}")
@@ -1852,6 +2770,81 @@ async def analyze_bookshelf(
         print(f"书架分析处理失败: {str(e)}")
         raise HTTPException(status_code=500, detail=f"书架分析失败: {str(e)}")
 
+@app.post("/api/analyze-bookshelf/batch", response_model=BatchShelfAnalysisResponse)
+async def analyze_bookshelf_batch(
+    files: List[UploadFile] = File(...),
+    current_user: Optional[User] = Depends(get_current_user_optional)
+):
+    """批量书架分析API - 同一书架的多张照片并行OCR，合并去重后只调用一次AI"""
+
+    if len(files) > MAX_BATCH_SHELF_IMAGES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"一次最多上传 {MAX_BATCH_SHELF_IMAGES} 张图片"
+        )
+
+    for file in files:
+        if not file.content_type.startswith("image/"):
+            raise HTTPException(
+                status_code=400,
+                detail=f"请上传图片文件（支持 JPG, PNG, WebP 等格式）: {file.filename}"
+            )
+
+    try:
+        print(f"📸 接收批量书架图片分析请求：{len(files)} 张")
+        start_time = time.perf_counter()
+
+        async def prepare(file: UploadFile) -> dict:
+            preprocess_start = time.perf_counter()
+            image_base64 = await run_in_threadpool(process_uploaded_image, file)
+            preprocess_ms = round((time.perf_counter() - preprocess_start) * 1000, 1)
+            shelf = await run_in_threadpool(prepare_shelf_image, image_base64)
+            shelf["preprocess_ms"] = preprocess_ms
+            return shelf
+
+        # 各图片的预处理和OCR并行执行
+        shelves = await asyncio.gather(*(prepare(file) for file in files))
+
+        llm_start = time.perf_counter()
+        analysis_result = await run_in_threadpool(analyze_shelf_images, shelves)
+        llm_ms = round((time.perf_counter() - llm_start) * 1000, 1)
+
+        image_timings = [
+            {
+                "filename": file.filename,
+                "preprocess_ms": shelf["preprocess_ms"],
+                "ocr_ms": shelf["ocr_ms"],
+                "ocr_quality": shelf["ocr_quality"],
+                "vision_detail": shelf["vision_detail"],
+                "catalog_matches": len(shelf["catalog_books"])
+            }
+            for file, shelf in zip(files, shelves)
+        ]
+
+        filenames = "_".join(file.filename or "" for file in files)
+        analysis_id = hashlib.md5(f"shelf_{current_user.id if current_user else 'anonymous'}_{filenames}".encode()).hexdigest()[:12]
+
+        response = BatchShelfAnalysisResponse(
+            success=True,
+            detected_books=analysis_result.get("detected_books", []),
+            reading_preferences=analysis_result.get("reading_preferences", {}),
+            recommended_books=analysis_result.get("recommended_books", []),
+            analysis_summary=analysis_result.get("analysis_summary", "分析完成"),
+            confidence_score=analysis_result.get("confidence_score", 0.8),
+            analysis_id=analysis_id,
+            image_timings=image_timings,
+            total_ms=round((time.perf_counter() - start_time) * 1000, 1)
+        )
+
+        print(f"✅ 批量书架分析完成，{len(files)} 张图片检测到 {len(response.detected_books)} 本书（AI调用 {llm_ms}ms）")
+        return response
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f"批量书架分析处理失败: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"书架分析失败: {str(e)}")
+
 @app.get("/api/health")
 async def health_check():
     """健康检查API"""
@@ -1860,10 +2853,47 @@ async def health_check():
         "message": "Shh-elf API is operational!",
         "services": {
             "openai": "configured" if OPENAI_API_KEY else "missing",
-            "elevenlabs": "configured" if ELEVENLABS_API_KEY else "missing"
+            "elevenlabs": "configured" if ELEVENLABS_API_KEY else "missing",
+            "ocr_backend": ocr_engine.active_backend(),
+            "audio_transcoding": "ffmpeg" if FFMPEG_AVAILABLE else "mp3 only"
+        },
+        "audio_uploads": audio_upload_queue.status(),
+        "tts_providers": tts_router.status(),
+        "recommendation_cache": {
+            **recommendation_cache.stats(),
+            "template_reuse": recommendation_template_cache.stats() if RECOMMENDATION_TEMPLATE_REUSE else "disabled"
         }
     }
 
+@app.get("/api/bookshelf-metrics")
+async def get_bookshelf_metrics():
+    """书架分析的token用量和延迟统计（按视觉档位汇总）"""
+    summary = {}
+    for record in shelf_analysis_metrics:
+        stats = summary.setdefault(record["vision_detail"], {
+            "count": 0, "total_tokens": 0, "latency_ms": 0.0, "ocr_quality": 0.0
+        })
+        stats["count"] += 1
+        stats["total_tokens"] += record["total_tokens"]
+        stats["latency_ms"] += record["latency_ms"]
+        stats["ocr_quality"] += record["ocr_quality"]
+
+    for stats in summary.values():
+        count = stats["count"]
+        stats["avg_tokens"] = round(stats.pop("total_tokens") / count, 1)
+        stats["avg_latency_ms"] = round(stats.pop("latency_ms") / count, 1)
+        stats["avg_ocr_quality"] = round(stats.pop("ocr_quality") / count, 3)
+
+    return {
+        "success": True,
+        "thresholds": {
+            "text_only": OCR_TEXT_ONLY_THRESHOLD,
+            "low_detail": OCR_LOW_DETAIL_THRESHOLD
+        },
+        "by_detail": summary,
+        "recent": list(shelf_analysis_metrics)[-20:]
+    }
+
 # Render部署配置
 if __name__ == "__main__":
     import uvicorn
@@ -0,0 +1,150 @@
+# MP3 metadata - 只解析帧头，不解码音频
+# 逐帧读取 MPEG 音频帧头（版本、层、码率、采样率），累加每帧采样数得到时长；
+# 支持整段字节、文件和流式分块输入（分块边界可以落在帧中间），自动跳过 ID3v2 标签
+
+from pathlib import Path
+from typing import Optional, Union
+
+# 码率表（kbps），按 (MPEG版本是否为1, 层) 索引，下标为帧头中的码率索引
+_BITRATES = {
+    (True, 1): [0, 32, 64, 96, 128, 160, 192, 224, 256, 288, 320, 352, 384, 416, 448],
+    (True, 2): [0, 32, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 384],
+    (True, 3): [0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320],
+    (False, 1): [0, 32, 48, 56, 64, 80, 96, 112, 128, 144, 160, 176, 192, 224, 256],
+    (False, 2): [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],
+    (False, 3): [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160]
+}
+
+# 采样率表，按帧头中的版本位索引：0=MPEG2.5, 2=MPEG2, 3=MPEG1
+_SAMPLE_RATES = {
+    0: [11025, 12000, 8000],
+    2: [22050, 24000, 16000],
+    3: [44100, 48000, 32000]
+}
+
+_LAYERS = {1: 3, 2: 2, 3: 1}  # 帧头中的层位 -> 层号
+
+
+def parse_frame_header(header: bytes) -> Optional[dict]:
+    """解析4字节帧头；不是有效帧头时返回None"""
+    if len(header) < 4 or header[0] != 0xFF or (header[1] & 0xE0) != 0xE0:
+        return None
+
+    version_bits = (header[1] >> 3) & 0x03
+    layer_bits = (header[1] >> 1) & 0x03
+    bitrate_index = header[2] >> 4
+    sample_rate_index = (header[2] >> 2) & 0x03
+    if version_bits == 1 or layer_bits == 0 or bitrate_index in (0, 15) or sample_rate_index == 3:
+        return None  # 保留值或自由格式码率
+
+    mpeg1 = version_bits == 3
+    layer = _LAYERS[layer_bits]
+    bitrate = _BITRATES[(mpeg1, layer)][bitrate_index] * 1000
+    sample_rate = _SAMPLE_RATES[version_bits][sample_rate_index]
+    padding = (header[2] >> 1) & 0x01
+
+    if layer == 1:
+        samples = 384
+    elif layer == 3 and not mpeg1:
+        samples = 576
+    else:
+        samples = 1152
+
+    frame_length = samples // 8 * bitrate // sample_rate + padding * (4 if layer == 1 else 1)
+    return {
+        "bitrate": bitrate,
+        "sample_rate": sample_rate,
+        "samples": samples,
+        "channels": 1 if (header[3] >> 6) == 3 else 2,
+        "frame_length": frame_length
+    }
+
+
+class Mp3Scanner:
+    """增量扫描MP3帧头：feed() 逐块输入，result() 返回时长、平均码率和采样率"""
+
+    def __init__(self):
+        self._buffer = bytearray()
+        self._skip = 0          # 还需要跳过的字节数（帧体或ID3标签）
+        self._started = False   # 已检查过开头的ID3v2标签
+        self.frames = 0
+        self.total_samples = 0
+        self.audio_bytes = 0
+        self.sample_rate = None
+        self.channels = None
+
+    def feed(self, chunk: bytes):
+        if self._skip:
+            skipped = min(self._skip, len(chunk))
+            self._skip -= skipped
+            chunk = chunk[skipped:]
+        self._buffer += chunk
+        self._scan()
+
+    def _scan(self):
+        buffer = self._buffer
+        position = 0
+
+        if not self._started:
+            if len(buffer) < 10:
+                return
+            self._started = True
+            if buffer[:3] == b"ID3":
+                # ID3v2 标签长度为4个7位字节（syncsafe整数），不含10字节标签头
+                size = (buffer[6] << 21) | (buffer[7] << 14) | (buffer[8] << 7) | buffer[9]
+                position = 10 + size + (10 if buffer[5] & 0x10 else 0)
+
+        while position + 4 <= len(buffer):
+            frame = parse_frame_header(bytes(buffer[position:position + 4]))
+            if frame is None or frame["frame_length"] < 4:
+                position += 1  # 失去同步（尾部ID3v1标签、垃圾数据），逐字节重新寻找帧头
+                continue
+
+            # 只按第一帧的采样率计算，中途出现不同采样率的帧视为误同步
+            if self.sample_rate is None:
+                self.sample_rate = frame["sample_rate"]
+                self.channels = frame["channels"]
+            elif frame["sample_rate"] != self.sample_rate:
+                position += 1
+                continue
+
+            self.frames += 1
+            self.total_samples += frame["samples"]
+            self.audio_bytes += frame["frame_length"]
+            position += frame["frame_length"]
+
+        if position > len(buffer):
+            # 帧体超出当前缓冲区，后续分块中继续跳过
+            self._skip = position - len(buffer)
+            position = len(buffer)
+        del buffer[:position]
+
+    def result(self) -> Optional[dict]:
+        """扫描结果；没有找到任何帧时返回None"""
+        if not self.frames:
+            return None
+        duration = self.total_samples / self.sample_rate
+        return {
+            "duration_seconds": round(duration, 2),
+            "bitrate_kbps": round(self.audio_bytes * 8 / duration / 1000) if duration else 0,
+            "sample_rate": self.sample_rate,
+            "channels": self.channels,
+            "frames": self.frames
+        }
+
+
+def scan_bytes(data: bytes) -> Optional[dict]:
+    scanner = Mp3Scanner()
+    scanner.feed(data)
+    return scanner.result()
+
+
+def scan_file(path: Union[str, Path], chunk_size: int = 64 * 1024) -> Optional[dict]:
+    scanner = Mp3Scanner()
+    with open(path, "rb") as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            scanner.feed(chunk)
+    return scanner.result()
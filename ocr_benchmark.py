@@ -0,0 +1,192 @@
+# OCR preprocessing benchmark - 书架OCR预处理方案的耗时/内存/召回率对比
+#
+# 用法:
+#   python ocr_benchmark.py shelf_samples/
+#   python ocr_benchmark.py shelf_samples/ --variants baseline,no_denoise --repeat 3 --json report.json
+#
+# 标注格式（二选一）:
+#   - 目录下的 labels.json: {"shelf1.jpg": ["Animal Farm", "三体"], ...}
+#   - 与图片同名的 .txt 文件: 每行一个书名
+#
+# 耗时在当前进程中测量（不开启任何内存跟踪）；内存在单独的一轮中测量：每个方案启动一个子进程跑完所有图片，
+# 读取子进程的峰值RSS（resource.getrusage 的 ru_maxrss，包括OpenCV/Tesseract的原生内存），
+# 并减去子进程加载完依赖后的RSS，得到预处理和识别本身增加的内存
+
+import argparse
+import json
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+try:
+    import resource
+    RESOURCE_AVAILABLE = True
+except ImportError:  # Windows
+    RESOURCE_AVAILABLE = False
+
+from book_catalog import BookCatalog, CATALOG_MATCH_THRESHOLD
+import ocr_engine
+
+IMAGE_SUFFIXES = {".jpg", ".jpeg", ".png", ".webp", ".bmp"}
+
+# 对比方案：只需写出与 DEFAULT_PREPROCESS 不同的参数
+VARIANTS = {
+    "baseline": {},
+    "no_denoise": {"denoise": False},
+    "no_sharpen": {"sharpen": False},
+    "no_clahe": {"clahe_clip": None},
+    "clahe_3": {"clahe_clip": 3.0},
+    "no_whitelist": {"whitelist": False},
+    "minimal": {"clahe_clip": None, "denoise": False, "sharpen": False}
+}
+
+STAGES = ["decode", "grayscale", "clahe", "denoise", "sharpen", "ocr"]
+
+
+def load_labeled_images(folder: Path) -> list:
+    """读取图片及对应的书名标注，返回 [(图片路径, [书名...]), ...]"""
+    labels_file = folder / "labels.json"
+    labels = json.loads(labels_file.read_text(encoding="utf-8")) if labels_file.exists() else {}
+
+    samples = []
+    for image_path in sorted(folder.iterdir()):
+        if image_path.suffix.lower() not in IMAGE_SUFFIXES:
+            continue
+        titles = labels.get(image_path.name)
+        sidecar = image_path.with_suffix(".txt")
+        if titles is None and sidecar.exists():
+            titles = [line.strip() for line in sidecar.read_text(encoding="utf-8").splitlines() if line.strip()]
+        if titles:
+            samples.append((image_path, titles))
+        else:
+            print(f"⚠️  跳过没有标注的图片: {image_path.name}")
+    return samples
+
+
+def title_recall(ocr_text: str, titles: list, threshold: float) -> float:
+    """标注书名中能被OCR文字模糊匹配到的比例"""
+    catalog = BookCatalog()
+    for title in titles:
+        catalog.add(title)
+    resolved, _ = catalog.resolve(ocr_text, threshold)
+    return len(resolved) / len(titles)
+
+
+def max_rss_mb() -> float:
+    """当前进程的峰值RSS（MB）；ru_maxrss 在Linux上以KB为单位，在macOS上以字节为单位"""
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return max_rss / 1024 / 1024 if sys.platform == "darwin" else max_rss / 1024
+
+
+def memory_probe(folder: Path, name: str) -> dict:
+    """子进程中执行：用一种方案识别所有样本一次，返回峰值RSS和识别带来的增长"""
+    import cv2  # noqa: F401  依赖库本身的内存计入基线，不算作预处理的开销
+
+    samples = load_labeled_images(folder)
+    baseline = max_rss_mb()
+    for image_path, _ in samples:
+        ocr_engine.recognize_image(image_path.read_bytes(), VARIANTS[name])
+    peak = max_rss_mb()
+    return {"peak_rss_mb": round(peak, 1), "rss_growth_mb": round(peak - baseline, 1)}
+
+
+def measure_memory(folder: Path, name: str) -> dict:
+    """在独立的子进程中测量一种方案的内存，避免各方案和计时轮次互相影响峰值"""
+    if not RESOURCE_AVAILABLE:
+        return {"peak_rss_mb": None, "rss_growth_mb": None}
+    completed = subprocess.run(
+        [sys.executable, __file__, str(folder), "--memory-probe", name],
+        capture_output=True, text=True, check=True
+    )
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def run_variant(samples: list, options: dict, repeat: int, threshold: float) -> dict:
+    """用一种预处理方案跑完所有样本，汇总各阶段耗时和召回率"""
+    stage_totals = {}
+    recalls = []
+    qualities = []
+    total_ms = 0.0
+
+    for image_path, titles in samples:
+        image_bytes = image_path.read_bytes()
+        for _ in range(repeat):
+            timings = {}
+            start = time.perf_counter()
+            result = ocr_engine.recognize_image(image_bytes, options, timings)
+            total_ms += (time.perf_counter() - start) * 1000
+
+            for stage, ms in timings.items():
+                stage_totals[stage] = stage_totals.get(stage, 0.0) + ms
+
+        recalls.append(title_recall(result["text"], titles, threshold))
+        qualities.append(result["quality"])
+
+    runs = len(samples) * repeat
+    return {
+        "options": {**ocr_engine.DEFAULT_PREPROCESS, **options},
+        "avg_total_ms": round(total_ms / runs, 1),
+        "avg_stage_ms": {stage: round(ms / runs, 1) for stage, ms in stage_totals.items()},
+        "title_recall": round(sum(recalls) / len(recalls), 3),
+        "avg_ocr_quality": round(sum(qualities) / len(qualities), 3)
+    }
+
+
+def print_report(report: dict):
+    header = (f"{'variant':<14}{'recall':>8}{'quality':>9}{'total ms':>10}{'RSS MB':>9}{'+RSS MB':>9}  "
+              + "".join(f"{stage:>10}" for stage in STAGES))
+    print(header)
+    print("-" * len(header))
+    for name, stats in report.items():
+        stage_cols = "".join(f"{stats['avg_stage_ms'].get(stage, 0.0):>10.1f}" for stage in STAGES)
+        memory_cols = "".join(
+            f"{stats.get(key):>9.1f}" if stats.get(key) is not None else f"{'-':>9}"
+            for key in ("peak_rss_mb", "rss_growth_mb")
+        )
+        print(f"{name:<14}{stats['title_recall']:>8.3f}{stats['avg_ocr_quality']:>9.3f}"
+              f"{stats['avg_total_ms']:>10.1f}{memory_cols}  {stage_cols}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="书架OCR预处理基准测试")
+    parser.add_argument("folder", type=Path, help="包含书架图片和标注的目录")
+    parser.add_argument("--variants", default=",".join(VARIANTS), help="逗号分隔的方案名")
+    parser.add_argument("--repeat", type=int, default=1, help="每张图片重复次数（取平均耗时）")
+    parser.add_argument("--threshold", type=float, default=CATALOG_MATCH_THRESHOLD, help="书名匹配阈值")
+    parser.add_argument("--json", type=Path, help="把完整结果写入JSON文件")
+    parser.add_argument("--no-memory", action="store_true", help="跳过内存测量（不启动子进程）")
+    parser.add_argument("--memory-probe", help=argparse.SUPPRESS)  # 内部使用：子进程中测量一种方案的内存
+    args = parser.parse_args()
+
+    if args.memory_probe:
+        print(json.dumps(memory_probe(args.folder, args.memory_probe)))
+        return
+
+    samples = load_labeled_images(args.folder)
+    if not samples:
+        raise SystemExit(f"{args.folder} 中没有带标注的图片")
+
+    print(f"📊 {len(samples)} 张图片, OCR后端: {ocr_engine.active_backend()}\n")
+
+    report = {}
+    for name in args.variants.split(","):
+        name = name.strip()
+        if name not in VARIANTS:
+            raise SystemExit(f"未知方案: {name}（可选: {', '.join(VARIANTS)}）")
+        report[name] = run_variant(samples, VARIANTS[name], args.repeat, args.threshold)
+
+    if not args.no_memory:
+        print("🧠 测量内存（每个方案一个子进程）...\n")
+        for name, stats in report.items():
+            stats.update(measure_memory(args.folder, name))
+
+    print_report(report)
+
+    if args.json:
+        args.json.write_text(json.dumps(report, ensure_ascii=False, indent=2), encoding="utf-8")
+        print(f"\n结果已写入 {args.json}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,229 @@
+# OCR engine - 书架图片预处理与Tesseract识别
+# 优先使用 tesserocr（进程内 C-API，有上限的句柄池，每个句柄常驻一份已加载的语言模型），
+# 不可用或出错时回退到 pytesseract（每次调用启动 tesseract 子进程）
+
+import os
+import queue
+import threading
+import time
+from typing import Optional
+
+import numpy as np
+
+OCR_LANG = "chi_sim+eng"
+OCR_WHITELIST = "ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789一二三四五六七八九十百千万亿《》（）()[]【】：:：，、。！？.,!?-—"
+OCR_CONFIG = f"--oem 3 --psm 6 -c tessedit_char_whitelist={OCR_WHITELIST}"
+
+# 默认预处理参数（ocr_benchmark.py 用同样的键定义对比方案）
+DEFAULT_PREPROCESS = {
+    "clahe_clip": 2.0,   # CLAHE对比度增强，None表示跳过
+    "clahe_tile": 8,
+    "denoise": True,     # fastNlMeansDenoising
+    "sharpen": True,     # 3x3锐化核
+    "whitelist": True    # Tesseract字符白名单
+}
+
+# OCR后端：tesserocr（默认，不可用时自动回退）或 pytesseract
+OCR_BACKEND = os.getenv("OCR_BACKEND", "tesserocr")
+TESSDATA_PREFIX = os.getenv("TESSDATA_PREFIX")
+# Tesseract句柄池大小：每个句柄常驻一份语言模型，同时最多这么多个识别在进行，其余请求等待归还
+OCR_TESSERACT_POOL_SIZE = max(1, int(os.getenv("OCR_TESSERACT_POOL_SIZE", "2")))
+
+try:
+    import tesserocr
+    TESSEROCR_AVAILABLE = True
+except ImportError:
+    TESSEROCR_AVAILABLE = False
+
+# Tesseract句柄池（句柄本身不是线程安全的，每次识别取出一个独占使用，用完归还）
+_api_pool = queue.Queue()
+_api_count = 0  # 已创建且未释放的句柄数（池中空闲的 + 正在使用的）
+_api_lock = threading.Lock()
+
+
+def active_backend() -> str:
+    """当前实际使用的OCR后端"""
+    if OCR_BACKEND == "tesserocr" and TESSEROCR_AVAILABLE:
+        return "tesserocr"
+    return "pytesseract"
+
+
+def preprocess_image(image_bytes: bytes, options: Optional[dict] = None, timings: Optional[dict] = None) -> np.ndarray:
+    """解码图片并做OCR预处理：灰度、增强对比度、降噪、锐化；timings 非空时记录各阶段耗时（毫秒）"""
+    import cv2
+
+    options = {**DEFAULT_PREPROCESS, **(options or {})}
+    stage_start = time.perf_counter()
+
+    def mark(stage: str):
+        nonlocal stage_start
+        if timings is not None:
+            now = time.perf_counter()
+            timings[stage] = timings.get(stage, 0.0) + (now - stage_start) * 1000
+            stage_start = now
+
+    nparr = np.frombuffer(image_bytes, np.uint8)
+    image = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+    mark("decode")
+
+    # 图像预处理，提高OCR效果
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    mark("grayscale")
+
+    # 增强对比度
+    if options["clahe_clip"]:
+        tile = options["clahe_tile"]
+        clahe = cv2.createCLAHE(clipLimit=options["clahe_clip"], tileGridSize=(tile, tile))
+        gray = clahe.apply(gray)
+        mark("clahe")
+
+    # 降噪
+    if options["denoise"]:
+        gray = cv2.fastNlMeansDenoising(gray)
+        mark("denoise")
+
+    # 锐化
+    if options["sharpen"]:
+        kernel = np.array([[-1,-1,-1], [-1,9,-1], [-1,-1,-1]])
+        gray = cv2.filter2D(gray, -1, kernel)
+        mark("sharpen")
+
+    return gray
+
+
+def _create_tesserocr_api():
+    kwargs = {"lang": OCR_LANG, "psm": tesserocr.PSM.SINGLE_BLOCK, "oem": tesserocr.OEM.DEFAULT}
+    if TESSDATA_PREFIX:
+        kwargs["path"] = TESSDATA_PREFIX
+    api = tesserocr.PyTessBaseAPI(**kwargs)
+    api.SetVariable("tessedit_char_whitelist", OCR_WHITELIST)
+    print(f"🔤 Tesseract句柄已加载 ({_api_count}/{OCR_TESSERACT_POOL_SIZE})")
+    return api
+
+
+def _checkout_tesserocr_api():
+    """从池中取出一个句柄；没有空闲句柄时，未达上限则新建（加载语言模型），否则等待归还"""
+    global _api_count
+    while True:
+        try:
+            return _api_pool.get_nowait()
+        except queue.Empty:
+            pass
+        with _api_lock:
+            if _api_count < OCR_TESSERACT_POOL_SIZE:
+                _api_count += 1
+                break
+        try:
+            # 定时醒来重新检查：出错的句柄被释放后可以新建
+            return _api_pool.get(timeout=1)
+        except queue.Empty:
+            continue
+
+    try:
+        return _create_tesserocr_api()
+    except Exception:
+        with _api_lock:
+            _api_count -= 1
+        raise
+
+
+def _release_tesserocr_api(api):
+    """End()释放句柄的原生资源并从计数中去掉"""
+    global _api_count
+    with _api_lock:
+        _api_count -= 1
+    try:
+        api.End()
+    except Exception as e:
+        print(f"释放Tesseract实例失败: {str(e)}")
+
+
+def _words_tesserocr(image: np.ndarray, whitelist: bool = True) -> list:
+    """通过C-API识别，直接传入灰度图像缓冲区，不写临时文件"""
+    image = np.ascontiguousarray(image)
+    height, width = image.shape
+    api = _checkout_tesserocr_api()
+    try:
+        api.SetVariable("tessedit_char_whitelist", OCR_WHITELIST if whitelist else "")
+        api.SetImageBytes(image.tobytes(), width, height, 1, width)
+        api.Recognize()
+
+        words = []
+        line_num = 0
+        level = tesserocr.RIL.WORD
+        for word_iter in tesserocr.iterate_level(api.GetIterator(), level):
+            if word_iter.IsAtBeginningOf(tesserocr.RIL.TEXTLINE):
+                line_num += 1
+            word = word_iter.GetUTF8Text(level)
+            if word:
+                words.append((line_num, word, word_iter.Confidence(level)))
+    except Exception:
+        # 出错的句柄状态不可信，释放后下次识别时重新创建
+        _release_tesserocr_api(api)
+        raise
+    else:
+        api.Clear()
+        _api_pool.put(api)
+        return words
+
+
+def _words_pytesseract(image: np.ndarray, whitelist: bool = True) -> list:
+    """通过tesseract子进程识别（后备方案）"""
+    import pytesseract
+
+    data = pytesseract.image_to_data(
+        image, lang=OCR_LANG, config=OCR_CONFIG if whitelist else "--oem 3 --psm 6",
+        output_type=pytesseract.Output.DICT
+    )
+    words = []
+    for i, word in enumerate(data["text"]):
+        line_key = (data["block_num"][i], data["par_num"][i], data["line_num"][i])
+        words.append((line_key, word, float(data["conf"][i])))
+    return words
+
+
+def shutdown():
+    """释放池中空闲的Tesseract句柄（应用关闭时调用）"""
+    while True:
+        try:
+            api = _api_pool.get_nowait()
+        except queue.Empty:
+            return
+        _release_tesserocr_api(api)
+
+
+def recognize_words(image: np.ndarray, whitelist: bool = True) -> list:
+    """识别预处理后的图像，返回 (行号, 词, 置信度) 列表"""
+    if active_backend() == "tesserocr":
+        try:
+            return _words_tesserocr(image, whitelist)
+        except Exception as e:
+            print(f"tesserocr识别失败，回退到pytesseract: {str(e)}")
+    return _words_pytesseract(image, whitelist)
+
+
+def recognize_image(image_bytes: bytes, options: Optional[dict] = None, timings: Optional[dict] = None) -> dict:
+    """完整OCR流程：预处理 + 识别，返回文字和基于逐词置信度的质量分（0-1）"""
+    options = {**DEFAULT_PREPROCESS, **(options or {})}
+    image = preprocess_image(image_bytes, options, timings)
+
+    ocr_start = time.perf_counter()
+    words = recognize_words(image, options["whitelist"])
+    if timings is not None:
+        timings["ocr"] = timings.get("ocr", 0.0) + (time.perf_counter() - ocr_start) * 1000
+
+    lines = {}
+    weighted_conf = 0.0
+    total_chars = 0
+    for line_key, word, conf in words:
+        word = (word or "").strip()
+        if not word or conf < 0:
+            continue
+        lines.setdefault(line_key, []).append(word)
+        # 按字符数加权，避免大量单字符噪声拉高或拉低整体分数
+        weighted_conf += conf * len(word)
+        total_chars += len(word)
+
+    text = "\n".join(" ".join(line_words) for _, line_words in sorted(lines.items()))
+    quality = round(weighted_conf / total_chars / 100, 3) if total_chars else 0.0
+    return {"text": text.strip(), "quality": quality, "char_count": total_chars}
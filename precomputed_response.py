@@ -0,0 +1,87 @@
+# Precomputed JSON responses - 对所有访客都相同的接口响应，预先序列化并压缩
+# 序列化（优先 orjson）和 gzip/brotli 压缩只在内容变化时做一次，之后每次请求直接返回字节；
+# 带内容ETag，浏览器重新验证时返回304
+
+import gzip
+import hashlib
+import json
+from typing import Optional
+
+from starlette.datastructures import Headers
+from starlette.responses import Response
+
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+
+try:
+    import brotli
+    BROTLI_AVAILABLE = True
+except ImportError:
+    BROTLI_AVAILABLE = False
+
+GZIP_LEVEL = 9
+BROTLI_QUALITY = 9
+
+# 内容可能随时更新：允许缓存，但每次都用ETag重新验证
+PRECOMPUTED_CACHE_CONTROL = "public, no-cache"
+
+
+def dumps(payload) -> bytes:
+    """序列化为紧凑的UTF-8 JSON字节"""
+    if ORJSON_AVAILABLE:
+        return orjson.dumps(payload)
+    return json.dumps(payload, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def accepted_encodings(accept_encoding: Optional[str]) -> dict:
+    """解析 Accept-Encoding，返回 编码 -> q值"""
+    encodings = {}
+    for item in (accept_encoding or "").split(","):
+        parts = [part.strip() for part in item.split(";")]
+        if not parts[0]:
+            continue
+        q = 1.0
+        for param in parts[1:]:
+            if param.startswith("q="):
+                try:
+                    q = float(param[2:])
+                except ValueError:
+                    q = 0.0
+        encodings[parts[0].lower()] = q
+    return encodings
+
+
+class PrecomputedJSON:
+    """一份序列化好的JSON响应及其压缩版本"""
+
+    def __init__(self, payload):
+        self.body = dumps(payload)
+        self.etag = f'"{hashlib.sha1(self.body).hexdigest()[:20]}"'
+        self.encoded = {"gzip": gzip.compress(self.body, compresslevel=GZIP_LEVEL, mtime=0)}
+        if BROTLI_AVAILABLE:
+            self.encoded["br"] = brotli.compress(self.body, quality=BROTLI_QUALITY)
+
+    def response(self, request_headers: Headers) -> Response:
+        """按 If-None-Match 和 Accept-Encoding 返回304或对应编码的字节"""
+        headers = {
+            "etag": self.etag,
+            "cache-control": PRECOMPUTED_CACHE_CONTROL,
+            "vary": "Accept-Encoding"
+        }
+
+        if_none_match = request_headers.get("if-none-match")
+        if if_none_match:
+            tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+            if "*" in tags or self.etag in tags:
+                return Response(status_code=304, headers=headers)
+
+        accepted = accepted_encodings(request_headers.get("accept-encoding"))
+        for encoding in ("br", "gzip"):
+            if accepted.get(encoding, accepted.get("*", 0)) > 0 and encoding in self.encoded:
+                headers["content-encoding"] = encoding
+                return Response(self.encoded[encoding], headers=headers, media_type="application/json")
+
+        return Response(self.body, headers=headers, media_type="application/json")
@@ -0,0 +1,102 @@
+# Prompt cache - LLM生成结果缓存
+# 按规范化后的提示词指纹缓存（只是空格、大小写、全半角不同的请求命中同一条），LRU + TTL 淘汰；
+# 可选的模板复用：同一本书/语调/语言/关系/兴趣只有收件人名字不同时，把已生成文本中的名字换成新名字直接返回，
+# 每个模板最多复用有限次数，之后重新生成，避免所有人收到完全相同的推荐
+
+import hashlib
+import json
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Optional
+
+NAME_PLACEHOLDER = "\x00recipient\x00"
+
+
+def normalize_field(value) -> str:
+    """统一全半角、大小写，合并连续空白"""
+    return " ".join(unicodedata.normalize("NFKC", str(value or "")).casefold().split())
+
+
+def prompt_fingerprint(*fields) -> str:
+    return hashlib.sha256(
+        json.dumps([normalize_field(field) for field in fields], ensure_ascii=False).encode("utf-8")
+    ).hexdigest()
+
+
+def _name_pattern(name: str) -> re.Pattern:
+    # 英文名按单词边界匹配，避免替换到其他单词内部
+    escaped = re.escape(name)
+    if name.isascii():
+        return re.compile(rf"\b{escaped}\b", re.IGNORECASE)
+    return re.compile(escaped)
+
+
+def make_template(text: str, name: str) -> Optional[str]:
+    """把文本中的收件人名字替换为占位符；名字太短或没有出现在文本中时无法做成模板"""
+    name = name.strip()
+    if len(name) < 2 or NAME_PLACEHOLDER in text:
+        return None
+    template, count = _name_pattern(name).subn(NAME_PLACEHOLDER, text)
+    return template if count else None
+
+
+def fill_template(template: str, name: str) -> str:
+    return template.replace(NAME_PLACEHOLDER, name.strip())
+
+
+class PromptCache:
+    """线程安全的 LRU + TTL 缓存，带命中率统计"""
+
+    def __init__(self, max_entries: int = 1000, ttl_seconds: float = 7 * 24 * 3600):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()  # 键 -> (写入时间, 值, 复用次数)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key: str, max_uses: Optional[int] = None):
+        """取出缓存值；过期或超过复用次数（max_uses）时视为未命中"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                stored_at, value, uses = entry
+                if time.time() - stored_at > self.ttl_seconds:
+                    del self._entries[key]
+                    self.expirations += 1
+                elif max_uses is None or uses < max_uses:
+                    self._entries[key] = (stored_at, value, uses + 1)
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+            self.misses += 1
+            return None
+
+    def put(self, key: str, value):
+        with self._lock:
+            self._entries[key] = (time.time(), value, 0)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+                "evictions": self.evictions,
+                "expirations": self.expirations
+            }
@@ -0,0 +1,60 @@
+# Stream drain - 在后台线程中把一个流完整读完，请求方只是旁听者
+# 流式TTS边合成边播放时，客户端断开不应丢掉已经合成（并已计费）的音频：
+# 读取和保存在后台线程完成，客户端通过无上限队列收到同样的数据块，断开后队列不再写入
+
+import queue
+import threading
+from typing import Callable, Iterable, Iterator, Optional
+
+_END = object()
+
+
+class StreamDrain:
+    """后台读完 source() 返回的迭代器；listen() 把数据块转发给一个旁听者
+
+    on_finish(error) 在读完（或出错）后于后台线程中调用，error 为None表示成功。
+    """
+
+    def __init__(self, source: Callable[[], Iterable[bytes]],
+                 on_finish: Optional[Callable[[Optional[BaseException]], None]] = None):
+        self._source = source
+        self._on_finish = on_finish
+        self._chunks = queue.Queue()
+        self._listening = True
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self) -> "StreamDrain":
+        self._thread.start()
+        return self
+
+    def _run(self):
+        error = None
+        try:
+            for chunk in self._source():
+                if self._listening:
+                    self._chunks.put(chunk)
+        except Exception as e:
+            error = e
+        finally:
+            if self._on_finish:
+                self._on_finish(error)
+            self._chunks.put(error or _END)
+
+    def listen(self) -> Iterator[bytes]:
+        """逐块产出数据；旁听者停止读取（客户端断开）后后台读取继续进行"""
+        try:
+            while True:
+                item = self._chunks.get()
+                if item is _END:
+                    return
+                if isinstance(item, BaseException):
+                    raise item
+                yield item
+        finally:
+            self._listening = False
+            # 丢弃已排队的数据块，之后不再写入队列
+            while not self._chunks.empty():
+                self._chunks.get_nowait()
+
+    def join(self, timeout: Optional[float] = None):
+        self._thread.join(timeout)
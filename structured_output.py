@@ -0,0 +1,167 @@
+# Structured output - 调用 OpenAI Chat Completions 并按 JSON Schema 取得结构化结果
+# 请求使用 response_format=json_schema（strict），模型输出直接是符合schema的JSON，不再从文本中截取第一个{到最后一个}；
+# 返回后在本地再按同一个schema校验（类型、必填字段、枚举、不允许多余字段，以及调用方的额外检查），
+# 校验失败时把错误告诉模型做一次有上限的修复重试，仍然失败则抛出 StructuredOutputError，由调用方决定如何处理，
+# 不会静默返回占位内容
+# OPENAI_STRUCTURED_OUTPUTS=false 时退回 JSON mode（response_format=json_object），兼容不支持 json_schema 的模型或代理
+
+import json
+import os
+import time
+from typing import Callable, List, Optional
+
+import requests
+
+OPENAI_CHAT_URL = "https://api.openai.com/v1/chat/completions"
+STRUCTURED_OUTPUTS = os.getenv("OPENAI_STRUCTURED_OUTPUTS", "true").lower() in ("1", "true", "yes")
+
+# 校验失败后的修复重试次数
+STRUCTURED_OUTPUT_REPAIR_RETRIES = int(os.getenv("STRUCTURED_OUTPUT_REPAIR_RETRIES", "1"))
+
+
+class StructuredOutputError(Exception):
+    """模型拒绝回答，或修复重试后输出仍不符合schema；usage / attempts / latency_ms 记录失败前所有请求的消耗"""
+
+    def __init__(self, message: str, usage: Optional[dict] = None, attempts: int = 0, latency_ms: float = 0.0):
+        super().__init__(message)
+        self.usage = usage or {}
+        self.attempts = attempts
+        self.latency_ms = latency_ms
+
+
+def strict_object(properties: dict) -> dict:
+    """strict模式的object schema：所有字段必填、不允许多余字段"""
+    return {
+        "type": "object",
+        "properties": properties,
+        "required": list(properties),
+        "additionalProperties": False
+    }
+
+
+def validate(value, schema: dict, path: str = "$") -> Optional[str]:
+    """按schema校验（支持strict模式用到的 type/properties/required/additionalProperties/items/enum），返回第一个错误"""
+    types = schema.get("type")
+    types = types if isinstance(types, list) else [types]
+    checks = {
+        "object": lambda v: isinstance(v, dict),
+        "array": lambda v: isinstance(v, list),
+        "string": lambda v: isinstance(v, str),
+        "integer": lambda v: isinstance(v, int) and not isinstance(v, bool),
+        "number": lambda v: isinstance(v, (int, float)) and not isinstance(v, bool),
+        "boolean": lambda v: isinstance(v, bool),
+        "null": lambda v: v is None
+    }
+    if not any(checks[name](value) for name in types if name):
+        return f"{path}: expected {'/'.join(types)}, got {type(value).__name__}"
+    if value is None:
+        return None
+    if "enum" in schema and value not in schema["enum"]:
+        return f"{path}: {value!r} is not one of {schema['enum']}"
+    if isinstance(value, dict):
+        for name in schema.get("required", []):
+            if name not in value:
+                return f"{path}: missing required field '{name}'"
+        properties = schema.get("properties", {})
+        if schema.get("additionalProperties") is False:
+            extra = [name for name in value if name not in properties]
+            if extra:
+                return f"{path}: unexpected field '{extra[0]}'"
+        for name, item in value.items():
+            if name in properties:
+                error = validate(item, properties[name], f"{path}.{name}")
+                if error:
+                    return error
+    if isinstance(value, list) and "items" in schema:
+        for index, item in enumerate(value):
+            error = validate(item, schema["items"], f"{path}[{index}]")
+            if error:
+                return error
+    return None
+
+
+def _response_format(name: str, schema: dict) -> dict:
+    if STRUCTURED_OUTPUTS:
+        return {"type": "json_schema", "json_schema": {"name": name, "strict": True, "schema": schema}}
+    return {"type": "json_object"}
+
+
+def _elapsed_ms(start_time: float) -> float:
+    return round((time.perf_counter() - start_time) * 1000, 1)
+
+
+def _add_usage(total: dict, usage: dict):
+    for key in ("prompt_tokens", "completion_tokens", "total_tokens"):
+        total[key] = total.get(key, 0) + usage.get(key, 0)
+
+
+def chat_json(messages: List[dict], schema_name: str, schema: dict, api_key: str, model: str = "gpt-4o-mini",
+              temperature: float = 0.3, max_tokens: Optional[int] = None, timeout=None,
+              check: Optional[Callable[[dict], Optional[str]]] = None) -> dict:
+    """请求结构化JSON，返回 {"data": 解析结果, "usage": 所有尝试的token合计, "attempts": 请求次数, "latency_ms": 总耗时}
+
+    check(data) 可返回额外的错误说明（例如必填文本为空），与schema错误一样触发修复重试。
+    HTTP错误直接抛出（requests.HTTPError），模型拒绝或修复后仍无效时抛出 StructuredOutputError。
+    """
+    headers = {"Authorization": f"Bearer {api_key}", "Content-Type": "application/json"}
+    messages = list(messages)
+    if not STRUCTURED_OUTPUTS:
+        # JSON mode 不接收schema，放在系统消息里告诉模型
+        messages.insert(0, {
+            "role": "system",
+            "content": f"Respond with a single JSON object that matches this JSON Schema: {json.dumps(schema, ensure_ascii=False)}"
+        })
+    usage = {}
+    start_time = time.perf_counter()
+
+    for attempt in range(1, STRUCTURED_OUTPUT_REPAIR_RETRIES + 2):
+        data = {
+            "model": model,
+            "messages": messages,
+            "temperature": temperature,
+            "response_format": _response_format(schema_name, schema)
+        }
+        if max_tokens:
+            data["max_tokens"] = max_tokens
+        response = requests.post(OPENAI_CHAT_URL, headers=headers, json=data, timeout=timeout)
+        response.raise_for_status()
+        result = response.json()
+        _add_usage(usage, result.get("usage", {}))
+
+        choice = result["choices"][0]
+        message = choice["message"]
+        if message.get("refusal"):
+            raise StructuredOutputError(
+                f"model refused: {message['refusal']}", usage, attempt, _elapsed_ms(start_time)
+            )
+
+        content = message.get("content") or ""
+        try:
+            parsed = json.loads(content)
+            error = validate(parsed, schema)
+        except ValueError as e:
+            parsed, error = None, f"invalid JSON: {str(e)}"
+        if not error and check:
+            error = check(parsed)
+        if not error:
+            return {
+                "data": parsed,
+                "usage": usage,
+                "attempts": attempt,
+                "latency_ms": _elapsed_ms(start_time)
+            }
+
+        if choice.get("finish_reason") == "length":
+            error += " (output was truncated; keep it shorter)"
+        print(f"⚠️  {schema_name} 输出校验失败（第{attempt}次）: {error}")
+        messages = messages + [
+            {"role": "assistant", "content": content},
+            {"role": "user", "content": (
+                f"Your previous response was not valid: {error}. "
+                "Return the complete result again as a single JSON object that matches the required schema exactly."
+            )}
+        ]
+
+    raise StructuredOutputError(
+        f"{schema_name}: invalid output after {attempt} attempts: {error}", usage, attempt, _elapsed_ms(start_time)
+    )
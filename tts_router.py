@@ -0,0 +1,297 @@
+# TTS provider router - 按语言、实时延迟和错误率选择TTS服务
+# 每个 服务+声音 记录最近的响应延迟（收到响应头为止，正文随后流式读取）和成败，
+# 优先选择支持该语言、未熔断且p50最快的服务；主服务超过自身p95仍未响应时，
+# 向下一个服务发起对冲请求，采用先成功返回的结果
+# 每个服务有一个熔断器：失败率过高时熔断（open），冷却后放行一个试探请求（half_open），成功则恢复（closed）
+
+import math
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Callable, List, Optional
+
+import requests
+
+# 滑动窗口大小（每个服务+声音保留的最近请求数）
+TTS_ROUTER_WINDOW = int(os.getenv("TTS_ROUTER_WINDOW", "50"))
+
+# 样本数不足时不计算分位数，按注册顺序（质量偏好）选择
+TTS_ROUTER_MIN_SAMPLES = int(os.getenv("TTS_ROUTER_MIN_SAMPLES", "5"))
+
+# 没有足够样本时的对冲等待时间，以及对冲等待的下限（秒）
+TTS_HEDGE_DEFAULT_DELAY = float(os.getenv("TTS_HEDGE_DEFAULT_DELAY", "4.0"))
+TTS_HEDGE_MIN_DELAY = 0.2
+
+TTS_ROUTER_WORKERS = int(os.getenv("TTS_ROUTER_WORKERS", "8"))
+
+# 熔断器：最近 BREAKER_WINDOW 次请求中至少 BREAKER_MIN_CALLS 次且失败率达到阈值时熔断，冷却后试探
+BREAKER_WINDOW = int(os.getenv("TTS_BREAKER_WINDOW", "20"))
+BREAKER_MIN_CALLS = int(os.getenv("TTS_BREAKER_MIN_CALLS", "5"))
+BREAKER_FAILURE_RATE = float(os.getenv("TTS_BREAKER_FAILURE_RATE", "0.5"))
+BREAKER_COOLDOWN_SECONDS = float(os.getenv("TTS_BREAKER_COOLDOWN_SECONDS", "30"))
+
+
+def percentile(values: List[float], pct: float) -> float:
+    """最近邻法分位数"""
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, math.ceil(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+class LatencyStats:
+    """一个服务+声音的滑动窗口统计"""
+
+    def __init__(self, window: int = TTS_ROUTER_WINDOW):
+        self._samples = deque(maxlen=window)  # (延迟秒数, 是否成功)
+        self._lock = threading.Lock()
+
+    def record(self, latency: float, ok: bool):
+        with self._lock:
+            self._samples.append((latency, ok))
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            samples = list(self._samples)
+        latencies = [latency for latency, ok in samples if ok]
+        errors = sum(1 for _, ok in samples if not ok)
+        return {
+            "samples": len(samples),
+            "p50": percentile(latencies, 50) if len(latencies) >= TTS_ROUTER_MIN_SAMPLES else None,
+            "p95": percentile(latencies, 95) if len(latencies) >= TTS_ROUTER_MIN_SAMPLES else None,
+            "error_rate": errors / len(samples) if samples else 0.0
+        }
+
+
+class CircuitBreaker:
+    """单个服务的熔断器：closed（正常）-> open（跳过）-> half_open（放行一个试探请求）"""
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, name: str):
+        self.name = name
+        self.state = self.CLOSED
+        self._results = deque(maxlen=BREAKER_WINDOW)  # True 表示成功
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+
+    def _cooled_down(self) -> bool:
+        return time.monotonic() - self._opened_at >= BREAKER_COOLDOWN_SECONDS
+
+    def available(self) -> bool:
+        """是否可以尝试该服务（不改变状态）"""
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN:
+                return self._cooled_down()
+            return not self._probe_in_flight
+
+    def probe_ready(self) -> bool:
+        """熔断冷却结束、正在等待试探请求"""
+        with self._lock:
+            if self.state == self.OPEN:
+                return self._cooled_down()
+            return self.state == self.HALF_OPEN and not self._probe_in_flight
+
+    def acquire(self) -> bool:
+        """真正发出请求前调用；熔断冷却结束后只放行一个试探请求"""
+        with self._lock:
+            if self.state == self.OPEN and self._cooled_down():
+                self.state = self.HALF_OPEN
+                self._probe_in_flight = False
+                print(f"🔌 {self.name} 熔断冷却结束，放行试探请求")
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.HALF_OPEN and not self._probe_in_flight:
+                self._probe_in_flight = True
+                return True
+            return False
+
+    def record(self, ok: bool):
+        with self._lock:
+            if self.state == self.HALF_OPEN:
+                self._probe_in_flight = False
+                if ok:
+                    self.state = self.CLOSED
+                    self._results.clear()
+                    print(f"✅ {self.name} 已恢复，熔断关闭")
+                else:
+                    self._trip()
+                return
+
+            self._results.append(ok)
+            failures = self._results.count(False)
+            if (self.state == self.CLOSED and len(self._results) >= BREAKER_MIN_CALLS
+                    and failures / len(self._results) >= BREAKER_FAILURE_RATE):
+                self._trip()
+
+    def _trip(self):
+        self.state = self.OPEN
+        self._opened_at = time.monotonic()
+        self._results.clear()
+        print(f"⛔ {self.name} 失败率过高，熔断 {BREAKER_COOLDOWN_SECONDS:.0f} 秒")
+
+    def status(self) -> dict:
+        with self._lock:
+            status = {"state": self.state, "recent_calls": len(self._results),
+                      "recent_failures": self._results.count(False)}
+            if self.state == self.OPEN:
+                status["retry_in"] = round(max(0.0, BREAKER_COOLDOWN_SECONDS - (time.monotonic() - self._opened_at)), 1)
+            return status
+
+
+class TTSProvider:
+    """一个TTS服务：request(text, voice) 返回尚未读取正文的流式响应"""
+
+    def __init__(self, name: str, request: Callable[[str, str], requests.Response], languages: set,
+                 configured: Callable[[], bool] = lambda: True, fixed_voice: Optional[str] = None):
+        self.name = name
+        self.request = request
+        self.languages = languages
+        self.configured = configured
+        self.fixed_voice = fixed_voice  # 不区分方言的服务使用固定声音
+        self.breaker = CircuitBreaker(name)
+
+    def voice_for(self, voice: str) -> str:
+        return self.fixed_voice or voice
+
+
+class TTSRouter:
+    """延迟感知的TTS服务路由，带对冲请求"""
+
+    def __init__(self, max_workers: int = TTS_ROUTER_WORKERS):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="tts-router")
+        self._lock = threading.Lock()
+        self.providers = []
+        self._stats = {}  # (服务名, 声音) -> LatencyStats
+
+    def register(self, name: str, request: Callable[[str, str], requests.Response], languages: set,
+                 configured: Callable[[], bool] = lambda: True, fixed_voice: Optional[str] = None) -> TTSProvider:
+        """注册服务，注册顺序即样本不足时的优先顺序"""
+        provider = TTSProvider(name, request, languages, configured, fixed_voice)
+        self.providers.append(provider)
+        return provider
+
+    def stats(self, provider: TTSProvider, voice: str) -> LatencyStats:
+        key = (provider.name, provider.voice_for(voice))
+        with self._lock:
+            if key not in self._stats:
+                self._stats[key] = LatencyStats()
+            return self._stats[key]
+
+    def candidates(self, language: str, voice: str) -> List[TTSProvider]:
+        """支持该语言、已配置且未熔断的服务：等待试探的服务排在最前（只放行一个请求），其余p50快的在前；
+        样本不足的排在有数据的服务之后，按注册顺序
+
+        样本不足的服务会在对冲和回退时积累数据，不会仅仅因为没有数据就抢占主服务。
+        """
+        ranked = []
+        for order, provider in enumerate(self.providers):
+            if language not in provider.languages or not provider.configured():
+                continue
+            if not provider.breaker.available():
+                continue
+            snapshot = self.stats(provider, voice).snapshot()
+            probing = provider.breaker.probe_ready()
+            p50 = snapshot["p50"] if snapshot["p50"] is not None else float("inf")
+            ranked.append(((not probing, p50, order), provider))
+        ranked.sort(key=lambda item: item[0])
+        return [provider for _, provider in ranked]
+
+    def hedge_delay(self, provider: TTSProvider, voice: str) -> float:
+        """主服务超过自身p95仍未响应时发起对冲"""
+        p95 = self.stats(provider, voice).snapshot()["p95"]
+        if p95 is None:
+            return TTS_HEDGE_DEFAULT_DELAY
+        return max(TTS_HEDGE_MIN_DELAY, p95)
+
+    def _timed_request(self, provider: TTSProvider, text: str, voice: str) -> requests.Response:
+        start = time.perf_counter()
+        try:
+            response = provider.request(text, voice)
+        except Exception:
+            self.stats(provider, voice).record(time.perf_counter() - start, False)
+            provider.breaker.record(False)
+            raise
+        self.stats(provider, voice).record(time.perf_counter() - start, True)
+        provider.breaker.record(True)
+        return response
+
+    def open(self, text: str, language: str, voice: str) -> requests.Response:
+        """打开流式TTS响应：先请求最优服务，超时对冲或失败时依次启用后备服务"""
+        candidates = self.candidates(language, voice)
+        if not candidates:
+            raise Exception(f"没有可用的{language} TTS服务（未配置或已熔断）")
+
+        pending = {}  # Future -> 服务
+        errors = []
+        launched = 0
+        latest = None
+
+        def launch(reason: str = ""):
+            """启动下一个能通过熔断器的候选服务"""
+            nonlocal launched, latest
+            while launched < len(candidates):
+                provider = candidates[launched]
+                launched += 1
+                if provider.breaker.acquire():
+                    if reason:
+                        print(f"{reason} {provider.name}")
+                    pending[self._executor.submit(self._timed_request, provider, text, provider.voice_for(voice))] = provider
+                    latest = provider
+                    return
+                errors.append(f"{provider.name}: 熔断中")
+
+        launch()
+        while pending:
+            timeout = self.hedge_delay(latest, voice) if launched < len(candidates) else None
+            done, _ = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+
+            if not done:
+                launch(f"⏱️  {latest.name} 超过p95未响应，对冲请求")
+                continue
+
+            winner = None
+            for future in done:
+                provider = pending.pop(future)
+                try:
+                    response = future.result()
+                except Exception as e:
+                    print(f"{provider.name} TTS错误: {str(e)}")
+                    errors.append(f"{provider.name}: {str(e)}")
+                    continue
+                if winner is None:
+                    winner = response
+                    print(f"TTS服务: {provider.name}")
+                else:
+                    response.close()
+
+            if winner is not None:
+                # 落选的请求返回后直接关闭，不读取正文
+                for future in pending:
+                    future.add_done_callback(_close_response)
+                return winner
+
+            if not pending:
+                launch("回退到")
+
+        raise Exception("所有TTS服务均失败: " + "; ".join(errors))
+
+    def status(self) -> dict:
+        """各服务的熔断状态和按声音统计的延迟/错误率"""
+        with self._lock:
+            items = list(self._stats.items())
+        status = {provider.name: {"breaker": provider.breaker.status(), "voices": {}} for provider in self.providers}
+        for (name, voice), stats in items:
+            status[name]["voices"][voice] = stats.snapshot()
+        return status
+
+
+def _close_response(future):
+    if not future.cancelled() and future.exception() is None:
+        future.result().close()